@@ -0,0 +1,78 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Compare the wall time of generating the simulator certificate chain with serial and
+with pregenerated (process pool) key pairs, for each certificate engine.
+
+    python benchmarks/bench_certgen.py [--rounds N]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from iotedgehubdev.certutils import EdgeCertUtil  # noqa: E402
+from iotedgehubdev.constants import EdgeConstants as EC  # noqa: E402
+from iotedgehubdev.cryptocertutils import CryptographyEdgeCertUtil  # noqa: E402
+
+ENGINES = [('pyopenssl', EdgeCertUtil), ('cryptography', CryptographyEdgeCertUtil)]
+
+
+def generate_chain(cert_util_class, certs_dir, pregenerate):
+    cert_util = cert_util_class()
+    if pregenerate:
+        cert_util.pregenerate_key_pairs({
+            EC.EDGE_DEVICE_CA: (EdgeCertUtil.TYPE_RSA, EdgeCertUtil.CA_KEY_LEN),
+            EC.EDGE_AGENT_CA: (EdgeCertUtil.TYPE_RSA, EdgeCertUtil.CA_KEY_LEN),
+            EC.EDGE_HUB_SERVER: (EdgeCertUtil.TYPE_RSA, EdgeCertUtil.SERVER_KEY_LEN)
+        })
+    cert_util.create_root_ca_cert(EC.EDGE_DEVICE_CA, subject_dict=EC.CERT_DEFAULT_DICT)
+    cert_util.create_intermediate_ca_cert(EC.EDGE_AGENT_CA, EC.EDGE_DEVICE_CA,
+                                          common_name='Edge Agent CA', set_terminal_ca=False)
+    cert_util.create_server_cert(EC.EDGE_HUB_SERVER, EC.EDGE_AGENT_CA, hostname='benchmark')
+    export_start = time.perf_counter()
+    for id_str in [EC.EDGE_DEVICE_CA, EC.EDGE_AGENT_CA, EC.EDGE_HUB_SERVER]:
+        cert_util.export_simulator_cert_artifacts_to_dir(id_str, certs_dir)
+    cert_util.export_pfx_cert(EC.EDGE_HUB_SERVER, certs_dir)
+    return time.perf_counter() - export_start
+
+
+def measure(cert_util_class, rounds, pregenerate):
+    timings = []
+    export_timings = []
+    for _ in range(rounds):
+        certs_dir = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            export_timings.append(generate_chain(cert_util_class, certs_dir, pregenerate))
+            timings.append(time.perf_counter() - start)
+        finally:
+            shutil.rmtree(certs_dir, ignore_errors=True)
+    return timings, export_timings
+
+
+def report(name, result):
+    timings, export_timings = result
+    print('{0:<26} min {1:7.3f}s  avg {2:7.3f}s  max {3:7.3f}s  export avg {4:7.4f}s'.format(
+        name, min(timings), sum(timings) / len(timings), max(timings), sum(export_timings) / len(export_timings)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    print('CPU count: {0}, rounds: {1}'.format(os.cpu_count(), args.rounds))
+    for engine, cert_util_class in ENGINES:
+        report('{0} serial'.format(engine), measure(cert_util_class, args.rounds, False))
+        report('{0} pregenerate'.format(engine), measure(cert_util_class, args.rounds, True))
+
+
+if __name__ == '__main__':
+    main()
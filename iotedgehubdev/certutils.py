@@ -3,9 +3,14 @@
 
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
 from OpenSSL import crypto
 from shutil import copy2
 from datetime import datetime
+from . import tracing
 from .errors import EdgeFileAccessError, EdgeInvalidArgument, EdgeValueError
 from .constants import EdgeConstants as EC
 from .utils import Utils
@@ -14,6 +19,11 @@ from .utils import Utils
 class EdgeCertUtil(object):
 
     TYPE_RSA = 0
+    TYPE_EC = 1
+    KEY_ALGORITHM_RSA = 'rsa'
+    KEY_ALGORITHM_ECDSA_P256 = 'ecdsa-p256'
+    KEY_ALGORITHM_ECDSA_P384 = 'ecdsa-p384'
+    KEY_ALGORITHMS = [KEY_ALGORITHM_RSA, KEY_ALGORITHM_ECDSA_P256, KEY_ALGORITHM_ECDSA_P384]
     MIN_VALIDITY_DAYS = 1
     MAX_VALIDITY_DAYS = 1095  # 3 years
     MIN_PASSPHRASE_LENGTH = 4
@@ -25,6 +35,8 @@ class EdgeCertUtil(object):
     MAX_COMMON_NAME_LEN = 64
     DIGEST = 'sha256'
     _type_dict = {TYPE_RSA: crypto.TYPE_RSA}
+    _ec_curve_dict = {256: ec.SECP256R1, 384: ec.SECP384R1}
+    _ec_key_algorithm_dict = {KEY_ALGORITHM_ECDSA_P256: 256, KEY_ALGORITHM_ECDSA_P384: 384}
     _subject_validation_dict = {
         EC.SUBJECT_COUNTRY_KEY: {'MIN': 2, 'MAX': 2},
         EC.SUBJECT_STATE_KEY: {'MIN': 0, 'MAX': 128},
@@ -35,9 +47,44 @@ class EdgeCertUtil(object):
                                      'MAX': MAX_COMMON_NAME_LEN}
     }
 
-    def __init__(self, serial_num=1000):
+    def __init__(self, serial_num=1000, key_pool=None):
         self._cert_chain = {}
         self._serial_number = serial_num
+        self._pregenerated_key_pairs = {}
+        self._key_pool = key_pool
+
+    @tracing.traced('certutils.pregenerate_key_pairs')
+    def pregenerate_key_pairs(self, key_specs, max_workers=None):
+        """Generate the private keys of a certificate chain concurrently, ahead of signing.
+
+        key_specs maps a certificate ID to a (private_key_type, key_bit_len) tuple. The create_*
+        methods pick up the pregenerated key of the ID they are asked to create. max_workers
+        defaults to the number of CPUs.
+        """
+        pending = []
+        for id_str, spec in key_specs.items():
+            if id_str in self._pregenerated_key_pairs:
+                continue
+            key_pair = self._take_pool_key_pair(spec)
+            if key_pair is not None:
+                self._pregenerated_key_pairs[id_str] = key_pair
+            else:
+                pending.append((id_str, spec))
+        workers = min(len(pending), max_workers or os.cpu_count() or 1)
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [(id_str, executor.submit(generate_private_key_pem, *spec)) for id_str, spec in pending]
+                    for id_str, future in futures:
+                        self._pregenerated_key_pairs[id_str] = self._load_private_key_pem(future.result())
+                return
+            except (OSError, NotImplementedError, BrokenProcessPool):
+                # Process pools are not available everywhere, fall back to generating the keys serially
+                pass
+
+        for id_str, spec in pending:
+            if id_str not in self._pregenerated_key_pairs:
+                self._pregenerated_key_pairs[id_str] = self._create_key_pair(*spec)
 
     def create_root_ca_cert(self, id_str, **kwargs):
         if id_str in list(self._cert_chain.keys()):
@@ -55,9 +102,9 @@ class EdgeCertUtil(object):
             msg = 'Certificate subject dictionary is required'
             raise EdgeValueError(msg)
         passphrase = self._get_kwargs_passphrase(**kwargs)
+        key_type, key_len = self._get_kwargs_key_spec(EdgeCertUtil.CA_KEY_LEN, **kwargs)
 
-        key_obj = self._create_key_pair(EdgeCertUtil.TYPE_RSA,
-                                        EdgeCertUtil.CA_KEY_LEN)
+        key_obj = self._get_key_pair(id_str, key_type, key_len)
         csr_obj = self._create_csr(key_obj,
                                    C=subj_dict[EC.SUBJECT_COUNTRY_KEY],
                                    ST=subj_dict[EC.SUBJECT_STATE_KEY],
@@ -92,6 +139,7 @@ class EdgeCertUtil(object):
 
         validity_days_from_now = self._get_kwargs_validity(**kwargs)
         passphrase = self._get_kwargs_passphrase(**kwargs)
+        key_type, key_len = self._get_kwargs_key_spec(EdgeCertUtil.CA_KEY_LEN, **kwargs)
 
         min_length = self._subject_validation_dict[EC.SUBJECT_COMMON_NAME_KEY]['MIN']
         max_length = self._subject_validation_dict[EC.SUBJECT_COMMON_NAME_KEY]['MAX']
@@ -108,19 +156,15 @@ class EdgeCertUtil(object):
             issuer_cert_dict = self._cert_chain[issuer_id_str]
             issuer_cert = issuer_cert_dict['cert']
 
-            not_after_ts = issuer_cert.get_notAfter()
+            not_after_ts = self._get_not_after(issuer_cert)
             valid_days = self._get_maximum_validity_days(not_after_ts,
                                                          validity_days_from_now)
 
             issuer_key = issuer_cert_dict['key_pair']
-            key_obj = self._create_key_pair(EdgeCertUtil.TYPE_RSA, EdgeCertUtil.CA_KEY_LEN)
-            csr_obj = self._create_csr(key_obj,
-                                       C=issuer_cert.get_subject().countryName,
-                                       ST=issuer_cert.get_subject().stateOrProvinceName,
-                                       L=issuer_cert.get_subject().localityName,
-                                       O=issuer_cert.get_subject().organizationName,
-                                       OU=issuer_cert.get_subject().organizationalUnitName,
-                                       CN=common_name)
+            key_obj = self._get_key_pair(id_str, key_type, key_len)
+            subject = self._get_subject_fields(issuer_cert)
+            subject['CN'] = common_name
+            csr_obj = self._create_csr(key_obj, **subject)
 
             validity_secs_from_now = valid_days * 24 * 60 * 60
             cert_obj = self._create_ca_cert(csr_obj,
@@ -152,6 +196,7 @@ class EdgeCertUtil(object):
         validity_days_from_now = self._get_kwargs_validity(**kwargs)
 
         passphrase = self._get_kwargs_passphrase(**kwargs)
+        key_type, key_len = self._get_kwargs_key_spec(EdgeCertUtil.SERVER_KEY_LEN, **kwargs)
 
         max_length = self._subject_validation_dict[EC.SUBJECT_COMMON_NAME_KEY]['MAX']
         hostname = kwargs.get('hostname', None)
@@ -165,15 +210,11 @@ class EdgeCertUtil(object):
             issuer_cert_dict = self._cert_chain[issuer_id_str]
             issuer_cert = issuer_cert_dict['cert']
             issuer_key = issuer_cert_dict['key_pair']
-            key_obj = self._create_key_pair(EdgeCertUtil.TYPE_RSA, EdgeCertUtil.SERVER_KEY_LEN)
-            csr_obj = self._create_csr(key_obj,
-                                       C=issuer_cert.get_subject().countryName,
-                                       ST=issuer_cert.get_subject().stateOrProvinceName,
-                                       L=issuer_cert.get_subject().localityName,
-                                       O=issuer_cert.get_subject().organizationName,
-                                       OU=issuer_cert.get_subject().organizationalUnitName,
-                                       CN=common_name)
-            not_after_ts = issuer_cert.get_notAfter()
+            key_obj = self._get_key_pair(id_str, key_type, key_len)
+            subject = self._get_subject_fields(issuer_cert)
+            subject['CN'] = common_name
+            csr_obj = self._create_csr(key_obj, **subject)
+            not_after_ts = self._get_not_after(issuer_cert)
             valid_days = self._get_maximum_validity_days(not_after_ts,
                                                          validity_days_from_now)
             validity_secs_from_now = valid_days * 24 * 60 * 60
@@ -203,22 +244,30 @@ class EdgeCertUtil(object):
             cert_dict = self._cert_chain[id_str]
             cert_obj = cert_dict['cert']
             key_obj = cert_dict['key_pair']
-            pfx = crypto.PKCS12()
-            pfx.set_privatekey(key_obj)
-            pfx.set_certificate(cert_obj)
-            pfx_data = pfx.export()
+            pfx_data = self._serialize_pfx(cert_obj, key_obj)
             prefix = id_str
             path = os.path.realpath(dir_path)
             path = os.path.join(path, prefix)
             cert_dir = os.path.join(path, 'cert')
             pfx_output_file_name = os.path.join(cert_dir, prefix + EC.PFX_SUFFIX)
-            with open(pfx_output_file_name, 'wb') as pfx_file:
-                pfx_file.write(pfx_data)
+            Utils.write_file_atomic(pfx_output_file_name, pfx_data)
         except IOError as ex:
             msg = 'IO Error when exporting PFX cert ID: {0}.' \
                   ' Errno: {1} Error: {2}'.format(id_str, str(ex.errno), ex.strerror)
             raise EdgeFileAccessError(msg, pfx_output_file_name)
 
+    @staticmethod
+    def get_key_spec(key_algorithm, rsa_key_bit_len):
+        """Map a key algorithm name to the (private_key_type, key_bit_len) tuple of a certificate.
+        rsa_key_bit_len is the key length used for RSA, EC keys use the size of their curve."""
+        if key_algorithm == EdgeCertUtil.KEY_ALGORITHM_RSA:
+            return (EdgeCertUtil.TYPE_RSA, rsa_key_bit_len)
+        if key_algorithm in EdgeCertUtil._ec_key_algorithm_dict:
+            return (EdgeCertUtil.TYPE_EC, EdgeCertUtil._ec_key_algorithm_dict[key_algorithm])
+        msg = 'Unsupported key algorithm: {0}. Supported algorithms: {1}'.format(
+            key_algorithm, ', '.join(EdgeCertUtil.KEY_ALGORITHMS))
+        raise EdgeValueError(msg)
+
     @staticmethod
     def get_cert_file_path(id_str, dir_path):
         return os.path.join(dir_path, id_str, 'cert', id_str + EC.CERT_SUFFIX)
@@ -236,14 +285,14 @@ class EdgeCertUtil(object):
         try:
             with open(cert_path, 'r') as cert_file:
                 cert_content = cert_file.read()
-                cert_dict['cert'] = crypto.load_certificate(crypto.FILETYPE_PEM, cert_content)
+                cert_dict['cert'] = self._load_certificate_pem(cert_content)
         except Exception as ex:
             raise EdgeInvalidArgument('Failed to load cert from %s. Error: %s' % (cert_path, ex), ex)
         # Load key
         try:
             with open(key_path, 'r') as key_file:
                 key_content = key_file.read()
-                cert_dict['key_pair'] = crypto.load_privatekey(crypto.FILETYPE_PEM, key_content, key_passphrase)
+                cert_dict['key_pair'] = self._load_private_key_pem(key_content, key_passphrase)
         except Exception as ex:
             raise EdgeInvalidArgument(
                 'Failed to load private key from %s. Please check your passphase first. Error: %s' % (key_path, ex), ex)
@@ -327,6 +376,23 @@ class EdgeCertUtil(object):
         chain_path = cert_files[EC.CHAIN_CERT_SUFFIX]
         self._chain_ca_certs(chain_path, id_strs, certs_dir, self._device_ca_cert_file_path_gen)
 
+    def export_device_ca_artifacts_with_chain(self, id_str, issuer_id_str, output_prefix, dir_path):
+        """Export the cert, key and chain of id_str to dir_path with files named after output_prefix.
+        The chain is written from the certs in memory, so the issuer does not need to be exported first."""
+        output_files = Utils.get_device_ca_file_paths(dir_path, output_prefix)
+        cert_dict = self._get_cert_dict(id_str)
+        self._dump_cert_content(cert_dict, output_files[EC.CERT_SUFFIX])
+        self._dump_cert_key(cert_dict, output_files[EC.KEY_SUFFIX])
+        chain_path = output_files[EC.CHAIN_CERT_SUFFIX]
+        try:
+            Utils.write_file_atomic(chain_path, b''.join(
+                self._serialize_certificate_pem(self._get_cert_dict(chain_id_str)['cert'])
+                for chain_id_str in [id_str, issuer_id_str]))
+        except IOError as ex:
+            msg = 'IO Error when creating chain cert: {0}.' \
+                  ' Errno: {1} Error: {2}'.format(chain_path, str(ex.errno), ex.strerror)
+            raise EdgeFileAccessError(msg, chain_path)
+
     def is_valid_certificate_subject(self, subject_dict):
         result = True
         for key in list(EdgeCertUtil._subject_validation_dict.keys()):
@@ -347,6 +413,41 @@ class EdgeCertUtil(object):
                 break
         return result
 
+    # The methods below wrap the crypto library. Subclasses override them to use another engine,
+    # everything else in this class only handles the returned objects opaquely.
+
+    def _load_certificate_pem(self, cert_pem):
+        return crypto.load_certificate(crypto.FILETYPE_PEM, cert_pem)
+
+    def _load_private_key_pem(self, key_pem, passphrase=None):
+        return crypto.load_privatekey(crypto.FILETYPE_PEM, key_pem, passphrase)
+
+    def _serialize_certificate_pem(self, cert):
+        return crypto.dump_certificate(crypto.FILETYPE_PEM, cert)
+
+    def _serialize_private_key_pem(self, key_pair, passphrase=None):
+        cipher = 'aes256' if passphrase else None
+        return crypto.dump_privatekey(crypto.FILETYPE_PEM, key_pair, cipher=cipher, passphrase=passphrase)
+
+    def _serialize_pfx(self, cert, key_pair):
+        pfx = crypto.PKCS12()
+        pfx.set_privatekey(key_pair)
+        pfx.set_certificate(cert)
+        return pfx.export()
+
+    def _get_subject_fields(self, cert):
+        subject = cert.get_subject()
+        return {
+            'C': subject.countryName,
+            'ST': subject.stateOrProvinceName,
+            'L': subject.localityName,
+            'O': subject.organizationName,
+            'OU': subject.organizationalUnitName
+        }
+
+    def _get_not_after(self, cert):
+        return cert.get_notAfter()
+
     def _create_csr(self, key_pair, **kwargs):
         csr = crypto.X509Req()
         subj = csr.get_subject()
@@ -426,11 +527,35 @@ class EdgeCertUtil(object):
         cert.sign(issuer_key_pair, EdgeCertUtil.DIGEST)
         return cert
 
-    def _create_key_pair(self, private_key_type, key_bit_len):
+    @staticmethod
+    def _create_key_pair(private_key_type, key_bit_len):
+        if private_key_type == EdgeCertUtil.TYPE_EC:
+            private_key = ec.generate_private_key(EdgeCertUtil._ec_curve_dict[key_bit_len]())
+            # PKey.from_cryptography_key does not accept EC keys, hand the key over as DER instead
+            der = private_key.private_bytes(serialization.Encoding.DER,
+                                            serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+            return crypto.load_privatekey(crypto.FILETYPE_ASN1, der)
         key_pair = crypto.PKey()
         key_pair.generate_key(EdgeCertUtil._type_dict[private_key_type], key_bit_len)
         return key_pair
 
+    def _get_key_pair(self, id_str, private_key_type, key_bit_len):
+        key_pair = self._pregenerated_key_pairs.pop(id_str, None)
+        if key_pair is None:
+            key_pair = self._take_pool_key_pair((private_key_type, key_bit_len))
+        if key_pair is None:
+            key_pair = self._create_key_pair(private_key_type, key_bit_len)
+        return key_pair
+
+    def _take_pool_key_pair(self, key_spec):
+        if self._key_pool is None:
+            return None
+        key_pem = self._key_pool.take(key_spec)
+        if key_pem is None:
+            return None
+        return self._load_private_key_pem(key_pem)
+
     def _get_maximum_validity_days(self, not_after_ts_asn1, validity_days_from_now):
         result = 0
         try:
@@ -480,6 +605,12 @@ class EdgeCertUtil(object):
                 raise EdgeValueError(msg)
         return passphrase
 
+    def _get_kwargs_key_spec(self, rsa_key_bit_len, **kwargs):
+        key_algorithm = kwargs.get('key_algorithm')
+        if key_algorithm is None:
+            key_algorithm = EdgeCertUtil.KEY_ALGORITHM_RSA
+        return EdgeCertUtil.get_key_spec(key_algorithm, rsa_key_bit_len)
+
     def _get_kwargs_string(self, kwarg_key, min_length, max_length, default_str=None, **kwargs):
         result_str = default_str
         if kwarg_key in kwargs:
@@ -496,9 +627,7 @@ class EdgeCertUtil(object):
         Utils.mkdir_if_needed(os.path.dirname(output_path))
         cert_obj = cert_dict['cert']
         try:
-            with open(output_path, 'w') as output_file:
-                output_file.write(crypto.dump_certificate(crypto.FILETYPE_PEM,
-                                                          cert_obj).decode('utf-8'))
+            Utils.write_file_atomic(output_path, self._serialize_certificate_pem(cert_obj).decode('utf-8'))
         except IOError as ex:
             msg = 'IO Error when exporting certs.\n' \
                   ' Error seen when exporting file {0}.' \
@@ -517,14 +646,8 @@ class EdgeCertUtil(object):
                 passphrase = None
                 if key_passphrase and key_passphrase != '':
                     passphrase = key_passphrase.encode('utf-8')
-                cipher = None
-                if passphrase:
-                    cipher = 'aes256'
-                with open(output_path, 'w') as output_file:
-                    output_file.write(crypto.dump_privatekey(crypto.FILETYPE_PEM,
-                                                             key_obj,
-                                                             cipher=cipher,
-                                                             passphrase=passphrase).decode('utf-8'))
+                Utils.write_file_atomic(output_path,
+                                        self._serialize_private_key_pem(key_obj, passphrase).decode('utf-8'))
         except IOError as ex:
             msg = 'IO Error when exporting certs.\n' \
                   ' Error seen when exporting file {0}.' \
@@ -565,3 +688,9 @@ class EdgeCertUtil(object):
 
     def _device_ca_cert_file_path_gen(self, id_str, cert_file_name, certs_dir):
         return os.path.join(certs_dir, cert_file_name)
+
+
+def generate_private_key_pem(private_key_type, key_bit_len):
+    # Used by worker processes. PKey objects cannot be pickled, so the key is handed back as PEM.
+    key_pair = EdgeCertUtil._create_key_pair(private_key_type, key_bit_len)
+    return crypto.dump_privatekey(crypto.FILETYPE_PEM, key_pair)
@@ -6,18 +6,31 @@ import json
 import os
 import sys
 import re
+import time
 from functools import wraps
 
 import click
+import requests
 
-from . import configs, decorators, telemetry
+from . import configs, daemon, decorators, filelock, metrics, telemetry, tracing
+from .certutils import EdgeCertUtil
 from .constants import EdgeConstants
 from .edgecert import EdgeCert
 from .edgemanager import EdgeManager
 from .hostplatform import HostPlatform
+from .instance import EdgeInstance
+from .edgedockerclient import EdgeDockerClient
+from .edgehubmetrics import EdgeHubMetrics
+from .keypool import KeyPool
+from .latencyprobe import LatencyProbe
+from .loadgen import LoadGenerator
+from .logstreamer import LogStreamer
 from .output import Output
+from .resourcesampler import ResourceSampler, format_bytes
+from .taskgraph import TaskGraph
 from .utils import Utils
-from .errors import EdgeError, InvalidConfigError
+from .errors import EdgeError, InvalidConfigError, RegistriesLoginError
+from .filewatcher import FileWatcher
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'], max_content_width=120)
 output = Output()
@@ -27,9 +40,10 @@ CERT_PATH = 'certPath'
 GATEWAY_HOST = 'gatewayhost'
 DOCKER_HOST = 'DOCKER_HOST'
 HUB_CONN_STR = 'iothubConnectionString'
+DEFAULT_INPUT_PORT = 53000
 
 # a set of parameters whose value should be logged as given
-PARAMS_WITH_VALUES = {'edge_runtime_version'}
+PARAMS_WITH_VALUES = {'edge_runtime_version', 'key_algorithm', 'cert_engine'}
 
 @decorators.suppress_all_exceptions()
 def _parse_params(*args, **kwargs):
@@ -55,7 +69,8 @@ def _with_telemetry(func):
         params = _parse_params(*args, **kwargs)
         telemetry.start(func.__name__, params)
         try:
-            value = func(*args, **kwargs)
+            with tracing.span('command.{0}'.format(func.__name__)):
+                value = func(*args, **kwargs)
             telemetry.success()
             telemetry.flush()
             return value
@@ -69,9 +84,14 @@ def _with_telemetry(func):
     return _wrapper
 
 
-def _parse_config_json():
+def _parse_config_json(edge_instance=None):
+    if edge_instance is None:
+        edge_instance = EdgeInstance()
     try:
-        config_file = HostPlatform.get_config_file_path()
+        config_file = edge_instance.get_config_file_path()
+        if not edge_instance.is_default and not Utils.check_if_file_exists(config_file):
+            # Instances without their own setup share the device of the default one
+            config_file = HostPlatform.get_config_file_path()
 
         if not Utils.check_if_file_exists(config_file):
             raise ValueError('Cannot find config file. Please run `{0}` first.'.format(_get_setup_command()))
@@ -84,7 +104,7 @@ def _parse_config_json():
                 cert_path = config_json[CERT_PATH]
                 gatewayhost = config_json[GATEWAY_HOST]
                 hub_conn_str = config_json.get(HUB_CONN_STR)
-                return EdgeManager(connection_str, gatewayhost, cert_path, hub_conn_str)
+                return EdgeManager(connection_str, gatewayhost, cert_path, hub_conn_str, edge_instance)
 
             except (ValueError, KeyError):
                 raise ValueError('Invalid config file. Please run `{0}` again.'.format(_get_setup_command()))
@@ -96,14 +116,217 @@ def _get_setup_command():
     return 'iotedgehubdev setup -c "<edge-device-connection-string>"'
 
 
+def _output_instance_ports(edge_instance):
+    if edge_instance.is_default:
+        return
+    for container, ports in sorted(edge_instance.load_state().get('ports', {}).items()):
+        output.info('{0} ports: {1}'.format(container, ', '.join(
+            '{0} -> {1}'.format(host_port, container_port) for container_port, host_port in sorted(ports.items()))))
+
+
+def _get_input_port(edge_instance, port):
+    if port is not None:
+        return port
+    ports = edge_instance.load_state().get('ports', {}).get(edge_instance.get_resource_name(EdgeManager.INPUT), {})
+    return ports.get('3000', DEFAULT_INPUT_PORT)
+
+
+def _get_input_ports(edge_instance, port):
+    # The ports of all the input producers, unless a port is given
+    if port is not None:
+        return [port]
+    state = edge_instance.load_state()
+    ports = [state.get('ports', {}).get(producer, {}).get('3000') for producer in state.get('producers', [])]
+    return [producer_port for producer_port in ports if producer_port is not None] or [_get_input_port(edge_instance, None)]
+
+
+def _get_metrics_port(edge_instance, port):
+    if port is not None:
+        return port
+    ports = edge_instance.load_state().get('ports', {})
+    # Single module mode records the container name, solution mode the service name
+    for hub_name in [edge_instance.get_resource_name(EdgeManager.EDGEHUB), EdgeManager.EDGEHUB]:
+        hub_ports = ports.get(hub_name, {})
+        for container_port in [str(EdgeHubMetrics.CONTAINER_PORT), '{0}/tcp'.format(EdgeHubMetrics.CONTAINER_PORT)]:
+            if container_port in hub_ports:
+                return hub_ports[container_port]
+    if edge_instance.load_state().get('hostNetwork'):
+        # edgeHub shares the network of the host, so nothing is published
+        return EdgeHubMetrics.CONTAINER_PORT
+    return None
+
+
+def _connect_daemon(host):
+    # The daemon works against the Docker host it was started with, so a command for another one runs here
+    return daemon.connect(docker_host=host if host is not None else os.environ.get(DOCKER_HOST))
+
+
+def _get_network_options(network_mtu, network_opt, network_ipv6, network_internal, host_network):
+    driver_opts = {}
+    for option in network_opt:
+        if re.match(r'^[^=\s]+=.*$', option) is None:
+            raise ValueError('Network option: `{0}` is not valid. Use KEY=VALUE.'.format(option))
+        key, value = option.split('=', 1)
+        driver_opts[key] = value
+    return {
+        'mtu': network_mtu,
+        'driverOpts': driver_opts,
+        'ipv6': network_ipv6,
+        'internal': network_internal,
+        'hostNetwork': host_network
+    }
+
+
+def _output_metrics_url(edge_instance, metrics_port):
+    if metrics_port is None:
+        return
+    output.info('edgeHub metrics are published on {0}. Run `iotedgehubdev metrics{1}` to collect them.'.format(
+        EdgeHubMetrics.get_metrics_url(_get_metrics_port(edge_instance, None)),
+        '' if edge_instance.is_default else ' --instance {0}'.format(edge_instance.name)))
+
+
+def _write_chunks(file_path, chunks):
+    # Write next to the target and rename, so an interrupted save leaves no truncated file behind
+    partial_path = file_path + '.partial'
+    size = 0
+    try:
+        with open(partial_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(partial_path, file_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return size
+
+
+def _load_module_content(deployment):
+    with open(deployment) as json_file:
+        json_data = json.load(json_file)
+        if 'modulesContent' in json_data:
+            return json_data['modulesContent']
+        elif 'moduleContent' in json_data:
+            return json_data['moduleContent']
+    raise ValueError('Deployment manifest `{0}` has no modulesContent.'.format(deployment))
+
+
+def _watch_deployment(edge_manager, deployment, module_content):
+    watcher = FileWatcher(deployment)
+    # Reapplying a deployment should not fetch the credentials of every module again
+    edge_manager.cache_credentials(daemon.CREDENTIAL_TTL)
+    output.info('Watching {0} for changes{1}. Press Ctrl+C to stop watching, the simulator keeps running.'.format(
+        deployment, '' if watcher.uses_inotify else ' by polling'))
+    edgedockerclient = EdgeDockerClient()
+    try:
+        while True:
+            watcher.wait_for_change()
+            start_time = time.time()
+            try:
+                new_module_content = _load_module_content(deployment)
+            except (IOError, ValueError) as e:
+                output.warning('Skipped the changes to the deployment manifest, it is not valid: {0}'.format(e))
+                continue
+            try:
+                changes = edge_manager.apply_solution_changes(module_content, new_module_content, output,
+                                                              edgedockerclient)
+            except Exception as e:
+                output.error('Failed to apply the changes to the deployment manifest: {0}. '
+                             'Run `iotedgehubdev start` again if the simulator is left inconsistent.'.format(e))
+                continue
+            module_content = new_module_content
+            output.info(_format_solution_changes(changes, time.time() - start_time))
+    except KeyboardInterrupt:
+        output.info('Stopped watching {0}.'.format(deployment))
+    finally:
+        watcher.close()
+
+
+def _format_solution_changes(changes, elapsed):
+    applied = []
+    if changes['recreate']:
+        applied.append('recreated {0}'.format(', '.join(changes['recreate'])))
+    if changes['remove']:
+        applied.append('removed {0}'.format(', '.join(changes['remove'])))
+    if changes['twins']:
+        applied.append('updated the twin of {0}'.format(', '.join(changes['twins'])))
+    if not applied:
+        return 'No changes to apply to the running solution.'
+    return 'Applied the deployment changes in {0:.1f}s: {1}.'.format(elapsed, '; '.join(applied))
+
+
+def _report_trace(timings, trace_file):
+    session = tracing.stop()
+    if session is None:
+        return
+    if timings:
+        output.line()
+        for line in session.format_summary():
+            output.echo(line)
+    if trace_file is not None:
+        session.write_chrome_trace(trace_file)
+        output.info('Trace written to {0}. Load it in chrome://tracing or https://ui.perfetto.dev.'.format(
+            os.path.abspath(trace_file)))
+
+
+def _report_stats(stats, stats_file):
+    registry = metrics.get_registry()
+    if stats:
+        output.line()
+        for line in registry.format_summary():
+            output.echo(line)
+    if stats_file is not None:
+        with open(stats_file, 'w') as f:
+            json.dump(registry.snapshot(), f, indent=2)
+        output.info('Stats written to {0}.'.format(os.path.abspath(stats_file)))
+
+
+_instance_option = click.option(
+    '--instance',
+    required=False,
+    help='Name of the simulator instance. Each instance has its own Docker resources, host ports and state, '
+         'so several instances can run side by side on one Docker host.')
+
+
 @click.group(context_settings=CONTEXT_SETTINGS, invoke_without_command=True)
 @click.version_option()
-def main():
+@click.option('--timings',
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Print the time spent in each phase of the command when it finishes.')
+@click.option('--trace-file',
+              required=False,
+              help='Write the phases of the command to this file in Chrome trace event format.')
+@click.option('--stats',
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Print call counts and latencies of the Docker and IoT Hub operations when the command finishes.')
+@click.option('--stats-file',
+              required=False,
+              help='Write call counts and latency histograms of the Docker and IoT Hub operations to this JSON file.')
+@click.option('--lock-timeout',
+              required=False,
+              default=filelock.DEFAULT_TIMEOUT,
+              show_default=True,
+              type=click.IntRange(min=0),
+              help='Seconds to wait for other iotedgehubdev processes to release the simulator config, certificates '
+                   'and containers before giving up.')
+def main(timings, trace_file, stats, stats_file, lock_timeout):
     ctx = click.get_current_context()
     if ctx.invoked_subcommand is None:
         click.echo(ctx.get_help())
         sys.exit(0)
 
+    if timings or trace_file is not None:
+        tracing.start()
+        ctx.call_on_close(lambda: _report_trace(timings, trace_file))
+    if stats or stats_file is not None:
+        ctx.call_on_close(lambda: _report_stats(stats, stats_file))
+    filelock.set_default_timeout(lock_timeout)
+
 
 @click.command(context_settings=CONTEXT_SETTINGS,
                help='Setup the IoT Edge Simulator. This must be done before starting.')
@@ -121,11 +344,29 @@ def main():
               '-i',
               required=False,
               help='Set Azure IoT Hub connection string. Note: Use double quotes when supplying this input.')
+@click.option('--key-algorithm',
+              '-a',
+              required=False,
+              default=EdgeCertUtil.KEY_ALGORITHM_RSA,
+              show_default=True,
+              type=click.Choice(EdgeCertUtil.KEY_ALGORITHMS),
+              help='Key algorithm of the simulator certificates. ECDSA keys are much faster to generate and to handshake with.')
+@click.option('--cert-engine',
+              required=False,
+              default=EdgeCert.ENGINE_PYOPENSSL,
+              show_default=True,
+              type=click.Choice(EdgeCert.ENGINES),
+              help='Library used to generate the simulator certificates.')
+@click.option('--instance',
+              required=False,
+              help='Name of the simulator instance to set up with its own connection string and certificates. '
+                   'Instances that are not set up use the default setup.')
 @_with_telemetry
-def setup(connection_string, gateway_host, iothub_connection_string):
+def setup(connection_string, gateway_host, iothub_connection_string, key_algorithm, cert_engine, instance):
     try:
+        edge_instance = EdgeInstance(instance)
         gateway_host = gateway_host.lower()
-        certDir = HostPlatform.get_default_cert_path()
+        certDir = edge_instance.get_cert_path()
         Utils.parse_connection_strs(connection_string, iothub_connection_string)
         if iothub_connection_string is None:
             configDict = {
@@ -142,22 +383,22 @@ def setup(connection_string, gateway_host, iothub_connection_string):
             }
 
         fileType = 'edgehub.config'
-        Utils.mkdir_if_needed(certDir)
-        edgeCert = EdgeCert(certDir, gateway_host)
-        edgeCert.generate_self_signed_certs()
-        configFile = HostPlatform.get_config_file_path()
-        Utils.delete_file(configFile, fileType)
-        Utils.mkdir_if_needed(HostPlatform.get_config_path())
-        configJson = json.dumps(configDict, indent=2, sort_keys=True)
-        Utils.create_file(configFile, configJson, fileType)
-
-        dataDir = HostPlatform.get_share_data_path()
+        configFile = edge_instance.get_config_file_path()
+        with filelock.lock_for(configFile, 'config'), filelock.lock_for(certDir, 'certificates'):
+            Utils.mkdir_if_needed(certDir)
+            edgeCert = EdgeCert(certDir, gateway_host, key_algorithm, engine=cert_engine)
+            edgeCert.generate_self_signed_certs()
+            Utils.mkdir_if_needed(os.path.dirname(configFile))
+            configJson = json.dumps(configDict, indent=2, sort_keys=True)
+            Utils.create_file(configFile, configJson, fileType)
+
+        dataDir = edge_instance.get_data_path()
         Utils.mkdir_if_needed(dataDir)
         os.chmod(dataDir, 0o755)
 
-        with open(EdgeManager.COMPOSE_FILE, 'w') as f:
-            f.write('version: \'3.6\'')
-        os.chmod(EdgeManager.COMPOSE_FILE, 0o777)
+        composeFile = edge_instance.get_compose_file_path()
+        with edge_instance.get_runtime_lock():
+            Utils.write_file_atomic(composeFile, 'version: \'3.6\'', 0o777)
         output.info('Setup IoT Edge Simulator successfully.')
     except Exception as e:
         raise e
@@ -186,12 +427,21 @@ def setup(connection_string, gateway_host, iothub_connection_string):
               required=False,
               show_default=True,
               help='Specify the output file to save the connection string. If the file exists, the content will be overwritten.')
+@_instance_option
 @_with_telemetry
-def modulecred(modules, local, output_file):
-    edge_manager = _parse_config_json()
+def modulecred(modules, local, output_file, instance):
+    modules = [module.strip() for module in modules.strip().split('|')]
+    daemon_client = daemon.connect()
+    if daemon_client is not None:
+        credential = daemon_client.call('modulecred', instance=instance, modules=modules, local=local,
+                                        output_file=None if output_file is None else os.path.abspath(output_file))
+        output.info(credential[0])
+        output.info(credential[1])
+        return
+
+    edge_manager = _parse_config_json(EdgeInstance(instance))
 
     if edge_manager:
-        modules = [module.strip() for module in modules.strip().split('|')]
         credential = edge_manager.outputModuleCred(modules, local, output_file)
         output.info(credential[0])
         output.info(credential[1])
@@ -207,9 +457,9 @@ def modulecred(modules, local, output_file):
 @click.option('--port',
               '-p',
               required=False,
-              default=53000,
-              show_default=True,
-              help='Port of the service for sending message.')
+              type=int,
+              help='Port of the service for sending message. Defaults to {0}, or a free port for a named instance.'.format(
+                  DEFAULT_INPUT_PORT))
 @click.option('--deployment',
               '-d',
               required=False,
@@ -220,7 +470,16 @@ def modulecred(modules, local, output_file):
               is_flag=True,
               default=False,
               show_default=True,
-              help='Show the solution container logs.')
+              help='Show the solution container logs, or the timeline of the start steps in single module mode.')
+@click.option('--watch',
+              '-w',
+              required=False,
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Keep watching the deployment manifest in solution mode and apply its changes as it is saved. '
+                   'Only the modules whose settings changed are recreated, and desired property changes only update '
+                   'the module twins.')
 @click.option('--host',
               '-H',
               required=False,
@@ -237,11 +496,68 @@ def modulecred(modules, local, output_file):
               default='1.2',
               show_default=True,
               help='EdgeHub image version. Currently supported tags 1.0x, 1.1x, or 1.2x')
+@click.option('--producers',
+              required=False,
+              type=click.IntRange(min=1, max=64),
+              default=1,
+              show_default=True,
+              help='Number of input modules in single module mode. Each one has its own identity and port, from --port '
+                   'upwards, and routes to the same inputs of the target module. `iotedgehubdev load` sends through '
+                   'all of them.')
+@click.option('--pull/--no-pull',
+              required=False,
+              default=True,
+              show_default=True,
+              help='Pull the edgeHub and helper images before starting. With --no-pull the local images are used, '
+                   'such as those loaded by `iotedgehubdev images load`, and only missing ones are pulled.')
+@click.option('--metrics-port',
+              required=False,
+              type=click.IntRange(min=1, max=65535),
+              help='Publish the Prometheus metrics of edgeHub on this host port, or a free port for a named instance, '
+                   'so `iotedgehubdev metrics` can collect them.')
+@click.option('--network-mtu',
+              required=False,
+              type=click.IntRange(min=68, max=65535),
+              help='MTU of the simulator network, e.g., to match a VPN or overlay network with a smaller MTU.')
+@click.option('--network-opt',
+              required=False,
+              multiple=True,
+              help='Driver option of the simulator network, e.g., '
+                   '`--network-opt "com.docker.network.bridge.enable_icc=true"`.')
+@click.option('--network-ipv6',
+              required=False,
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Enable IPv6 on the simulator network. The Docker daemon needs IPv6 enabled too.')
+@click.option('--network-internal',
+              required=False,
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Make the simulator network internal, so the modules cannot reach anything outside of it. '
+                   'edgeHub still needs to reach IoT Hub, so this only suits modules that do not go through it.')
+@click.option('--host-network',
+              required=False,
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Run edgeHub and the modules on the network of the host, without the bridge network and port NAT in '
+                   'between. edgeHub listens on 8883, 443 and 5671 of the host, and the input module of single module '
+                   'mode on 3000. Linux containers only.')
+@_instance_option
 @_with_telemetry
-def start(inputs, port, deployment, verbose, host, environment, edge_runtime_version):
-    edge_manager = _parse_config_json()
+def start(inputs, port, deployment, verbose, watch, host, environment, edge_runtime_version, producers, pull,
+          metrics_port, network_mtu, network_opt, network_ipv6, network_internal, host_network, instance):
+    edge_instance = EdgeInstance(instance)
+    with tracing.span('cli.parse_config'):
+        edge_manager = _parse_config_json(edge_instance)
 
     if edge_manager:
+        if host_network and not edge_instance.is_default:
+            raise ValueError('Host networking cannot be used with a named instance, whose ports would collide.')
+        network_options = _get_network_options(network_mtu, network_opt, network_ipv6, network_internal, host_network)
+
         if host is not None:
             os.environ[DOCKER_HOST] = str(host)
 
@@ -255,15 +571,27 @@ def start(inputs, port, deployment, verbose, host, environment, edge_runtime_ver
             if len(edge_runtime_version) > 0:
                 output.info('edgeHub image version is ignored in solution mode.')
 
-            with open(deployment) as json_file:
-                json_data = json.load(json_file)
-                if 'modulesContent' in json_data:
-                    module_content = json_data['modulesContent']
-                elif 'moduleContent' in json_data:
-                    module_content = json_data['moduleContent']
-            edge_manager.start_solution(module_content, verbose, output)
+            if producers > 1:
+                output.info('Producers are ignored in solution mode.')
+
+            if watch and verbose:
+                output.info('The solution container logs are not shown in watch mode.')
+                verbose = False
+
+            module_content = _load_module_content(deployment)
+            daemon_client = _connect_daemon(host) if not verbose and not watch else None
+            if daemon_client is not None:
+                daemon_client.call('start_solution', instance=instance, module_content=module_content,
+                                   metrics_port=metrics_port, pull=pull, network_options=network_options)
+            else:
+                edge_manager.start_solution(module_content, verbose, output, metrics_port=metrics_port, pull=pull,
+                                            network_options=network_options)
             if not verbose:
                 output.info('IoT Edge Simulator has been started in solution mode.')
+                _output_instance_ports(edge_instance)
+                _output_metrics_url(edge_instance, metrics_port)
+            if watch:
+                _watch_deployment(edge_manager, deployment, module_content)
         else:
             if edge_runtime_version is not None:
                 # The only validated versions are 1.0, 1.1, and 1.2 variants, hence the current limitation
@@ -272,6 +600,8 @@ def start(inputs, port, deployment, verbose, host, environment, edge_runtime_ver
 
             if deployment is not None:
                 output.info('Deployment manifest is ignored when inputs are present.')
+            if watch:
+                output.info('Watch mode is only available in solution mode.')
             if inputs is None:
                 input_list = ['input1']
             else:
@@ -281,12 +611,34 @@ def start(inputs, port, deployment, verbose, host, environment, edge_runtime_ver
                 if re.match(r'^[a-zA-Z][a-zA-Z0-9_]*?=.*$', env) is None:
                     raise ValueError('Environment variable: `{0}` is not valid.'.format(env))
 
-            edge_manager.start_singlemodule(input_list, port, environment, edge_runtime_version)
+            if host_network:
+                # The input module listens on the port of its container, on the host itself
+                if port is not None and port != 3000:
+                    output.info('Port is ignored with host networking, the input module listens on 3000.')
+                port = 3000
+            if port is None:
+                port = edge_instance.get_host_port(DEFAULT_INPUT_PORT)
+            daemon_client = _connect_daemon(host)
+            if daemon_client is not None:
+                timeline = daemon_client.call('start_singlemodule', instance=instance, inputs=input_list, port=port,
+                                              envs=list(environment), edgehub_image_version=edge_runtime_version,
+                                              metrics_port=metrics_port, pull=pull, producers=producers,
+                                              network_options=network_options)
+            else:
+                timeline = edge_manager.start_singlemodule(input_list, port, environment, edge_runtime_version,
+                                                           metrics_port=metrics_port, pull=pull, producers=producers,
+                                                           network_options=network_options)
+            if verbose and timeline:
+                for line in TaskGraph.format_timeline(timeline):
+                    output.echo(line)
+                output.line()
 
             data = '--data \'{{"inputName": "{0}","data":"hello world"}}\''.format(input_list[0])
             url = 'http://localhost:{0}/api/v1/messages'.format(port)
             curl_msg = '        curl --header "Content-Type: application/json" --request POST {0} {1}'.format(data, url)
             output.info('IoT Edge Simulator has been started in single module mode.')
+            _output_instance_ports(edge_instance)
+            _output_metrics_url(edge_instance, metrics_port)
             output.info('Please run `iotedgehubdev modulecred` to get credential to connect your module.')
             output.info('And send message through:')
             output.line()
@@ -295,6 +647,11 @@ def start(inputs, port, deployment, verbose, host, environment, edge_runtime_ver
             output.info(
                 'Please refer to https://github.com/Azure/iot-edge-testing-utility/blob/master/swagger.json'
                 ' for detail schema')
+            if producers > 1:
+                output.info('{0} input modules are sending on ports {1}.'.format(
+                    producers, ', '.join(str(producer_port) for producer_port in _get_input_ports(edge_instance, None))))
+            output.info('Run `iotedgehubdev load{0}` to measure throughput and latency under load.'.format(
+                '' if edge_instance.is_default else ' --instance {0}'.format(instance)))
 
 
 @click.command(context_settings=CONTEXT_SETTINGS,
@@ -303,19 +660,521 @@ def start(inputs, port, deployment, verbose, host, environment, edge_runtime_ver
               '-H',
               required=False,
               help='Docker daemon socket to connect to')
+@_instance_option
+@_with_telemetry
+def stop(host, instance):
+    daemon_client = _connect_daemon(host)
+    if daemon_client is not None:
+        daemon_client.call('stop', instance=instance)
+    else:
+        if host is not None:
+            os.environ[DOCKER_HOST] = str(host)
+        EdgeManager.stop(instance=EdgeInstance(instance))
+    output.info('IoT Edge Simulator has been stopped successfully.')
+
+
+@click.command(context_settings=CONTEXT_SETTINGS,
+               help='Send messages to the inputs of the IoT Edge Simulator in single module mode '
+                    'and report throughput, errors and latency percentiles.')
+@click.option('--inputs',
+              '-i',
+              required=False,
+              default='input1',
+              show_default=True,
+              help='Comma-separated input names to send messages to, picked at random for each message.')
+@click.option('--port',
+              '-p',
+              required=False,
+              type=int,
+              help='Port of the service for sending message. Defaults to the ports of all the input modules the '
+                   'simulator was started with, which take the messages in turn.')
+@click.option('--rate',
+              '-r',
+              required=False,
+              type=click.FloatRange(min=0),
+              default=0,
+              show_default=True,
+              help='Target messages per second. 0 sends as fast as the concurrency allows.')
+@click.option('--concurrency',
+              '-c',
+              required=False,
+              type=click.IntRange(min=1),
+              default=8,
+              show_default=True,
+              help='Maximum number of requests in flight, each on its own keep-alive connection.')
+@click.option('--duration',
+              '-d',
+              required=False,
+              type=click.FloatRange(min=0),
+              default=10,
+              show_default=True,
+              help='Seconds to send messages for. 0 means no time limit, which requires --count.')
+@click.option('--count',
+              '-n',
+              required=False,
+              type=click.IntRange(min=1),
+              help='Total number of messages to send.')
+@click.option('--payload-size',
+              '-s',
+              required=False,
+              default='64',
+              show_default=True,
+              help='Message data size in bytes, either N or MIN-MAX for sizes uniformly distributed in the range.')
+@click.option('--report-file',
+              required=False,
+              help='Write the report to this JSON file.')
+@_instance_option
+@_with_telemetry
+def load(inputs, port, rate, concurrency, duration, count, payload_size, report_file, instance):
+    input_list = [input_.strip() for input_ in inputs.strip().split(',')]
+    if not duration and count is None:
+        raise ValueError('Please provide --count when --duration is 0.')
+
+    urls = [LoadGenerator.get_messages_url(input_port) for input_port in _get_input_ports(EdgeInstance(instance), port)]
+    generator = LoadGenerator(urls, input_list, concurrency,
+                              rate=rate or None,
+                              duration=duration or None,
+                              count=count,
+                              payload_size=LoadGenerator.parse_payload_size(payload_size))
+    output.info('Sending messages to {0}...'.format(', '.join(urls)))
+    report = generator.run()
+
+    target = ' (target {0:.1f} msg/s)'.format(rate) if rate else ''
+    output.info('Sent {0} messages in {1:.1f}s: {2:.1f} msg/s{3}, {4} errors ({5:.2%}).'.format(
+        report['sent'], report['elapsed'], report['throughput'], target,
+        report['sent'] - report['succeeded'], report['errorRate']))
+    if report['sent']:
+        latency = report['latency']
+        output.info('Latency (ms): min {0:.1f}, p50 {1:.1f}, p90 {2:.1f}, p99 {3:.1f}, p99.9 {4:.1f}, max {5:.1f}'.format(
+            *[latency[key] * 1000 for key in ['min', 'p50', 'p90', 'p99', 'p99.9', 'max']]))
+    for error, error_count in sorted(report['errors'].items()):
+        output.warning('{0}: {1}'.format(error, error_count))
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+@click.command(context_settings=CONTEXT_SETTINGS,
+               help='Measure the latency of messages routed from the input module through edgeHub to your module '
+                    'and back to the input module, in single module mode. Your module must forward the messages it '
+                    'receives to an output.')
+@click.option('--inputs',
+              '-i',
+              required=False,
+              default='input1',
+              show_default=True,
+              help='Comma-separated input names to probe. Each one is a separate route.')
+@click.option('--port',
+              '-p',
+              required=False,
+              type=int,
+              help='Port of the service for sending message. Defaults to the port the simulator was started with.')
+@click.option('--count',
+              '-n',
+              required=False,
+              type=click.IntRange(min=1),
+              default=100,
+              show_default=True,
+              help='Number of probe messages to send.')
+@click.option('--rate',
+              '-r',
+              required=False,
+              type=click.FloatRange(min=0.1),
+              default=10,
+              show_default=True,
+              help='Probe messages per second.')
+@click.option('--timeout',
+              '-t',
+              required=False,
+              type=click.FloatRange(min=0),
+              default=30,
+              show_default=True,
+              help='Seconds to wait for the last probe messages before counting them as lost.')
+@click.option('--host',
+              '-H',
+              required=False,
+              help='Docker daemon socket to connect to')
+@click.option('--report-file',
+              required=False,
+              help='Write the report to this JSON file.')
+@_instance_option
 @_with_telemetry
-def stop(host):
+def probe(inputs, port, count, rate, timeout, host, report_file, instance):
     if host is not None:
         os.environ[DOCKER_HOST] = str(host)
-    EdgeManager.stop()
-    output.info('IoT Edge Simulator has been stopped successfully.')
+    edge_instance = EdgeInstance(instance)
+    input_list = [input_.strip() for input_ in inputs.strip().split(',')]
+    input_container = edge_instance.get_resource_name(EdgeManager.INPUT)
+    url = LoadGenerator.get_messages_url(_get_input_port(edge_instance, port))
+
+    with EdgeDockerClient() as edgedockerclient:
+        if edgedockerclient.status(input_container) != 'running':
+            raise ValueError('The input module is not running. Please start the IoT Edge Simulator in single module mode first.')
+        edgehub_image = edgedockerclient.get_container_image(edge_instance.get_resource_name(EdgeManager.EDGEHUB))
+        output.info('Probing {0} route(s) through {1}...'.format(len(input_list), edgehub_image))
+        latency_probe = LatencyProbe(edgedockerclient, input_container, url, input_list, count, rate, timeout)
+        report = latency_probe.run()
+    report['edgeHubImage'] = edgehub_image
+
+    output.line()
+    output.echo('{0:<24} {1:>6} {2:>6} {3:>7} {4:>9} {5:>9} {6:>9} {7:>9} {8:>9}'.format(
+        'ROUTE', 'SENT', 'LOST', 'LOSS', 'REORDER', 'P50(ms)', 'P90(ms)', 'P99(ms)', 'MAX(ms)'))
+    for name, route in sorted(report['routes'].items()) + [('(all)', report['all'])]:
+        latency = route['latency']
+        percentiles = ['{0:>9.1f}'.format(latency[key] * 1000) if latency['count'] else '{0:>9}'.format('-')
+                       for key in ['p50', 'p90', 'p99', 'max']]
+        output.echo('{0:<24} {1:>6} {2:>6} {3:>7.1%} {4:>9} {5}'.format(
+            name, route['sent'], route['lost'], route['lossRate'], route['reordered'], ' '.join(percentiles)))
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+@click.command(context_settings=CONTEXT_SETTINGS,
+               help='Show the logs of all the IoT Edge Simulator containers, interleaved as they are written.')
+@click.option('--follow/--no-follow',
+              '-f/-F',
+              default=True,
+              show_default=True,
+              help='Keep streaming new log lines until interrupted.')
+@click.option('--since',
+              required=False,
+              help='Only show lines written since a unix timestamp, a UTC date such as 2021-06-01T10:00:00Z '
+                   'or a duration such as 10m.')
+@click.option('--tail',
+              '-n',
+              required=False,
+              default='all',
+              show_default=True,
+              help='Number of lines to show from the end of the logs of each container.')
+@click.option('--grep',
+              '-g',
+              required=False,
+              help='Only show lines matching this regular expression.')
+@click.option('--json',
+              'json_output',
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Write one JSON object per line with the container, timestamp and message.')
+@click.option('--timestamps',
+              '-t',
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Show the timestamp of each line.')
+@click.option('--no-prefix',
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Do not prefix the lines with the container name.')
+@click.option('--host',
+              '-H',
+              required=False,
+              help='Docker daemon socket to connect to.')
+@_instance_option
+@_with_telemetry
+def logs(follow, since, tail, grep, json_output, timestamps, no_prefix, host, instance):
+    if host is not None:
+        os.environ[DOCKER_HOST] = str(host)
+    if tail != 'all' and not tail.isdigit():
+        raise ValueError('Tail `{0}` is not valid. Use a number of lines or `all`.'.format(tail))
+    if grep is not None:
+        try:
+            re.compile(grep)
+        except re.error as e:
+            raise ValueError('Regular expression `{0}` is not valid: {1}'.format(grep, e))
+
+    edge_instance = EdgeInstance(instance)
+    with EdgeDockerClient() as edgedockerclient:
+        containers = edgedockerclient.list_containers_by_label(edge_instance.get_resource_name(EdgeManager.LABEL),
+                                                               all=True)
+        if not containers:
+            output.info('No IoT Edge Simulator containers found. Please start the IoT Edge Simulator first.')
+            return
+        streamer = LogStreamer(edgedockerclient, containers, follow=follow, since=LogStreamer.parse_since(since),
+                               tail=tail if tail == 'all' else int(tail), pattern=grep, json_output=json_output,
+                               timestamps=timestamps, prefix=not no_prefix)
+        try:
+            streamer.run(click.get_text_stream('stdout'))
+        except KeyboardInterrupt:
+            pass
+    for container, error in sorted(streamer.errors.items()):
+        output.warning('Could not stream the logs of {0}: {1}'.format(container, error))
+
+@click.command(name='stats',
+               context_settings=CONTEXT_SETTINGS,
+               help='Show the CPU, memory, network and block I/O usage of the IoT Edge Simulator containers, '
+                    'and their average and peak usage when stopped.')
+@click.option('--interval',
+              '-i',
+              required=False,
+              type=click.FloatRange(min=0.1),
+              default=1.0,
+              show_default=True,
+              help='Seconds between refreshes of the table.')
+@click.option('--duration',
+              '-d',
+              required=False,
+              type=click.FloatRange(min=0),
+              default=0,
+              show_default=True,
+              help='Seconds to sample for. 0 samples until interrupted.')
+@click.option('--record',
+              '-r',
+              required=False,
+              help='Write every sample to this CSV file.')
+@click.option('--host',
+              '-H',
+              required=False,
+              help='Docker daemon socket to connect to.')
+@_instance_option
+@_with_telemetry
+def stats_command(interval, duration, record, host, instance):
+    if host is not None:
+        os.environ[DOCKER_HOST] = str(host)
+    edge_instance = EdgeInstance(instance)
+    with EdgeDockerClient() as edgedockerclient:
+        containers = edgedockerclient.list_containers_by_label(edge_instance.get_resource_name(EdgeManager.LABEL))
+        if not containers:
+            output.info('No running IoT Edge Simulator containers found. Please start the IoT Edge Simulator first.')
+            return
+        sampler = ResourceSampler(edgedockerclient, containers, record)
+        sampler.start()
+        # Redrawing the table only makes sense on a terminal
+        live = sys.stdout.isatty()
+        if not live:
+            output.info('Sampling {0} container(s)...'.format(len(containers)))
+        deadline = time.time() + duration if duration else None
+        try:
+            while deadline is None or time.time() < deadline:
+                time.sleep(interval if deadline is None else max(0, min(interval, deadline - time.time())))
+                if live:
+                    click.clear()
+                    for line in sampler.format_table():
+                        output.echo(line)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sampler.stop()
+
+    output.line()
+    for line in sampler.format_summary():
+        output.echo(line)
+    for container, error in sorted(sampler.errors.items()):
+        output.warning('Could not sample {0}: {1}'.format(container, error))
+    if record is not None:
+        output.info('Samples written to {0}.'.format(os.path.abspath(record)))
+
+@click.command(name='metrics',
+               context_settings=CONTEXT_SETTINGS,
+               help='Collect the Prometheus metrics of edgeHub and summarize its throughput, queue depth and drop '
+                    'counters. Start the IoT Edge Simulator with --metrics-port to publish them.')
+@click.option('--interval',
+              '-i',
+              required=False,
+              type=click.FloatRange(min=0.5),
+              default=5.0,
+              show_default=True,
+              help='Seconds between scrapes.')
+@click.option('--duration',
+              '-d',
+              required=False,
+              type=click.FloatRange(min=0),
+              default=0,
+              show_default=True,
+              help='Seconds to collect for. 0 collects until interrupted.')
+@click.option('--retention',
+              required=False,
+              type=click.IntRange(min=2),
+              default=EdgeHubMetrics.DEFAULT_RETENTION,
+              show_default=True,
+              help='Number of scrapes kept in memory. The summary covers the scrapes kept.')
+@click.option('--port',
+              '-p',
+              required=False,
+              type=int,
+              help='Host port of the edgeHub metrics. Defaults to the port the simulator was started with.')
+@click.option('--export',
+              required=False,
+              help='Write a snapshot of the metrics and their summary to this JSON file.')
+@click.option('--compare',
+              required=False,
+              help='Compare the summary with a snapshot exported by an earlier run.')
+@_instance_option
+@_with_telemetry
+def metrics_command(interval, duration, retention, port, export, compare, instance):
+    metrics_port = _get_metrics_port(EdgeInstance(instance), port)
+    if metrics_port is None:
+        raise ValueError('The edgeHub metrics are not published. Please start the IoT Edge Simulator with --metrics-port.')
+    baseline = EdgeHubMetrics.load_snapshot(compare) if compare is not None else None
+
+    url = EdgeHubMetrics.get_metrics_url(metrics_port)
+    collector = EdgeHubMetrics(url, retention)
+    output.info('Collecting edgeHub metrics from {0}...'.format(url))
+    deadline = time.time() + duration if duration else None
+    failures = 0
+    try:
+        while True:
+            try:
+                collector.scrape()
+            except requests.RequestException as e:
+                failures += 1
+                if failures == 1:
+                    output.warning('Could not collect the edgeHub metrics: {0}'.format(e))
+            else:
+                summary = collector.get_summary()
+                output.echo('{0} {1}'.format(time.strftime('%H:%M:%S'), '; '.join(
+                    '{0} {1:.0f} ({2:.1f}/s)'.format(key, stats['total'], stats['rate'])
+                    for key, stats in summary['throughput'].items())))
+            if deadline is not None and time.time() + interval > deadline:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+    if collector.scrapes == 0:
+        raise ValueError('No edgeHub metrics were collected from {0}.'.format(url))
+    if failures:
+        output.warning('{0} scrape(s) failed.'.format(failures))
+    summary = collector.get_summary()
+    output.line()
+    for line in EdgeHubMetrics.format_summary(summary):
+        output.echo(line)
+    if baseline is not None:
+        output.line()
+        for line in EdgeHubMetrics.format_comparison(baseline['summary'], summary):
+            output.echo(line)
+    if export is not None:
+        collector.export_snapshot(export)
+        output.info('Snapshot written to {0}.'.format(os.path.abspath(export)))
+
+@click.group(name='images',
+             context_settings=CONTEXT_SETTINGS,
+             help='Bundle the images of the IoT Edge Simulator into one file, to start it where pulling them is slow '
+                  'or not possible.')
+def images_group():
+    pass
+
+
+@images_group.command(name='save',
+                      context_settings=CONTEXT_SETTINGS,
+                      help='Save the edgeHub, input module and helper images, and those of a deployment manifest, to '
+                           'one tarball. Layers shared by several images are stored once. Missing images are pulled.')
+@click.option('--output',
+              '-o',
+              'output_file',
+              required=True,
+              help='Tarball to write.')
+@click.option('--deployment',
+              '-d',
+              required=False,
+              help='Also save the images of the modules of this deployment manifest.')
+@click.option('--edge-runtime-version',
+              '-er',
+              required=False,
+              default='1.2',
+              show_default=True,
+              help='EdgeHub image version of single module mode.')
+@click.option('--host',
+              '-H',
+              required=False,
+              help='Docker daemon socket to connect to.')
+@_with_telemetry
+def images_save(output_file, deployment, edge_runtime_version, host):
+    if host is not None:
+        os.environ[DOCKER_HOST] = str(host)
+    module_content = _load_module_content(deployment) if deployment is not None else None
+    image_list = EdgeManager.get_images(edge_runtime_version, module_content)
+
+    with EdgeDockerClient() as edgedockerclient:
+        auths = {}
+        if module_content is not None:
+            try:
+                auths = EdgeManager.login_registries(module_content, edgedockerclient)
+            except RegistriesLoginError as e:
+                output.warning(e.getmsg())
+        for image in image_list:
+            username, password = EdgeManager.get_registry_auth(auths, image)
+            if edgedockerclient.pullIfNotExist(image, username, password):
+                output.info('Pulled {0}.'.format(image))
+        output.info('Saving {0} images to {1}...'.format(len(image_list), output_file))
+        size = _write_chunks(output_file, edgedockerclient.save_images(image_list))
+    for image in image_list:
+        output.echo('    {0}'.format(image))
+    output.info('Saved {0} images ({1}) to {2}.'.format(len(image_list), format_bytes(size), os.path.abspath(output_file)))
+
+
+@images_group.command(name='load',
+                      context_settings=CONTEXT_SETTINGS,
+                      help='Load the images of a tarball written by `iotedgehubdev images save`. Start the IoT Edge '
+                           'Simulator with --no-pull afterwards to use them without pulling.')
+@click.option('--input',
+              '-i',
+              'input_file',
+              required=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Tarball to load.')
+@click.option('--host',
+              '-H',
+              required=False,
+              help='Docker daemon socket to connect to.')
+@_with_telemetry
+def images_load(input_file, host):
+    if host is not None:
+        os.environ[DOCKER_HOST] = str(host)
+    output.info('Loading images from {0} ({1})...'.format(input_file, format_bytes(os.path.getsize(input_file))))
+    with EdgeDockerClient() as edgedockerclient, open(input_file, 'rb') as f:
+        loaded = edgedockerclient.load_images(f)
+    for image in loaded:
+        output.echo('    {0}'.format(image))
+    output.info('Loaded {0} images.'.format(len(loaded)))
+
+@click.group(name='volume',
+             context_settings=CONTEXT_SETTINGS,
+             help='Manage the data volumes of the modules.')
+def volume_group():
+    pass
+
+
+@volume_group.command(name='seed',
+                      context_settings=CONTEXT_SETTINGS,
+                      help='Copy a directory tree, such as ML models or reference data, into a named volume before '
+                           'starting the modules mounting it. The files are streamed, so memory use does not grow with '
+                           'their size, and files unchanged since the last seeding are skipped.')
+@click.argument('volume_name', metavar='VOLUME')
+@click.argument('source_dir', metavar='DIR', type=click.Path(exists=True, file_okay=False))
+@click.option('--host',
+              '-H',
+              required=False,
+              help='Docker daemon socket to connect to.')
+@_with_telemetry
+def volume_seed(volume_name, source_dir, host):
+    if host is not None:
+        os.environ[DOCKER_HOST] = str(host)
+    last_report = [time.time()]
+
+    def progress(copied, total):
+        # At most one line a second, whatever the chunk size
+        now = time.time()
+        if now - last_report[0] >= 1 or copied == total:
+            last_report[0] = now
+            output.echo('    {0} of {1} ({2:.0%})'.format(format_bytes(copied), format_bytes(total),
+                                                          float(copied) / total if total else 1))
+
+    output.info('Seeding volume {0} from {1}...'.format(volume_name, source_dir))
+    with EdgeDockerClient() as edgedockerclient:
+        seeder = EdgeManager.seed_volume(volume_name, source_dir, edgedockerclient, progress)
+    output.info('Copied {0} files ({1}), skipped {2} unchanged files ({3}).'.format(
+        len(seeder.files), format_bytes(seeder.copied_bytes), len(seeder.skipped), format_bytes(seeder.skipped_bytes)))
 
 
 @click.command(context_settings=CONTEXT_SETTINGS,
                help="Determine whether config file is valid.")
+@_instance_option
 @_with_telemetry
-def validateconfig():
-    _parse_config_json()
+def validateconfig(instance):
+    _parse_config_json(EdgeInstance(instance))
     output.info('Config file is valid.')
 
 @click.command(context_settings=CONTEXT_SETTINGS,
@@ -354,14 +1213,58 @@ def validateconfig():
               '-p',
               required=False,
               help='Passphase of your own trusted ca private key.')
+@click.option('--key-algorithm',
+              '-a',
+              required=False,
+              default=EdgeCertUtil.KEY_ALGORITHM_RSA,
+              show_default=True,
+              type=click.Choice(EdgeCertUtil.KEY_ALGORITHMS),
+              help='Key algorithm of the generated certificates.')
+@click.option('--key-pool',
+              required=False,
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Take private keys from the key pool filled by `iotedgehubdev keypool fill`. '
+              'Keys are generated inline when the pool is empty.')
+@click.option('--device-ids',
+              required=False,
+              help='Batch mode: comma-separated device IDs to generate a device CA for, e.g., `device1,device2`. '
+              'The certs of each device are stored in a sub folder named after the device ID.')
+@click.option('--device-ids-file',
+              required=False,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Batch mode: text or CSV file with one device ID per line (first column).')
+@click.option('--workers',
+              required=False,
+              type=click.IntRange(min=1),
+              help='Batch mode: number of worker processes generating keys. Defaults to the number of CPUs.')
+@click.option('--cert-engine',
+              required=False,
+              default=EdgeCert.ENGINE_PYOPENSSL,
+              show_default=True,
+              type=click.Choice(EdgeCert.ENGINES),
+              help='Library used to generate the certificates.')
 @_with_telemetry
-def generatedeviceca(output_dir, valid_days, force, trusted_ca, trusted_ca_key, trusted_ca_key_passphase):
+def generatedeviceca(output_dir, valid_days, force, trusted_ca, trusted_ca_key, trusted_ca_key_passphase, key_algorithm,
+                     key_pool, device_ids, device_ids_file, workers, cert_engine):
     try:
         output_dir = os.path.abspath(os.path.join(output_dir, EdgeConstants.CERT_FOLDER))
         if trusted_ca_key_passphase:
             trusted_ca_key_passphase = trusted_ca_key_passphase.encode()  # crypto requires byte string
+        batch_device_ids = None
+        if device_ids or device_ids_file:
+            batch_device_ids = Utils.parse_device_ids(device_ids, device_ids_file)
+            if not batch_device_ids:
+                raise ValueError('No device IDs were provided.')
         # Check whether create new trusted CA and generate files to be created
-        output_files = list(Utils.get_device_ca_file_paths(output_dir, EdgeConstants.DEVICE_CA_ID).values())
+        if batch_device_ids is None:
+            output_files = list(Utils.get_device_ca_file_paths(output_dir, EdgeConstants.DEVICE_CA_ID).values())
+        else:
+            output_files = []
+            for device_id in batch_device_ids:
+                device_dir = os.path.join(output_dir, device_id)
+                output_files.extend(Utils.get_device_ca_file_paths(device_dir, EdgeConstants.DEVICE_CA_ID).values())
         if trusted_ca and trusted_ca_key:
             output.info('Trusted CA (certification authority) and trusted CA key were provided.'
                         ' Load trusted CA from given files.')
@@ -383,19 +1286,120 @@ def generatedeviceca(output_dir, valid_days, force, trusted_ca, trusted_ca_key,
                 raise EdgeError('Following cert files already exist. '
                                 'You can use --force option to overwrite existing files: %s' % existing_files)
         # Generate certs
-        edgeCert = EdgeCert(output_dir, '')
-        edgeCert.generate_device_ca(valid_days, force, trusted_ca, trusted_ca_key, trusted_ca_key_passphase)
+        pool = KeyPool() if key_pool else None
+        edgeCert = EdgeCert(output_dir, '', key_algorithm, pool, cert_engine)
+        if batch_device_ids is None:
+            edgeCert.generate_device_ca(valid_days, force, trusted_ca, trusted_ca_key, trusted_ca_key_passphase)
+        else:
+            start_time = time.time()
+            edgeCert.generate_device_ca_batch(batch_device_ids, valid_days, trusted_ca, trusted_ca_key,
+                                              trusted_ca_key_passphase, workers)
+            elapsed = time.time() - start_time
+            output.info('Generated {0} device CA(s) in {1:.2f}s ({2:.2f} devices/s).'.format(
+                len(batch_device_ids), elapsed, len(batch_device_ids) / elapsed if elapsed > 0 else 0))
+        if pool is not None:
+            output.info('Key pool: {0} hit(s), {1} miss(es).'.format(pool.hits, pool.misses))
         output.info('Successfully generated device CA. Please find the generated certs at %s' % output_dir)
     except Exception as e:
         raise e
 
 
+@click.group(context_settings=CONTEXT_SETTINGS,
+             help='Manage the pool of pregenerated private keys used by `generatedeviceca --key-pool`.')
+def keypool():
+    pass
+
+
+@click.command(name='fill',
+               context_settings=CONTEXT_SETTINGS,
+               help='Pregenerate private keys into the key pool. Can be left running in the background.')
+@click.option('--count',
+              '-n',
+              required=False,
+              default=10,
+              show_default=True,
+              type=click.IntRange(min=1),
+              help='Number of keys to generate.')
+@click.option('--key-algorithm',
+              '-a',
+              required=False,
+              default=EdgeCertUtil.KEY_ALGORITHM_RSA,
+              show_default=True,
+              type=click.Choice(EdgeCertUtil.KEY_ALGORITHMS),
+              help='Key algorithm of the generated keys.')
+@_with_telemetry
+def keypool_fill(count, key_algorithm):
+    pool = KeyPool()
+    key_spec = EdgeCertUtil.get_key_spec(key_algorithm, EdgeCertUtil.CA_KEY_LEN)
+    pool.fill(key_spec, count)
+    output.info('Added {0} {1} key(s) to the key pool at {2}.'.format(count, KeyPool.get_spec_name(key_spec), pool.pool_dir))
+
+
+@click.command(name='status',
+               context_settings=CONTEXT_SETTINGS,
+               help='Show the available keys, hit rate and generation time saved by the key pool.')
+@_with_telemetry
+def keypool_status():
+    status = KeyPool().get_status()
+    if not status:
+        output.info('The key pool is empty.')
+        return
+    for spec_name, spec_status in sorted(status.items()):
+        output.info('{0}: {1} available, {2} hit(s), {3} miss(es), hit rate {4:.0%}, {5:.1f}s saved'.format(
+            spec_name, spec_status['available'], spec_status['hits'], spec_status['misses'],
+            spec_status['hit_rate'], spec_status['saved_seconds']))
+
+
+keypool.add_command(keypool_fill)
+keypool.add_command(keypool_status)
+
+
+@click.command(name='daemon',
+               context_settings=CONTEXT_SETTINGS,
+               help='Run a local daemon that keeps the Docker client, the IoT Hub connection, the config and the module '
+                    'credentials warm. While it runs, `start`, `stop` and `modulecred` hand their work to it instead of '
+                    'setting all of this up on every call.')
+@click.option('--shutdown',
+              required=False,
+              is_flag=True,
+              default=False,
+              show_default=True,
+              help='Stop the running daemon.')
+@_with_telemetry
+def daemon_command(shutdown):
+    if shutdown:
+        daemon_client = daemon.connect()
+        if daemon_client is None:
+            output.info('The iotedgehubdev daemon is not running.')
+            return
+        daemon_client.call('shutdown')
+        output.info('The iotedgehubdev daemon has been stopped.')
+        return
+
+    edge_daemon = daemon.EdgeDaemon(_parse_config_json)
+    output.info('iotedgehubdev daemon listening on {0}. Press Ctrl+C to stop it.'.format(edge_daemon.socket_path))
+    try:
+        edge_daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    output.info('The iotedgehubdev daemon has been stopped.')
+
+
 main.add_command(setup)
 main.add_command(modulecred)
 main.add_command(start)
 main.add_command(stop)
+main.add_command(load)
+main.add_command(probe)
+main.add_command(logs)
+main.add_command(stats_command)
+main.add_command(metrics_command)
+main.add_command(images_group)
+main.add_command(volume_group)
 main.add_command(validateconfig)
 main.add_command(generatedeviceca)
+main.add_command(keypool)
+main.add_command(daemon_command)
 
 if __name__ == "__main__":
     main()
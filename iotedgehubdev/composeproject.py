@@ -10,22 +10,31 @@ import yaml
 from collections import OrderedDict
 from io import StringIO
 from .compose_parser import CreateOptionParser
+from .edgehubmetrics import EdgeHubMetrics
 from .output import Output
+from .utils import Utils
 
 COMPOSE_VERSION = 3.6
 
 CREATE_OPTIONS_MAX_CHUNKS = 100
+# The startupOrder of modules which have none: the largest unsigned 32-bit integer, so they start last
+DEFAULT_STARTUP_ORDER = 4294967295
 
 
 class ComposeProject(object):
 
-    def __init__(self, module_content):
+    def __init__(self, module_content, output=None):
         self.module_content = module_content
+        self._output = output if output is not None else Output()
         self.yaml_dict = OrderedDict()
         self.Services = OrderedDict()
         self.Networks = {}
         self.Volumes = {}
         self.edge_info = {}
+        # Modules whose desired status is stopped, which are created but not started
+        self.StoppedServices = []
+        self.PullPolicies = {}
+        self.StartupOrders = {}
 
     def compose(self):
         modules = {
@@ -41,7 +50,12 @@ class ComposeProject(object):
                 create_option_parser = CreateOptionParser(create_option)
                 self.Services[service_name].update(create_option_parser.parse_create_option())
             self.Services[service_name]['image'] = config['settings']['image']
-            self.Services[service_name]['container_name'] = service_name
+            self.Services[service_name]['container_name'] = self.edge_info.get('container_prefix', '') + service_name
+
+            if self.edge_info.get('host_network'):
+                # Every service shares the network of the host, where published ports do not apply
+                self.Services[service_name]['networks'] = {'host': None}
+                self.Services[service_name].pop('ports', None)
 
             if 'networks' not in self.Services[service_name]:
                 self.Services[service_name]['networks'] = {}
@@ -72,11 +86,26 @@ class ComposeProject(object):
                 }[restart_policy]
 
                 if restart_policy == 'on-unhealthy':
-                    Output().warning('Unsupported restart policy \'{0}\' in solution mode. Falling back to \'always\'.'
-                                     .format(restart_policy))
+                    self._output.warning('Unsupported restart policy \'{0}\' in solution mode. Falling back to \'always\'.'
+                                         .format(restart_policy))
             except KeyError as e:
                 raise KeyError('Unsupported restart policy {0} in solution mode.'.format(e))
 
+            if service_name != self.edge_info['hub_name'] and config.get('status', 'running') == 'stopped':
+                self.StoppedServices.append(service_name)
+
+            pull_policy = config.get('imagePullPolicy', 'on-create')
+            if pull_policy not in ['on-create', 'never']:
+                raise KeyError('Unsupported image pull policy \'{0}\' in solution mode.'.format(pull_policy))
+            self.PullPolicies[service_name] = pull_policy
+
+            startup_order = config.get('startupOrder', DEFAULT_STARTUP_ORDER)
+            if not isinstance(startup_order, int) or isinstance(startup_order, bool) or \
+                    not 0 <= startup_order <= DEFAULT_STARTUP_ORDER:
+                raise ValueError('Unsupported startup order \'{0}\' of module {1} in solution mode.'.format(
+                    startup_order, service_name))
+            self.StartupOrders[service_name] = startup_order
+
             if 'env' in config:
                 self.Services[service_name]['environment'] = self.config_env(
                     self.Services[service_name].get('environment', []), config['env'])
@@ -101,6 +130,23 @@ class ComposeProject(object):
     def set_edge_info(self, info):
         self.edge_info = info
 
+    def remap_host_ports(self, get_host_port):
+        """Replace the host port of every published port with get_host_port(host_port).
+
+        Returns the published ports of each service as {service: {container_port: host_port}}."""
+        ports = {}
+        for service_name, config in self.Services.items():
+            remapped = []
+            for port in config.get('ports', []):
+                host_ip, host_port, container_port = ComposeProject._split_port(port)
+                if host_port and host_port.isdigit():
+                    host_port = str(get_host_port(int(host_port)))
+                    ports.setdefault(service_name, {})[container_port] = int(host_port)
+                remapped.append(':'.join(part for part in [host_ip, host_port, container_port] if part is not None))
+            if remapped:
+                config['ports'] = remapped
+        return ports
+
     def config_modules(self, service_name):
         config = self.Services[service_name]
         if 'volumes' not in config:
@@ -123,6 +169,12 @@ class ComposeProject(object):
             config['depends_on'] = []
         config['depends_on'].append(self.edge_info['hub_name'])
 
+        if self.edge_info.get('host_network'):
+            # edgeHub listens on the host, so its gateway host name must resolve to the loopback
+            if 'extra_hosts' not in config:
+                config['extra_hosts'] = []
+            config['extra_hosts'].append('{0}:127.0.0.1'.format(self.edge_info['network_info']['ALIASES']))
+
     def config_edge_hub(self, service_name):
         config = self.Services[service_name]
         if 'volumes' not in config:
@@ -133,9 +185,10 @@ class ComposeProject(object):
             'target': self.edge_info['volume_info']['HUB_MOUNT']
         })
 
-        config['networks'][self.edge_info['network_info']['NW_NAME']] = {
-            'aliases': [self.edge_info['network_info']['ALIASES']]
-        }
+        if 'networks' in config:
+            config['networks'][self.edge_info['network_info']['NW_NAME']] = {
+                'aliases': [self.edge_info['network_info']['ALIASES']]
+            }
 
         if 'environment' not in config:
             config['environment'] = []
@@ -146,6 +199,12 @@ class ComposeProject(object):
             'IotHubConnectionString=' + self.edge_info['ConnStr_info']['$edgeHub'])
         config['environment'].extend(self.edge_info['env_info']['hub_env'])
 
+        metrics_port = self.edge_info.get('metrics_port')
+        if metrics_port is not None and not self.edge_info.get('host_network'):
+            if 'ports' not in config:
+                config['ports'] = []
+            config['ports'].append('{0}:{1}'.format(metrics_port, EdgeHubMetrics.CONTAINER_PORT))
+
     def config_env(self, env_list, env_section):
         env_dict = {}
         for env in env_list:
@@ -207,8 +266,20 @@ class ComposeProject(object):
         if not os.path.exists(os.path.dirname(target)):
             os.makedirs(os.path.dirname(target))
 
-        with open(target, 'w') as f:
-            f.write(yml_str)
+        Utils.write_file_atomic(target, yml_str)
+
+    @staticmethod
+    def _split_port(port):
+        # The formats written by service_parser_hostconfig_ports: host_port:container_port,
+        # host_ip:host_port:container_port and host_ip:container_port
+        parts = port.split(':')
+        if len(parts) == 3:
+            return parts[0], parts[1], parts[2]
+        if len(parts) == 2:
+            if '.' in parts[0]:
+                return parts[0], None, parts[1]
+            return None, parts[0], parts[1]
+        return None, None, port
 
     @staticmethod
     def _join_create_options(settings):
@@ -0,0 +1,142 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+from .certutils import EdgeCertUtil
+
+# Subject and public key of a certificate to be issued. Unlike an X509Req it is never signed,
+# the builders below consume it directly.
+_CertRequest = namedtuple('_CertRequest', ['subject', 'public_key'])
+
+
+class CryptographyEdgeCertUtil(EdgeCertUtil):
+    """EdgeCertUtil on top of the cryptography x509 builders instead of the deprecated OpenSSL.crypto APIs.
+
+    Keys are cryptography private key objects and certs are x509.Certificate objects.
+    """
+    _name_oid_dict = {
+        'C': NameOID.COUNTRY_NAME,
+        'ST': NameOID.STATE_OR_PROVINCE_NAME,
+        'L': NameOID.LOCALITY_NAME,
+        'O': NameOID.ORGANIZATION_NAME,
+        'OU': NameOID.ORGANIZATIONAL_UNIT_NAME,
+        'CN': NameOID.COMMON_NAME
+    }
+    _subject_field_order = ['C', 'ST', 'L', 'O', 'OU', 'CN']
+    _digest = hashes.SHA256()
+
+    def _load_certificate_pem(self, cert_pem):
+        return x509.load_pem_x509_certificate(CryptographyEdgeCertUtil._to_bytes(cert_pem))
+
+    def _load_private_key_pem(self, key_pem, passphrase=None):
+        if passphrase is not None:
+            passphrase = CryptographyEdgeCertUtil._to_bytes(passphrase)
+        return serialization.load_pem_private_key(CryptographyEdgeCertUtil._to_bytes(key_pem), passphrase)
+
+    def _serialize_certificate_pem(self, cert):
+        return cert.public_bytes(serialization.Encoding.PEM)
+
+    def _serialize_private_key_pem(self, key_pair, passphrase=None):
+        if passphrase:
+            encryption = serialization.BestAvailableEncryption(passphrase)
+        else:
+            encryption = serialization.NoEncryption()
+        return key_pair.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, encryption)
+
+    def _serialize_pfx(self, cert, key_pair):
+        return pkcs12.serialize_key_and_certificates(None, key_pair, cert, None, serialization.NoEncryption())
+
+    def _get_subject_fields(self, cert):
+        fields = {}
+        for key in CryptographyEdgeCertUtil._subject_field_order[:-1]:
+            attributes = cert.subject.get_attributes_for_oid(CryptographyEdgeCertUtil._name_oid_dict[key])
+            fields[key] = attributes[0].value if attributes else None
+        return fields
+
+    def _get_not_after(self, cert):
+        return cert.not_valid_after.strftime('%Y%m%d%H%M%SZ').encode('utf-8')
+
+    def _create_csr(self, key_pair, **kwargs):
+        attributes = []
+        for key in CryptographyEdgeCertUtil._subject_field_order:
+            value = kwargs.get(key)
+            if value:
+                attributes.append(x509.NameAttribute(CryptographyEdgeCertUtil._name_oid_dict[key], value))
+        return _CertRequest(x509.Name(attributes), key_pair.public_key())
+
+    def _create_cert_common(self,
+                            csr,
+                            issuer_cert,
+                            validity_period):
+        not_before, not_after = validity_period
+        now = datetime.utcnow()
+        return x509.CertificateBuilder() \
+            .serial_number(self._serial_number) \
+            .not_valid_before(now + timedelta(seconds=not_before)) \
+            .not_valid_after(now + timedelta(seconds=not_after)) \
+            .issuer_name(issuer_cert.subject) \
+            .subject_name(csr.subject) \
+            .public_key(csr.public_key)
+
+    def _create_ca_cert(self,
+                        csr,
+                        issuer_cert,
+                        issuer_key_pair,
+                        validity_period,
+                        path_len_zero):
+        builder = self._create_cert_common(csr, issuer_cert, validity_period)
+        builder = builder.add_extension(x509.BasicConstraints(ca=True, path_length=0 if path_len_zero else None),
+                                        critical=True)
+        builder = builder.add_extension(x509.SubjectKeyIdentifier.from_public_key(csr.public_key), critical=False)
+        builder = builder.add_extension(x509.KeyUsage(digital_signature=True,
+                                                      content_commitment=False,
+                                                      key_encipherment=False,
+                                                      data_encipherment=False,
+                                                      key_agreement=False,
+                                                      key_cert_sign=True,
+                                                      crl_sign=True,
+                                                      encipher_only=False,
+                                                      decipher_only=False),
+                                        critical=True)
+        # Same as keyid:always,issuer:always, a self-signed cert is its own authority
+        if isinstance(issuer_cert, x509.Certificate):
+            authority_issuer, authority_serial = issuer_cert.issuer, issuer_cert.serial_number
+        else:
+            authority_issuer, authority_serial = csr.subject, self._serial_number
+        builder = builder.add_extension(x509.AuthorityKeyIdentifier(
+            x509.SubjectKeyIdentifier.from_public_key(issuer_key_pair.public_key()).digest,
+            [x509.DirectoryName(authority_issuer)],
+            authority_serial), critical=False)
+        return builder.sign(issuer_key_pair, CryptographyEdgeCertUtil._digest)
+
+    def _create_server_cert(self,
+                            csr,
+                            issuer_cert,
+                            issuer_key_pair,
+                            validity_period,
+                            hostname):
+        builder = self._create_cert_common(csr, issuer_cert, validity_period)
+        builder = builder.add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=False)
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName('localhost'),
+                                                                     x509.DNSName(hostname)]),
+                                        critical=False)
+        return builder.sign(issuer_key_pair, CryptographyEdgeCertUtil._digest)
+
+    @staticmethod
+    def _create_key_pair(private_key_type, key_bit_len):
+        if private_key_type == EdgeCertUtil.TYPE_EC:
+            return ec.generate_private_key(EdgeCertUtil._ec_curve_dict[key_bit_len]())
+        return rsa.generate_private_key(public_exponent=65537, key_size=key_bit_len)
+
+    @staticmethod
+    def _to_bytes(content):
+        return content.encode('utf-8') if isinstance(content, str) else content
@@ -0,0 +1,251 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import json
+import os
+import socket
+import socketserver
+import threading
+
+import requests
+
+from . import filelock
+from .edgedockerclient import EdgeDockerClient
+from .edgemanager import EdgeManager
+from .errors import EdgeError, InvalidConfigError
+from .hostplatform import HostPlatform
+from .instance import EdgeInstance
+from .output import Output
+
+SOCKET_NAME = 'daemon.sock'
+DOCKER_HOST = 'DOCKER_HOST'
+ANY_DOCKER_HOST = object()
+CREDENTIAL_TTL = 600
+CONNECT_TIMEOUT = 0.5
+
+
+def get_socket_path():
+    return os.path.join(HostPlatform.get_data_path(), SOCKET_NAME)
+
+
+def is_supported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def connect(socket_path=None, docker_host=ANY_DOCKER_HOST):
+    """A client of the daemon listening on socket_path, or None when no daemon is running.
+
+    Given the Docker host of the command, also None when the daemon works against another one."""
+    if not is_supported():
+        return None
+    client = DaemonClient(socket_path)
+    if not client.is_running():
+        return None
+    if docker_host is not ANY_DOCKER_HOST and (docker_host or None) != client.docker_host:
+        return None
+    return client
+
+
+class DaemonClient(object):
+    """Sends one JSON line per call to the daemon and waits for the JSON line it answers with.
+
+    Messages the daemon printed while serving the call are printed here, as if the command ran locally."""
+
+    def __init__(self, socket_path=None):
+        self._socket_path = socket_path or get_socket_path()
+        # The Docker host the daemon works against, None for the default one
+        self.docker_host = None
+
+    def is_running(self):
+        try:
+            pong = self.call('ping', timeout=CONNECT_TIMEOUT)
+        except (EdgeError, OSError, ValueError):
+            return False
+        if not isinstance(pong, dict) or not pong.get('pong'):
+            return False
+        self.docker_host = pong.get('dockerHost')
+        return True
+
+    def call(self, method, timeout=None, **params):
+        # Locks taken for this call wait as long as they would in this process
+        params.setdefault('lock_timeout', filelock.get_default_timeout())
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self._socket_path)
+            sock.sendall((json.dumps({'method': method, 'params': params}) + '\n').encode('utf-8'))
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise EdgeError('The iotedgehubdev daemon closed the connection during `{0}`'.format(method))
+        response = json.loads(line.decode('utf-8'))
+
+        output = Output()
+        for level, text in response.get('output', []):
+            if level in _RecordingOutput.LEVELS:
+                getattr(output, level)(text)
+        if 'error' in response:
+            if response.get('errorType') == InvalidConfigError.__name__:
+                raise InvalidConfigError(response['error'])
+            raise EdgeError(response['error'])
+        return response.get('result')
+
+
+class _RecordingOutput(Output):
+    LEVELS = ['info', 'warning', 'error']
+
+    def __init__(self):
+        self.messages = []
+
+    def info(self, text, suppress=False):
+        if not suppress:
+            self.messages.append(['info', text])
+
+    def warning(self, text):
+        self.messages.append(['warning', text])
+
+    def error(self, text):
+        self.messages.append(['error', text])
+
+
+class _WarmDockerClient(EdgeDockerClient):
+    # The OS type of a Docker daemon does not change while it runs
+    def __init__(self):
+        super(_WarmDockerClient, self).__init__()
+        self._os_type = None
+
+    def get_os_type(self):
+        if self._os_type is None:
+            self._os_type = super(_WarmDockerClient, self).get_os_type()
+        return self._os_type
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        output = _RecordingOutput()
+        try:
+            request = json.loads(line.decode('utf-8'))
+            result = self.server.edge_daemon.dispatch(request['method'], request.get('params', {}), output)
+            response = {'result': result}
+        except Exception as e:
+            response = {'error': str(e), 'errorType': type(e).__name__}
+        response['output'] = output.messages
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class EdgeDaemon(object):
+    """Serves start, stop and modulecred on a Unix socket, keeping what they need warm between calls:
+    the Docker client and the facts of its daemon, a keep-alive session to IoT Hub, the parsed
+    config of each instance and the module connection strings."""
+    METHODS = ['ping', 'shutdown', 'start_singlemodule', 'start_solution', 'stop', 'modulecred']
+
+    def __init__(self, parse_config, socket_path=None):
+        self._parse_config = parse_config
+        self._socket_path = socket_path or get_socket_path()
+        self._server = None
+        self._lock = threading.Lock()
+        self._docker = None
+        self._managers = {}
+
+    @property
+    def socket_path(self):
+        return self._socket_path
+
+    def serve(self):
+        if not is_supported():
+            raise EdgeError('The iotedgehubdev daemon needs Unix domain sockets, which this platform does not support')
+        if os.path.exists(self._socket_path):
+            if DaemonClient(self._socket_path).is_running():
+                raise EdgeError('An iotedgehubdev daemon is already listening on {0}'.format(self._socket_path))
+            # Left behind by a daemon that did not exit cleanly
+            os.unlink(self._socket_path)
+
+        EdgeManager._http = requests.Session()
+        old_umask = os.umask(0o077)
+        try:
+            self._server = _UnixServer(self._socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.edge_daemon = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+            EdgeManager._http.close()
+            EdgeManager._http = requests
+
+    def shutdown(self):
+        if self._server is not None:
+            # serve_forever has to return on its own thread, so do not wait for it here
+            threading.Thread(target=self._server.shutdown).start()
+
+    def dispatch(self, method, params, output):
+        if method not in EdgeDaemon.METHODS:
+            raise EdgeError('Unknown daemon method `{0}`'.format(method))
+        params = dict(params)
+        lock_timeout = params.pop('lock_timeout', None)
+        # Waiting for a lock is reported to the client like everything else printed for the call
+        with filelock.call_settings(lock_timeout, output):
+            return getattr(self, '_' + method)(output=output, **params)
+
+    def _ping(self, output):
+        return {'pong': True, 'dockerHost': os.environ.get(DOCKER_HOST) or None}
+
+    def _shutdown(self, output):
+        self.shutdown()
+
+    def _start_singlemodule(self, output, instance, inputs, port, envs, edgehub_image_version, metrics_port=None,
+                            pull=True, producers=1, network_options=None):
+        edge_manager = self._get_manager(instance)
+        return edge_manager.start_singlemodule(inputs, port, envs, edgehub_image_version, self._get_docker(),
+                                               metrics_port, pull, producers, network_options)
+
+    def _start_solution(self, output, instance, module_content, metrics_port=None, pull=True, network_options=None):
+        edge_manager = self._get_manager(instance)
+        edge_manager.start_solution(module_content, False, output, self._get_docker(), metrics_port, pull,
+                                    network_options)
+
+    def _stop(self, output, instance):
+        EdgeManager.stop(self._get_docker(), EdgeInstance(instance))
+
+    def _modulecred(self, output, instance, modules, local, output_file):
+        return self._get_manager(instance).outputModuleCred(modules, local, output_file)
+
+    def _get_docker(self):
+        with self._lock:
+            if self._docker is None:
+                self._docker = _WarmDockerClient()
+            return self._docker
+
+    def _get_manager(self, instance):
+        edge_instance = EdgeInstance(instance)
+        # Set up again since the manager was created, or switched between its own and the default config
+        config_version = tuple(EdgeDaemon._get_mtime(path) for path in [
+            edge_instance.get_config_file_path(), HostPlatform.get_config_file_path()])
+        with self._lock:
+            cached = self._managers.get(instance)
+            if cached is not None and cached[0] == config_version:
+                return cached[1]
+            edge_manager = self._parse_config(edge_instance)
+            edge_manager.cache_credentials(CREDENTIAL_TTL)
+            self._managers[instance] = (config_version, edge_manager)
+            return edge_manager
+
+    @staticmethod
+    def _get_mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
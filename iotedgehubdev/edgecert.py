@@ -1,21 +1,44 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import os
+
+from . import tracing
 from .certutils import EdgeCertUtil
 from .constants import EdgeConstants
+from .cryptocertutils import CryptographyEdgeCertUtil
+from .errors import EdgeValueError
 
 
 class EdgeCert(object):
-    def __init__(self, certs_dir, hostname):
+    ENGINE_PYOPENSSL = 'pyopenssl'
+    ENGINE_CRYPTOGRAPHY = 'cryptography'
+    ENGINES = [ENGINE_PYOPENSSL, ENGINE_CRYPTOGRAPHY]
+    _engine_dict = {ENGINE_PYOPENSSL: EdgeCertUtil, ENGINE_CRYPTOGRAPHY: CryptographyEdgeCertUtil}
+
+    def __init__(self, certs_dir, hostname, key_algorithm=EdgeCertUtil.KEY_ALGORITHM_RSA, key_pool=None,
+                 engine=ENGINE_PYOPENSSL):
+        if engine not in EdgeCert._engine_dict:
+            raise EdgeValueError('Unsupported cert engine: {0}'.format(engine))
         self.certs_dir = certs_dir
         self.hostname = hostname
+        self.key_algorithm = key_algorithm
+        self.key_pool = key_pool
+        self.engine = engine
 
+    @tracing.traced('edgecert.generate_self_signed_certs')
     def generate_self_signed_certs(self):
-        cert_util = EdgeCertUtil()
+        cert_util = self._create_cert_util()
+        cert_util.pregenerate_key_pairs({
+            EdgeConstants.EDGE_DEVICE_CA: EdgeCertUtil.get_key_spec(self.key_algorithm, EdgeCertUtil.CA_KEY_LEN),
+            EdgeConstants.EDGE_AGENT_CA: EdgeCertUtil.get_key_spec(self.key_algorithm, EdgeCertUtil.CA_KEY_LEN),
+            EdgeConstants.EDGE_HUB_SERVER: EdgeCertUtil.get_key_spec(self.key_algorithm, EdgeCertUtil.SERVER_KEY_LEN)
+        })
         cert_util.create_root_ca_cert(EdgeConstants.EDGE_DEVICE_CA,
                                       validity_days_from_now=365,
                                       subject_dict=EdgeConstants.CERT_DEFAULT_DICT,
-                                      passphrase=None)
+                                      passphrase=None,
+                                      key_algorithm=self.key_algorithm)
         cert_util.export_simulator_cert_artifacts_to_dir(EdgeConstants.EDGE_DEVICE_CA, self.certs_dir)
 
         cert_util.create_intermediate_ca_cert(EdgeConstants.EDGE_AGENT_CA,
@@ -23,13 +46,15 @@ class EdgeCert(object):
                                               validity_days_from_now=365,
                                               common_name='Edge Agent CA',
                                               set_terminal_ca=False,
-                                              passphrase=None)
+                                              passphrase=None,
+                                              key_algorithm=self.key_algorithm)
         cert_util.export_simulator_cert_artifacts_to_dir(EdgeConstants.EDGE_AGENT_CA, self.certs_dir)
 
         cert_util.create_server_cert(EdgeConstants.EDGE_HUB_SERVER,
                                      EdgeConstants.EDGE_AGENT_CA,
                                      validity_days_from_now=365,
-                                     hostname=self.hostname)
+                                     hostname=self.hostname,
+                                     key_algorithm=self.key_algorithm)
         cert_util.export_simulator_cert_artifacts_to_dir(EdgeConstants.EDGE_HUB_SERVER, self.certs_dir)
         cert_util.export_pfx_cert(EdgeConstants.EDGE_HUB_SERVER, self.certs_dir)
 
@@ -37,16 +62,22 @@ class EdgeCert(object):
         cert_util.chain_simulator_ca_certs(EdgeConstants.EDGE_CHAIN_CA, prefixes, self.certs_dir)
 
     # Generate IoT Edge device CA to be configured in IoT Edge runtime
+    @tracing.traced('edgecert.generate_device_ca')
     def generate_device_ca(self, valid_days, overwrite_existing, trusted_ca, trusted_ca_key, trusted_ca_key_passphase):
         # Function level variables
         create_root_ca = not (trusted_ca and trusted_ca_key)
         # Generate certs
-        cert_util = EdgeCertUtil()
+        cert_util = self._create_cert_util()
         if create_root_ca:
+            cert_util.pregenerate_key_pairs({
+                EdgeConstants.ROOT_CA_ID: EdgeCertUtil.get_key_spec(self.key_algorithm, EdgeCertUtil.CA_KEY_LEN),
+                EdgeConstants.DEVICE_CA_ID: EdgeCertUtil.get_key_spec(self.key_algorithm, EdgeCertUtil.CA_KEY_LEN)
+            })
             cert_util.create_root_ca_cert(EdgeConstants.ROOT_CA_ID,
                                           validity_days_from_now=valid_days,
                                           subject_dict=EdgeConstants.CERT_DEFAULT_DICT,
-                                          passphrase=None)
+                                          passphrase=None,
+                                          key_algorithm=self.key_algorithm)
             cert_util.export_device_ca_cert_artifacts_to_dir(EdgeConstants.ROOT_CA_ID, self.certs_dir)
         else:
             cert_util.load_cert_from_file(EdgeConstants.ROOT_CA_ID, trusted_ca, trusted_ca_key, trusted_ca_key_passphase)
@@ -55,12 +86,55 @@ class EdgeCert(object):
                                               validity_days_from_now=valid_days,
                                               common_name='Edge Device CA',
                                               set_terminal_ca=False,
-                                              passphrase=None)
+                                              passphrase=None,
+                                              key_algorithm=self.key_algorithm)
         cert_util.export_device_ca_cert_artifacts_to_dir(EdgeConstants.DEVICE_CA_ID, self.certs_dir)
         cert_util.chain_device_ca_certs(EdgeConstants.DEVICE_CA_ID,
                                         [EdgeConstants.DEVICE_CA_ID, EdgeConstants.ROOT_CA_ID],
                                         self.certs_dir)
 
+    # Generate an IoT Edge device CA for each device, all signed by the same trusted CA.
+    # The trusted CA is created or loaded once, the device CA keys are generated by a pool of worker processes
+    # and every device gets its artifacts in its own sub folder.
+    @tracing.traced('edgecert.generate_device_ca_batch')
+    def generate_device_ca_batch(self, device_ids, valid_days, trusted_ca, trusted_ca_key, trusted_ca_key_passphase,
+                                 workers=None):
+        create_root_ca = not (trusted_ca and trusted_ca_key)
+        cert_util = self._create_cert_util()
+        key_specs = {}
+        if create_root_ca:
+            key_specs[EdgeConstants.ROOT_CA_ID] = EdgeCertUtil.get_key_spec(self.key_algorithm, EdgeCertUtil.CA_KEY_LEN)
+        else:
+            cert_util.load_cert_from_file(EdgeConstants.ROOT_CA_ID, trusted_ca, trusted_ca_key, trusted_ca_key_passphase)
+        for device_id in device_ids:
+            key_specs[device_id] = EdgeCertUtil.get_key_spec(self.key_algorithm, EdgeCertUtil.CA_KEY_LEN)
+        cert_util.pregenerate_key_pairs(key_specs, workers)
+
+        if create_root_ca:
+            cert_util.create_root_ca_cert(EdgeConstants.ROOT_CA_ID,
+                                          validity_days_from_now=valid_days,
+                                          subject_dict=EdgeConstants.CERT_DEFAULT_DICT,
+                                          passphrase=None,
+                                          key_algorithm=self.key_algorithm)
+            cert_util.export_device_ca_cert_artifacts_to_dir(EdgeConstants.ROOT_CA_ID, self.certs_dir)
+
+        for device_id in device_ids:
+            cert_util.create_intermediate_ca_cert(device_id, EdgeConstants.ROOT_CA_ID,
+                                                  validity_days_from_now=valid_days,
+                                                  common_name='Edge Device CA',
+                                                  set_terminal_ca=False,
+                                                  passphrase=None,
+                                                  key_algorithm=self.key_algorithm)
+            cert_util.export_device_ca_artifacts_with_chain(device_id, EdgeConstants.ROOT_CA_ID,
+                                                            EdgeConstants.DEVICE_CA_ID,
+                                                            self.get_device_certs_dir(device_id))
+
+    def _create_cert_util(self):
+        return EdgeCert._engine_dict[self.engine](key_pool=self.key_pool)
+
+    def get_device_certs_dir(self, device_id):
+        return os.path.join(self.certs_dir, device_id)
+
     def get_cert_file_path(self, id_str):
         return EdgeCertUtil.get_cert_file_path(id_str, self.certs_dir)
 
@@ -3,16 +3,24 @@
 
 
 import docker
+import hashlib
+import json
 import os
+import posixpath
 import time
 import tarfile
 from io import BytesIO
+from . import metrics, tracing
 from .errors import EdgeDeploymentError
 from .utils import Utils
 
 
 class EdgeDockerClient(object):
     _DOCKER_INFO_OS_TYPE_KEY = 'OSType'
+    _NETWORK_SETTINGS_LABEL = 'iotedgehubdev.network-settings'
+    _DEFAULT_NETWORK_SETTINGS = json.dumps({'options': {}, 'ipv6': False, 'internal': False}, sort_keys=True)
+    # SHA-256 of the files seeded into a volume, next to them
+    SEED_MANIFEST = '.iotedgehubdev-seed.json'
 
     def __init__(self, docker_client=None):
         if docker_client is not None:
@@ -31,12 +39,15 @@ class EdgeDockerClient(object):
         if self._client is not None:
             self._client.api.close()
 
+    @tracing.traced('docker.stop_remove_by_label')
     def stop_remove_by_label(self, label):
         try:
             filter_dict = {'label': label}
-            containers = self._client.containers.list(all=True, filters=filter_dict)
+            with metrics.timed('docker containers.list'):
+                containers = self._client.containers.list(all=True, filters=filter_dict)
             for container in containers:
-                container.stop()
+                with metrics.timed('docker container.stop'):
+                    container.stop()
                 self.remove(container.name)
         except docker.errors.APIError as ex:
             msg = 'Could not stop and remove containers by label: {0}'.format(label)
@@ -45,12 +56,14 @@ class EdgeDockerClient(object):
     def get_local_image_sha_id(self, image):
         local_id = None
         try:
-            inspect_dict = self._client.api.inspect_image(image)
+            with metrics.timed('docker inspect_image'):
+                inspect_dict = self._client.api.inspect_image(image)
             local_id = inspect_dict['Id']
         except docker.errors.APIError:
             local_id = None
         return local_id
 
+    @tracing.traced('docker.pull')
     def pull(self, image, username, password):
         old_id = self.get_local_image_sha_id(image)
         try:
@@ -58,9 +71,11 @@ class EdgeDockerClient(object):
             auth_dict = None
             if username is not None:
                 auth_dict = {'username': username, 'password': password}
-            self._client.images.pull(image, auth_config=auth_dict)
+            with metrics.timed('docker images.pull'):
+                self._client.images.pull(image, auth_config=auth_dict)
             if old_id is not None:
-                inspect_dict = self._client.api.inspect_image(image)
+                with metrics.timed('docker inspect_image'):
+                    inspect_dict = self._client.api.inspect_image(image)
                 new_id = inspect_dict['Id']
                 if new_id == old_id:
                     is_updated = False
@@ -75,9 +90,57 @@ class EdgeDockerClient(object):
         if imageId is None:
             return self.pull(image, username, password)
 
+    @tracing.traced('docker.save_images')
+    def save_images(self, images, chunk_size=docker.constants.DEFAULT_DATA_CHUNK_SIZE):
+        """A generator of the chunks of one tarball holding all the images, like `docker save`.
+
+        Layers shared by several images are stored once."""
+        api = self._client.api
+        try:
+            with metrics.timed('docker images.get'):
+                # docker-py only exposes the single image form of this endpoint
+                res = api._get(api._url('/images/get'), params={'names': images}, stream=True)
+                api._raise_for_status(res)
+            return api._stream_raw_result(res, chunk_size, False)
+        except docker.errors.APIError as ex:
+            msg = 'Could not save images: {0}'.format(', '.join(images))
+            raise EdgeDeploymentError(msg, ex)
+
+    @tracing.traced('docker.load_images')
+    def load_images(self, data):
+        """Load a tarball written by save_images or `docker save` from a file object, without reading it
+        into memory. Returns the names of the images loaded."""
+        loaded = []
+        try:
+            with metrics.timed('docker images.load'):
+                for message in self._client.api.load_image(data):
+                    if 'error' in message:
+                        raise EdgeDeploymentError('Could not load images: {0}'.format(message['error']))
+                    stream = message.get('stream', '').strip()
+                    for prefix in ['Loaded image: ', 'Loaded image ID: ']:
+                        if stream.startswith(prefix):
+                            loaded.append(stream[len(prefix):])
+            return loaded
+        except docker.errors.APIError as ex:
+            raise EdgeDeploymentError('Could not load images', ex)
+
+    @tracing.traced('docker.login')
+    def login(self, username, password, registry):
+        """Log in to the registry without touching the Docker config, unless it already holds credentials of
+        the same user for it. Returns the auth config to pull from the registry with."""
+        try:
+            with metrics.timed('docker login'):
+                self._client.login(username=username, password=password, registry=registry)
+            return {'username': username, 'password': password}
+        except docker.errors.APIError as ex:
+            msg = 'Could not log in to {0}'.format(registry)
+            raise EdgeDeploymentError(msg, ex)
+
+    @tracing.traced('docker.status')
     def status(self, container_name):
         try:
-            containers = self._client.containers.list(all=True)
+            with metrics.timed('docker containers.list'):
+                containers = self._client.containers.list(all=True)
             for container in containers:
                 if container_name == container.name:
                     return container.status
@@ -86,40 +149,113 @@ class EdgeDockerClient(object):
             msg = 'Error while checking status for: {0}'.format(container_name)
             raise EdgeDeploymentError(msg, ex)
 
+    @tracing.traced('docker.get_container_state')
+    def get_container_state(self, container_name):
+        """The State of the container as docker inspect shows it, with Status and Health, or None if there is no
+        such container."""
+        try:
+            with metrics.timed('docker containers.get'):
+                return self._client.containers.get(container_name).attrs.get('State')
+        except docker.errors.NotFound:
+            return None
+        except docker.errors.APIError as ex:
+            msg = 'Error while checking state for: {0}'.format(container_name)
+            raise EdgeDeploymentError(msg, ex)
+
+    @tracing.traced('docker.stop')
     def stop(self, container_name):
         self._exec_container_method(container_name, 'stop')
 
+    @tracing.traced('docker.start')
     def start(self, container_name):
         self._exec_container_method(container_name, 'start')
 
+    @tracing.traced('docker.remove')
     def remove(self, container_name):
         self._exec_container_method(container_name, 'remove')
 
-    def create_network(self, network_name):
-        create_network = False
+    @tracing.traced('docker.get_container_logs')
+    def get_container_logs(self, container_name, since=None):
+        container = self._get_container_by_name(container_name)
         try:
-            networks = self._client.networks.list(names=[network_name])
-            if networks:
-                num_networks = len(networks)
-                if num_networks == 0:
-                    create_network = True
-            else:
-                create_network = True
-            if create_network is True:
-                os_name = self.get_os_type()
-                if os_name == 'windows':
-                    return self._client.networks.create(network_name, driver='nat')
-                else:
-                    return self._client.networks.create(network_name, driver='bridge')
+            with metrics.timed('docker container.logs'):
+                logs = container.logs(timestamps=True, since=since)
+            return logs.decode('utf-8', errors='replace')
+        except docker.errors.APIError as ex:
+            msg = 'Could not get logs of container: {0}'.format(container_name)
+            raise EdgeDeploymentError(msg, ex)
+
+    def stream_container_logs(self, container_name, follow=True, since=None, tail='all'):
+        """A generator of timestamped log chunks of the container, stdout and stderr merged."""
+        try:
+            with metrics.timed('docker container.logs'):
+                return self._client.api.logs(container_name, stream=True, follow=follow, timestamps=True,
+                                             since=since, tail=tail)
+        except docker.errors.APIError as ex:
+            msg = 'Could not get logs of container: {0}'.format(container_name)
+            raise EdgeDeploymentError(msg, ex)
+
+    def stream_container_stats(self, container_name):
+        """A generator of the decoded resource usage samples Docker sends about once a second."""
+        try:
+            with metrics.timed('docker container.stats'):
+                return self._client.api.stats(container_name, stream=True, decode=True)
+        except docker.errors.APIError as ex:
+            msg = 'Could not get stats of container: {0}'.format(container_name)
+            raise EdgeDeploymentError(msg, ex)
+
+    @tracing.traced('docker.list_containers_by_label')
+    def list_containers_by_label(self, label, all=False):
+        """Names of the containers carrying the label, running ones only unless all is set."""
+        try:
+            with metrics.timed('docker containers.list'):
+                containers = self._client.containers.list(all=all, filters={'label': label})
+            return sorted(container.name for container in containers)
+        except docker.errors.APIError as ex:
+            msg = 'Could not list containers with label: {0}'.format(label)
+            raise EdgeDeploymentError(msg, ex)
+
+    def get_container_image(self, container_name):
+        container = self._get_container_by_name(container_name)
+        return container.attrs['Config']['Image']
+
+    @tracing.traced('docker.create_network')
+    def create_network(self, network_name, mtu=None, driver_opts=None, ipv6=False, internal=False):
+        """Create the network unless it exists with the same options. A network created with other options is
+        removed and created again, so it must have no containers attached."""
+        options = dict(driver_opts or {})
+        if mtu is not None:
+            options['com.docker.network.driver.mtu'] = str(mtu)
+        # Docker adds options of its own on some platforms, so the options asked for are kept in a label
+        settings = json.dumps({'options': options, 'ipv6': ipv6, 'internal': internal}, sort_keys=True)
+        try:
+            with metrics.timed('docker networks.list'):
+                networks = self._client.networks.list(names=[network_name])
+            for network in networks:
+                if network.name != network_name:
+                    continue
+                labels = network.attrs.get('Labels') or {}
+                if labels.get(EdgeDockerClient._NETWORK_SETTINGS_LABEL, EdgeDockerClient._DEFAULT_NETWORK_SETTINGS) == settings:
+                    return None
+                with metrics.timed('docker network.remove'):
+                    network.remove()
+            os_name = self.get_os_type()
+            driver = 'nat' if os_name == 'windows' else 'bridge'
+            with metrics.timed('docker networks.create'):
+                return self._client.networks.create(network_name, driver=driver, options=options or None,
+                                                    enable_ipv6=ipv6, internal=internal,
+                                                    labels={EdgeDockerClient._NETWORK_SETTINGS_LABEL: settings})
         except docker.errors.APIError as ex:
             msg = 'Could not create docker network: {0}'.format(network_name)
             raise EdgeDeploymentError(msg, ex)
 
+    @tracing.traced('docker.create_volume')
     def create_volume(self, volume_name):
         try:
             volume = self._get_volume_if_exists(volume_name)
             if volume is None:
-                return self._client.volumes.create(volume_name)
+                with metrics.timed('docker volumes.create'):
+                    return self._client.volumes.create(volume_name)
         except docker .errors.APIError as ex:
             msg = 'Docker volume create failed for: {0}'.format(volume_name)
             raise EdgeDeploymentError(msg, ex)
@@ -129,9 +265,11 @@ class EdgeDockerClient(object):
             nw_name: self._client.api.create_endpoint_config(*args, **kwargs)
         })
 
+    @tracing.traced('docker.create_container')
     def create_container(self, image, **kwargs):
         try:
-            return self._client.api.create_container(image, **kwargs)
+            with metrics.timed('docker create_container'):
+                return self._client.api.create_container(image, **kwargs)
         except docker.errors.ContainerError as ex_ctr:
             msg = 'Container exited with errors: {0}'.format(kwargs.get('name', None))
             raise EdgeDeploymentError(msg, ex_ctr)
@@ -149,6 +287,7 @@ class EdgeDockerClient(object):
             msg = 'docker create host config failed'
             raise EdgeDeploymentError(msg, ex)
 
+    @tracing.traced('docker.copy_file_to_volume')
     def copy_file_to_volume(self,
                             container_name,
                             volume_name,
@@ -163,37 +302,160 @@ class EdgeDockerClient(object):
                                            volume_dest_dir_path,
                                            host_src_file)
 
+    @tracing.traced('docker.seed_volume')
+    def seed_volume(self, container_name, volume_name, volume_dest_dir_path, files):
+        """Copy the (volume_dest_file_name, host_src_file) pairs into the volume, skipping those whose content it
+        already has according to its seed manifest. The changed files and the manifest are copied in one archive.
+
+        Returns the names and bytes of the files copied and skipped."""
+        windows = self.get_os_type() == 'windows'
+        report = {'copied': [], 'skipped': [], 'copiedBytes': 0, 'skippedBytes': 0}
+        try:
+            if windows:
+                with metrics.timed('docker inspect_volume'):
+                    volume_dest_dir_path = self._client.api.inspect_volume(volume_name)['Mountpoint'].replace('\\\\', '\\')
+                manifest = self._read_volume_manifest_from_mount(volume_dest_dir_path)
+            else:
+                container = self._get_container_by_name(container_name)
+                manifest = EdgeDockerClient._read_volume_manifest_from_container(container, volume_dest_dir_path)
+
+            contents = []
+            for volume_dest_file_name, host_src_file in files:
+                with open(host_src_file, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                if manifest.get(volume_dest_file_name) == digest:
+                    report['skipped'].append(volume_dest_file_name)
+                    report['skippedBytes'] += len(data)
+                else:
+                    contents.append((volume_dest_file_name, data, 0o444))
+                    manifest[volume_dest_file_name] = digest
+                    report['copied'].append(volume_dest_file_name)
+                    report['copiedBytes'] += len(data)
+            if not contents:
+                return report
+
+            contents.append((EdgeDockerClient.SEED_MANIFEST, json.dumps(manifest, sort_keys=True).encode('utf-8'), 0o644))
+            if windows:
+                # A read-only file cannot be replaced on Windows
+                for volume_dest_file_name, data, _ in contents:
+                    Utils.write_file_atomic(os.path.join(volume_dest_dir_path, volume_dest_file_name), data, 0o644)
+            else:
+                tar_stream = BytesIO()
+                with tarfile.TarFile(fileobj=tar_stream, mode='w') as container_tar_file:
+                    for volume_dest_file_name, data, file_mode in contents:
+                        archive_info = tarfile.TarInfo(name=volume_dest_file_name)
+                        archive_info.size = len(data)
+                        archive_info.mtime = time.time()
+                        archive_info.mode = file_mode
+                        container_tar_file.addfile(archive_info, BytesIO(data))
+                tar_stream.seek(0)
+                with metrics.timed('docker put_archive'):
+                    container.put_archive(volume_dest_dir_path, tar_stream)
+            return report
+        except docker.errors.APIError as docker_ex:
+            msg = 'Seeding failed for volume: {0}'.format(volume_name)
+            raise EdgeDeploymentError(msg, docker_ex)
+        except (OSError, IOError) as ex_os:
+            msg = 'File IO error seen seeding volume: {0}. ' \
+                  'Errno: {1}, Error {2}'.format(volume_name, str(ex_os.errno), ex_os.strerror)
+            raise EdgeDeploymentError(msg, ex_os)
+
+    @staticmethod
+    def _parse_volume_manifest(data):
+        try:
+            manifest = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    @staticmethod
+    def _read_volume_manifest_from_mount(mount_path):
+        manifest_file = os.path.join(mount_path, EdgeDockerClient.SEED_MANIFEST)
+        if not os.path.isfile(manifest_file):
+            return {}
+        with open(manifest_file, 'rb') as f:
+            return EdgeDockerClient._parse_volume_manifest(f.read())
+
+    @tracing.traced('docker.get_volume_manifest')
+    def get_volume_manifest(self, container_name, volume_dir_path):
+        """The seed manifest of the volume mounted at volume_dir_path in the container, empty if it has none."""
+        try:
+            container = self._get_container_by_name(container_name)
+            return EdgeDockerClient._read_volume_manifest_from_container(container, volume_dir_path)
+        except docker.errors.APIError as docker_ex:
+            msg = 'Container get_archive failed for container: {0}'.format(container_name)
+            raise EdgeDeploymentError(msg, docker_ex)
+
+    @tracing.traced('docker.put_archive')
+    def put_archive(self, container_name, path, data):
+        """Extract the tar archive into path in the container. data can be a generator of chunks, which is streamed
+        to the Docker daemon as it is produced."""
+        try:
+            container = self._get_container_by_name(container_name)
+            with metrics.timed('docker put_archive'):
+                if not container.put_archive(path, data):
+                    raise EdgeDeploymentError('Container put_archive failed for container: {0}'.format(container_name))
+        except docker.errors.APIError as docker_ex:
+            msg = 'Container put_archive failed for container: {0}'.format(container_name)
+            raise EdgeDeploymentError(msg, docker_ex)
+        except (OSError, IOError) as ex_os:
+            msg = 'File IO error seen during put archive for container: {0}. ' \
+                  'Errno: {1}, Error {2}'.format(container_name, str(ex_os.errno), ex_os.strerror)
+            raise EdgeDeploymentError(msg, ex_os)
+
+    @staticmethod
+    def _read_volume_manifest_from_container(container, volume_dir_path):
+        try:
+            with metrics.timed('docker get_archive'):
+                chunks, _ = container.get_archive(posixpath.join(volume_dir_path, EdgeDockerClient.SEED_MANIFEST))
+                archive = BytesIO(b''.join(chunks))
+        except docker.errors.NotFound:
+            return {}
+        with tarfile.open(fileobj=archive) as tar_file:
+            member = tar_file.next()
+            manifest_file = tar_file.extractfile(member) if member is not None else None
+            return EdgeDockerClient._parse_volume_manifest(manifest_file.read()) if manifest_file is not None else {}
+
+    @tracing.traced('docker.get_os_type')
     def get_os_type(self):
         try:
-            info = self._client.info()
+            with metrics.timed('docker info'):
+                info = self._client.info()
             return info[EdgeDockerClient._DOCKER_INFO_OS_TYPE_KEY].lower()
         except docker.errors.APIError as ex:
             msg = 'Docker daemon returned error'
             raise EdgeDeploymentError(msg, ex)
 
+    @tracing.traced('docker.destroy_network')
     def destroy_network(self, network_name):
         try:
-            networks = self._client.networks.list(names=[network_name])
+            with metrics.timed('docker networks.list'):
+                networks = self._client.networks.list(names=[network_name])
             if networks is not None:
                 for network in networks:
                     if network.name == network_name:
-                        network.remove()
+                        with metrics.timed('docker network.remove'):
+                            network.remove()
         except docker.errors.APIError as ex:
             msg = 'Could not remove docker network: {0}'.format(network_name)
             raise EdgeDeploymentError(msg, ex)
 
+    @tracing.traced('docker.remove_volume')
     def remove_volume(self, volume_name, force=False):
         try:
             volume = self._get_volume_if_exists(volume_name)
             if volume is not None:
-                volume.remove(force)
+                with metrics.timed('docker volume.remove'):
+                    volume.remove(force)
         except docker.errors.APIError as ex:
             msg = 'Docker volume remove failed for: {0}, force flag: {1}'.format(volume_name, force)
             raise EdgeDeploymentError(msg, ex)
 
     def _get_volume_if_exists(self, name):
         try:
-            return self._client.volumes.get(name)
+            with metrics.timed('docker volumes.get'):
+                return self._client.volumes.get(name)
         except docker.errors.NotFound:
             return None
         except docker.errors.APIError as ex:
@@ -203,14 +465,16 @@ class EdgeDockerClient(object):
     def _exec_container_method(self, container_name, method, **kwargs):
         container = self._get_container_by_name(container_name)
         try:
-            getattr(container, method)(**kwargs)
+            with metrics.timed('docker container.{0}'.format(method)):
+                getattr(container, method)(**kwargs)
         except docker.errors.APIError as ex:
             msg = 'Could not {0} container: {1}'.format(method, container_name)
             raise EdgeDeploymentError(msg, ex)
 
     def _get_container_by_name(self, container_name):
         try:
-            return self._client.containers.get(container_name)
+            with metrics.timed('docker containers.get'):
+                return self._client.containers.get(container_name)
         except docker.errors.NotFound as nf_ex:
             msg = 'Could not find container by name {0}'.format(container_name)
             raise EdgeDeploymentError(msg, nf_ex)
@@ -220,7 +484,8 @@ class EdgeDockerClient(object):
 
     def _insert_file_in_volume_mount(self, volume_name, host_src_file, volume_dest_file_name):
         try:
-            volume_info = self._client.api.inspect_volume(volume_name)
+            with metrics.timed('docker inspect_volume'):
+                volume_info = self._client.api.inspect_volume(volume_name)
             Utils.copy_files(host_src_file.replace('\\\\', '\\'),
                              os.path.join(volume_info['Mountpoint'].replace('\\\\', '\\'), volume_dest_file_name))
         except docker.errors.APIError as docker_ex:
@@ -239,7 +504,8 @@ class EdgeDockerClient(object):
         try:
             (tar_stream, dest_archive_info, container_tar_file) = \
                 EdgeDockerClient.create_tar_objects(volume_dest_file_name)
-            file_data = open(host_src_file, 'rb').read()
+            with open(host_src_file, 'rb') as f:
+                file_data = f.read()
             dest_archive_info.size = len(file_data)
             dest_archive_info.mtime = time.time()
             dest_archive_info.mode = 0o444
@@ -247,7 +513,8 @@ class EdgeDockerClient(object):
             container_tar_file.close()
             tar_stream.seek(0)
             container = self._get_container_by_name(container_name)
-            container.put_archive(volume_dest_dir_path, tar_stream)
+            with metrics.timed('docker put_archive'):
+                container.put_archive(volume_dest_dir_path, tar_stream)
         except docker.errors.APIError as docker_ex:
             msg = 'Container put_archive failed for container: {0}'.format(container_name)
             raise EdgeDeploymentError(msg, docker_ex)
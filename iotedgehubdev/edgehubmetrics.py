@@ -0,0 +1,206 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import collections
+import json
+import re
+import time
+
+import requests
+
+from .utils import Utils
+
+
+class EdgeHubMetrics(object):
+    """Scrapes the Prometheus metrics edgeHub exposes on port 9600 into an in-memory time series.
+
+    Only the last `retention` scrapes are kept, so memory stays bounded however long it runs. Counters are
+    summarized as their increase over the retained scrapes, which survives edgeHub restarting and resetting them."""
+    CONTAINER_PORT = 9600
+    # edgeHub images before 1.0.10 only expose metrics with these experimental features enabled
+    ENV = ['experimentalFeatures__enabled=true', 'experimentalFeatures__enableMetrics=true']
+    DEFAULT_RETENTION = 720
+    THROUGHPUT = collections.OrderedDict([
+        ('received', 'edgehub_messages_received_total'),
+        ('sent', 'edgehub_messages_sent_total')
+    ])
+    QUEUE_LENGTH = 'edgehub_queue_length'
+    DROPS = ['edgehub_messages_dropped_total', 'edgehub_messages_unack_total', 'edgehub_offline_count_total',
+             'edgehub_client_connect_failed_total']
+    SEND_DURATION = 'edgehub_message_send_duration_seconds'
+    _sample_pattern = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)(?:\s+-?\d+)?$')
+    _label_pattern = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+    _escapes = {'\\\\': '\\', '\\"': '"', '\\n': '\n'}
+
+    def __init__(self, url, retention=DEFAULT_RETENTION, timeout=5):
+        self._url = url
+        self._timeout = timeout
+        self._session = requests.Session()
+        self._series = collections.deque(maxlen=retention)
+
+    @staticmethod
+    def get_metrics_url(port):
+        return 'http://localhost:{0}/metrics'.format(port)
+
+    @staticmethod
+    def parse(text):
+        """Parse the Prometheus text exposition format into {(name, ((label, value), ...)): value}."""
+        samples = {}
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = EdgeHubMetrics._sample_pattern.match(line)
+            if match is None:
+                continue
+            try:
+                value = float(match.group(3))
+            except ValueError:
+                continue
+            labels = tuple(sorted(
+                (name, re.sub(r'\\[\\"n]', lambda escape: EdgeHubMetrics._escapes[escape.group(0)], label_value))
+                for name, label_value in EdgeHubMetrics._label_pattern.findall(match.group(2) or '')))
+            samples[(match.group(1), labels)] = value
+        return samples
+
+    @property
+    def scrapes(self):
+        return len(self._series)
+
+    def scrape(self, now=None):
+        response = self._session.get(self._url, timeout=self._timeout)
+        response.raise_for_status()
+        self.add_scrape(EdgeHubMetrics.parse(response.text), now)
+
+    def add_scrape(self, samples, now=None):
+        self._series.append((time.time() if now is None else now, samples))
+
+    def get_summary(self):
+        """Throughput, queue depth, drop counters and send latency over the retained scrapes."""
+        if not self._series:
+            return None
+        first_time, first = self._series[0]
+        last_time, last = self._series[-1]
+        elapsed = last_time - first_time
+
+        throughput = collections.OrderedDict()
+        for key, name in EdgeHubMetrics.THROUGHPUT.items():
+            increase = EdgeHubMetrics._increase(first, last, name)
+            throughput[key] = {
+                'total': EdgeHubMetrics._sum(last, name),
+                'increase': increase,
+                'rate': increase / elapsed if elapsed > 0 else 0.0
+            }
+
+        queues = {}
+        for _, samples in self._series:
+            depths = {}
+            for (name, labels), value in samples.items():
+                if name == EdgeHubMetrics.QUEUE_LENGTH:
+                    endpoint = dict(labels).get('endpoint', '')
+                    depths[endpoint] = depths.get(endpoint, 0) + value
+            for endpoint, depth in depths.items():
+                queue = queues.setdefault(endpoint, {'current': 0, 'peak': 0})
+                queue['peak'] = max(queue['peak'], depth)
+        for endpoint, queue in queues.items():
+            queue['current'] = sum(value for (name, labels), value in last.items()
+                                   if name == EdgeHubMetrics.QUEUE_LENGTH and dict(labels).get('endpoint', '') == endpoint)
+
+        drops = {}
+        for name in EdgeHubMetrics.DROPS:
+            drops[name] = {'total': EdgeHubMetrics._sum(last, name), 'increase': EdgeHubMetrics._increase(first, last, name)}
+
+        # The quantiles of the slowest endpoint
+        latency = {}
+        for (name, labels), value in last.items():
+            quantile = dict(labels).get('quantile')
+            if name == EdgeHubMetrics.SEND_DURATION and quantile is not None and value == value:
+                latency[quantile] = max(latency.get(quantile, 0.0), value)
+
+        return {
+            'scrapes': len(self._series),
+            'elapsed': elapsed,
+            'throughput': throughput,
+            'queues': queues,
+            'drops': drops,
+            'sendLatency': latency
+        }
+
+    def get_snapshot(self):
+        """The summary and the last scrape, to compare with another run later."""
+        samples = self._series[-1][1] if self._series else {}
+        return {
+            'url': self._url,
+            'time': self._series[-1][0] if self._series else None,
+            'summary': self.get_summary(),
+            'metrics': [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(samples.items())]
+        }
+
+    def export_snapshot(self, file_path):
+        Utils.write_file_atomic(file_path, json.dumps(self.get_snapshot(), indent=2))
+
+    @staticmethod
+    def load_snapshot(file_path):
+        with open(file_path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def format_summary(summary):
+        lines = []
+        for key, stats in summary['throughput'].items():
+            lines.append('Messages {0}: {1:.0f} total, {2:.0f} in the last {3:.0f}s ({4:.1f} msg/s)'.format(
+                key, stats['total'], stats['increase'], summary['elapsed'], stats['rate']))
+        for endpoint, queue in sorted(summary['queues'].items()):
+            lines.append('Queue {0}: {1:.0f} now, {2:.0f} peak'.format(endpoint or '(all)', queue['current'], queue['peak']))
+        for name, stats in sorted(summary['drops'].items()):
+            if stats['total'] or stats['increase']:
+                lines.append('{0}: {1:.0f} total, {2:.0f} in the last {3:.0f}s'.format(
+                    name, stats['total'], stats['increase'], summary['elapsed']))
+        if summary['sendLatency']:
+            lines.append('Send latency (ms): {0}'.format(', '.join(
+                'q{0} {1:.1f}'.format(quantile, value * 1000)
+                for quantile, value in sorted(summary['sendLatency'].items(), key=lambda item: float(item[0])))))
+        return lines
+
+    @staticmethod
+    def format_comparison(baseline, summary):
+        """Lines comparing the summary of a baseline snapshot with the current one."""
+        rows = []
+        for key in summary['throughput']:
+            rows.append(('{0} msg/s'.format(key), baseline['throughput'].get(key, {}).get('rate'),
+                         summary['throughput'][key]['rate']))
+        for endpoint in sorted(set(baseline['queues']) | set(summary['queues'])):
+            rows.append(('queue peak {0}'.format(endpoint or '(all)'), baseline['queues'].get(endpoint, {}).get('peak'),
+                         summary['queues'].get(endpoint, {}).get('peak')))
+        for name in sorted(summary['drops']):
+            rows.append((name, baseline['drops'].get(name, {}).get('increase'), summary['drops'][name]['increase']))
+        for quantile in sorted(set(baseline['sendLatency']) | set(summary['sendLatency']), key=float):
+            before, after = [value * 1000 if value is not None else None
+                             for value in [baseline['sendLatency'].get(quantile), summary['sendLatency'].get(quantile)]]
+            rows.append(('send latency q{0} (ms)'.format(quantile), before, after))
+
+        lines = ['{0:<44} {1:>12} {2:>12} {3:>9}'.format('METRIC', 'BASELINE', 'CURRENT', 'CHANGE')]
+        for name, before, after in rows:
+            change = '-'
+            if before and after is not None:
+                change = '{0:+.1%}'.format((after - before) / before)
+            lines.append('{0:<44} {1:>12} {2:>12} {3:>9}'.format(
+                name, *['{0:.1f}'.format(value) if value is not None else '-' for value in [before, after]] + [change]))
+        return lines
+
+    @staticmethod
+    def _sum(samples, metric):
+        return sum(value for (name, labels), value in samples.items() if name == metric)
+
+    @staticmethod
+    def _increase(first, last, metric):
+        increase = 0
+        for key, value in last.items():
+            if key[0] != metric:
+                continue
+            before = first.get(key, 0)
+            # A counter lower than before was reset by edgeHub restarting
+            increase += value - before if value >= before else value
+        return increase
@@ -4,23 +4,32 @@
 
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import docker
 import requests
+import yaml
 
-from .composeproject import ComposeProject
+from . import filelock, metrics, tracing
+from .composeproject import DEFAULT_STARTUP_ORDER, ComposeProject
 from .constants import EdgeConstants as EC
 from .edgecert import EdgeCert
 from .edgedockerclient import EdgeDockerClient
+from .edgehubmetrics import EdgeHubMetrics
 from .errors import ResponseError, RegistriesLoginError
 from .hostplatform import HostPlatform
+from .instance import EdgeInstance
+from .taskgraph import TaskGraph
 from .utils import Utils
+from .volumeseeder import VolumeSeeder
 
 
 class EdgeManager(object):
     TWIN_API_VERSION = '2020-05-31-preview'
     LABEL = 'iotedgehubdev'
     EDGEHUB_IMG = 'mcr.microsoft.com/azureiotedge-hub:{0}'
+    MAX_LOGIN_WORKERS = 8
     TESTUTILITY_IMG = 'mcr.microsoft.com/azureiotedge-testing-utility:1.0.0'
     EDGEHUB_MODULE = '$edgeHub'
     EDGEHUB = 'edgeHubDev'
@@ -39,9 +48,16 @@ class EdgeManager(object):
     HUB_SSLCRT_ENV = 'SSL_CERTIFICATE_NAME=edge-hub-server.cert.pfx'
     CERT_HELPER = 'cert_helper'
     HELPER_IMG = 'hello-world:latest'
+    SEED_HELPER = '{0}_seed_helper'
+    SEED_MOUNT = '/seed'
+    # How long each group of modules of a staged startup may take to be running, and how often it is checked
+    STARTUP_TIMEOUT = 300
+    STARTUP_POLL_INTERVAL = 0.5
     COMPOSE_FILE = os.path.join(HostPlatform.get_share_data_path(), 'docker-compose.yml')
+    # Either the requests module or a requests.Session reusing connections to IoT Hub
+    _http = requests
 
-    def __init__(self, connection_str, gatewayhost, cert_path, hub_conn_str=None):
+    def __init__(self, connection_str, gatewayhost, cert_path, hub_conn_str=None, instance=None):
         connection_str_dict = Utils.parse_connection_strs(connection_str, hub_conn_str)
         self._hostname = connection_str_dict[EC.HOSTNAME_KEY]
         self._device_id = connection_str_dict[EC.DEVICE_ID_KEY]
@@ -53,89 +69,212 @@ class EdgeManager(object):
         self._edge_cert = EdgeCert(self._cert_path, self._gatewayhost)
         self._hub_access_key = connection_str_dict.get(EC.HUB_ACCESS_KEY_KEY)
         self._hub_access_name = connection_str_dict.get(EC.ACCESS_KEY_NAME)
+        self._instance = instance if instance is not None else EdgeInstance()
+        self._credential_cache = None
+        self._credential_ttl = None
+        self._host_ports = {}
+        self._metrics_port = None
+        self._pull_images = True
+        self._registry_auths = {}
+        self._network_options = {}
+        # The compose services of the solution, the stopped ones and the image pull policy of each
+        self._services = []
+        self._stopped_services = []
+        self._pull_policies = {}
+        self._startup_orders = {}
+        self._nw_name = self._instance.get_resource_name(EdgeManager.NW_NAME)
+        self._hub_volume = self._instance.get_resource_name(EdgeManager.HUB_VOLUME)
+        self._module_volume = self._instance.get_resource_name(EdgeManager.MODULE_VOLUME)
+        self._label = self._instance.get_resource_name(EdgeManager.LABEL)
+        self._edgehub_container = self._instance.get_resource_name(EdgeManager.EDGEHUB)
+        self._cert_helper = self._instance.get_resource_name(EdgeManager.CERT_HELPER)
 
     @property
     def hostname(self):
         return self._hostname
 
     @staticmethod
-    def stop(edgedockerclient=None):
+    @tracing.traced('edgemanager.stop')
+    def stop(edgedockerclient=None, instance=None):
         if edgedockerclient is None:
             edgedockerclient = EdgeDockerClient()
+        if instance is None:
+            instance = EdgeInstance()
 
+        with instance.get_runtime_lock():
+            EdgeManager._stop(edgedockerclient, instance)
+
+    @staticmethod
+    def _stop(edgedockerclient, instance):
+        # The caller holds the runtime lock, possibly on another thread
         compose_err = None
         label_err = None
         try:
-            if os.path.exists(EdgeManager.COMPOSE_FILE):
-                cmd = "docker-compose -f {0} down".format(EdgeManager.COMPOSE_FILE)
-                Utils.exe_proc(cmd.split())
+            if os.path.exists(instance.get_compose_file_path()):
+                with tracing.span('compose.down'):
+                    Utils.exe_proc(instance.get_compose_cmd('down'))
         except Exception as e:
             compose_err = e
 
         try:
-            edgedockerclient.stop_remove_by_label(EdgeManager.LABEL)
+            edgedockerclient.stop_remove_by_label(instance.get_resource_name(EdgeManager.LABEL))
         except Exception as e:
             label_err = e
 
+        instance.delete_state()
+
         if compose_err or label_err:
             raise Exception('{0}{1}'.format(
                 '' if compose_err is None else str(compose_err),
                 '' if label_err is None else str(label_err)))
 
-    def start_singlemodule(self, inputs, port, envs, edgehub_image_version):
-        edgedockerclient = EdgeDockerClient()
+    def start_singlemodule(self, inputs, port, envs, edgehub_image_version, edgedockerclient=None, metrics_port=None,
+                           pull=True, producers=1, network_options=None):
+        """Start edgeHub and the input modules. Returns the timeline of the start steps.
+
+        Each input module is a producer with its own identity, container and host port, the first one on port and
+        the next ones on the following ports, or free ports for a named instance."""
+        if edgedockerclient is None:
+            edgedockerclient = EdgeDockerClient()
         mount_base = self._obtain_mount_path(edgedockerclient)
         if mount_base is None:
             raise Exception("OS Type is not supported")
 
-        EdgeManager.stop(edgedockerclient)
-        self._prepare(edgedockerclient)
+        EdgeManager._check_network_options(network_options, mount_base, producers)
+        edgehub_image = EdgeManager.EDGEHUB_IMG.format(edgehub_image_version)
+        producer_names = EdgeManager.get_producer_names(producers)
+        producer_ports = [port] + [self._instance.get_host_port(port + index) for index in range(1, producers)]
+        if (network_options or {}).get('hostNetwork'):
+            # The input module listens on the host directly
+            producer_ports = [3000]
+        routes = self._generateRoutesEnvFromInputs(inputs, producer_names)
+
+        def create_edge_hub(_, edgeHubConnStr, __):
+            return self._create_edge_hub(edgedockerclient, edgeHubConnStr, routes, mount_base, envs, edgehub_image,
+                                         metrics_port)
+
+        def create_input(name, producer_port):
+            # The producers share the module volume, so the first one copies the certificate for all
+            copy_cert = name == EdgeManager.INPUT
+            return lambda _, inputConnStr, __: self._create_input(edgedockerclient, name, inputConnStr, producer_port,
+                                                                  mount_base, copy_cert)
+
+        # Identities and image pulls do not depend on the old containers being gone, so they overlap the stop
+        graph = TaskGraph()
+        graph.add('stop', lambda: EdgeManager._stop(edgedockerclient, self._instance))
+        graph.add('prepare', lambda _: self._prepare(edgedockerclient), ['stop'])
+        graph.add('hub_identity', lambda: self.getOrAddModule(EdgeManager.EDGEHUB_MODULE, False))
+        for name in producer_names:
+            graph.add('{0}_identity'.format(name), lambda name=name: self.getOrAddModule(name, False))
+        graph.add('pull_hub', lambda: self._pull_image(edgedockerclient, edgehub_image))
+        graph.add('pull_input', lambda: edgedockerclient.pullIfNotExist(EdgeManager.TESTUTILITY_IMG, None, None))
+        graph.add('create_hub', create_edge_hub, ['prepare', 'hub_identity', 'pull_hub'])
+        for name, producer_port in zip(producer_names, producer_ports):
+            graph.add('create_{0}'.format(name), create_input(name, producer_port),
+                      ['prepare', '{0}_identity'.format(name), 'pull_input'])
+        graph.add('start_hub', lambda hub: edgedockerclient.start(hub[0]), ['create_hub'])
+        # The input modules connect to edgeHub, so they are still started second
+        for name in producer_names:
+            graph.add('start_{0}'.format(name), lambda input_id, *_: edgedockerclient.start(input_id),
+                      ['create_{0}'.format(name), 'start_hub', 'create_{0}'.format(EdgeManager.INPUT)])
+
+        with self._instance.get_runtime_lock():
+            # The daemon shares this manager between the starts of the instance, which the lock serializes
+            self._set_network_options(network_options)
+            self._pull_images = pull
+            # The containers copy the certificates in, so they must not change midway
+            with filelock.lock_for(self._cert_path, 'certificates'):
+                results = graph.run()
+            ports = {self._edgehub_container: results['create_hub'][1]}
+            producer_containers = [self._instance.get_resource_name(name) for name in producer_names]
+            for container, producer_port in zip(producer_containers, producer_ports):
+                ports[container] = {'3000': producer_port}
+            self._save_state({
+                'mode': 'singlemodule',
+                'ports': ports,
+                'producers': producer_containers
+            })
+        return graph.timeline
+
+    @property
+    def _host_network(self):
+        return bool(self._network_options.get('hostNetwork'))
+
+    def _set_network_options(self, network_options):
+        """Keep the network options for this start and the watch mode: mtu, driverOpts, ipv6, internal and hostNetwork."""
+        self._network_options = dict(network_options or {})
 
-        edgeHubConnStr = self.getOrAddModule(EdgeManager.EDGEHUB_MODULE, False)
-        inputConnStr = self.getOrAddModule(EdgeManager.INPUT, False)
-        routes = self._generateRoutesEnvFromInputs(inputs)
-        self._start_edge_hub(edgedockerclient, edgeHubConnStr, routes, mount_base, envs, edgehub_image_version)
+    @staticmethod
+    def _check_network_options(network_options, mount_base, producers=1):
+        if (network_options or {}).get('hostNetwork'):
+            if not mount_base.startswith('/'):
+                raise ValueError('Host networking is only supported for Linux containers.')
+            if producers > 1:
+                raise ValueError('Several producers need their own ports, which host networking does not allow.')
+
+    def _save_state(self, state):
+        if self._host_network:
+            state['hostNetwork'] = True
+        self._instance.save_state(state)
+
+    @staticmethod
+    def get_producer_names(producers):
+        """Module names of the input producers: input, input2, input3..."""
+        return [EdgeManager.INPUT] + ['{0}{1}'.format(EdgeManager.INPUT, index) for index in range(2, producers + 1)]
 
+    @tracing.traced('edgemanager.create_input')
+    def _create_input(self, edgedockerclient, name, inputConnStr, port, mount_base, copy_cert=True):
+        container_name = self._instance.get_resource_name(name)
         module_mount = EdgeManager.MODULE_MOUNT.format(mount_base)
-        edgedockerclient.pullIfNotExist(EdgeManager.TESTUTILITY_IMG, None, None)
-        network_config = edgedockerclient.create_config_for_network(EdgeManager.NW_NAME)
         inputEnv = [EdgeManager.MODULE_CA_ENV.format(mount_base), "EdgeHubConnectionString={0}".format(inputConnStr)]
-        input_host_config = edgedockerclient.create_host_config(
-            mounts=[docker.types.Mount(module_mount, EdgeManager.MODULE_VOLUME)],
-            port_bindings={
-                '3000': port
-            },
-            restart_policy={
-                'MaximumRetryCount': 3,
-                'Name': 'on-failure'
-            }
-        )
+        restart_policy = {
+            'MaximumRetryCount': 3,
+            'Name': 'on-failure'
+        }
+        if self._host_network:
+            network_config = None
+            # edgeHub listens on the host too, so the gateway host name resolves to the loopback
+            input_host_config = edgedockerclient.create_host_config(
+                mounts=[docker.types.Mount(module_mount, self._module_volume)],
+                network_mode='host',
+                extra_hosts={self._gatewayhost: '127.0.0.1'},
+                restart_policy=restart_policy
+            )
+        else:
+            network_config = edgedockerclient.create_config_for_network(self._nw_name)
+            input_host_config = edgedockerclient.create_host_config(
+                mounts=[docker.types.Mount(module_mount, self._module_volume)],
+                port_bindings={
+                    '3000': port
+                },
+                restart_policy=restart_policy
+            )
         inputContainer = edgedockerclient.create_container(
             EdgeManager.TESTUTILITY_IMG,
-            name=EdgeManager.INPUT,
+            name=container_name,
             volumes=[module_mount],
             host_config=input_host_config,
             networking_config=network_config,
             environment=inputEnv,
-            labels=[EdgeManager.LABEL],
+            labels=[self._label],
             ports=[(3000, 'tcp')]
         )
 
-        edgedockerclient.copy_file_to_volume(
-            EdgeManager.INPUT, EdgeManager.MODULE_VOLUME, self._device_cert(),
-            module_mount,
-            self._edge_cert.get_cert_file_path(EC.EDGE_DEVICE_CA))
-        edgedockerclient.start(inputContainer.get('Id'))
+        if copy_cert:
+            self._seed_volume(edgedockerclient, container_name, self._module_volume, module_mount, [
+                (self._device_cert(), self._edge_cert.get_cert_file_path(EC.EDGE_DEVICE_CA))])
+        return inputContainer.get('Id')
 
-    def config_solution(self, module_content, target, mount_base):
+    def config_solution(self, module_content, target, mount_base, output=None):
         module_names = [EdgeManager.EDGEHUB_MODULE]
         custom_modules = module_content['$edgeAgent']['properties.desired']['modules']
         for module_name in custom_modules:
             module_names.append(module_name)
 
         ConnStr_info = {}
-        for module_name in module_names:
-            ConnStr_info[module_name] = self.getOrAddModule(module_name, False)
+        with tracing.span('edgemanager.provision_identities'):
+            for module_name in module_names:
+                ConnStr_info[module_name] = self.getOrAddModule(module_name, False)
 
         env_info = {
             'hub_env': [
@@ -149,62 +288,190 @@ class EdgeManager(object):
                 EdgeManager.MODULE_CA_ENV.format(mount_base)
             ]
         }
+        if self._metrics_port is not None:
+            env_info['hub_env'].extend(EdgeHubMetrics.ENV)
 
         volume_info = {
             'HUB_MOUNT': EdgeManager.HUB_MOUNT.format(mount_base),
-            'HUB_VOLUME': EdgeManager.HUB_VOLUME,
-            'MODULE_VOLUME': EdgeManager.MODULE_VOLUME,
+            'HUB_VOLUME': self._hub_volume,
+            'MODULE_VOLUME': self._module_volume,
             'MODULE_MOUNT': EdgeManager.MODULE_MOUNT.format(mount_base)
         }
 
         network_info = {
-            'NW_NAME': EdgeManager.NW_NAME,
+            'NW_NAME': self._nw_name,
             'ALIASES': self._gatewayhost
         }
 
-        compose_project = ComposeProject(module_content)
+        compose_project = ComposeProject(module_content, output)
         compose_project.set_edge_info({
             'ConnStr_info': ConnStr_info,
             'env_info': env_info,
             'volume_info': volume_info,
             'network_info': network_info,
             'hub_name': EdgeManager.EDGEHUB,
-            'labels': EdgeManager.LABEL
+            'labels': self._label,
+            'container_prefix': self._instance.get_resource_name(''),
+            'metrics_port': self._metrics_port,
+            'host_network': self._host_network
         })
 
-        compose_project.compose()
-        compose_project.dump(target)
-
-    def start_solution(self, module_content, verbose, output):
-        try:
-            EdgeManager.login_registries(module_content)
-        except RegistriesLoginError as e:
-            output.warning(e.getmsg())
+        with tracing.span('compose.generate'):
+            compose_project.compose()
+            ports = compose_project.remap_host_ports(self._get_host_port)
+            compose_project.dump(target)
+        self._services = list(compose_project.Services)
+        self._stopped_services = compose_project.StoppedServices
+        self._pull_policies = compose_project.PullPolicies
+        self._startup_orders = compose_project.StartupOrders
+        return ports
+
+    def start_solution(self, module_content, verbose, output, edgedockerclient=None, metrics_port=None, pull=True,
+                       network_options=None):
+        if edgedockerclient is None:
+            edgedockerclient = EdgeDockerClient()
+        self._login_registries(module_content, edgedockerclient, output)
 
-        edgedockerclient = EdgeDockerClient()
         mount_base = self._obtain_mount_path(edgedockerclient)
         if not mount_base:
             raise Exception("OS Type is not supported")
 
-        EdgeManager.stop(edgedockerclient)
-        self._prepare(edgedockerclient)
-        self._prepare_cert(edgedockerclient, mount_base)
+        EdgeManager._check_network_options(network_options, mount_base)
+        with self._instance.get_runtime_lock():
+            # Kept for the watch mode regenerating the compose file, and set under the lock as in start_singlemodule
+            self._host_ports = {}
+            self._set_network_options(network_options)
+            self._metrics_port = metrics_port
+            self._pull_images = pull
+            EdgeManager.stop(edgedockerclient, self._instance)
+            self._prepare(edgedockerclient)
+            self._prepare_cert(edgedockerclient, mount_base)
+
+            with tracing.span('edgemanager.config_solution'):
+                ports = self.config_solution(module_content, self._instance.get_compose_file_path(), mount_base,
+                                             output)
+            self._save_state({'mode': 'solution', 'ports': ports})
+            try:
+                with tracing.span('edgemanager.update_module_twin'):
+                    self.update_module_twin(module_content)
+            except Exception as e:
+                output.warning(str(e))
+
+            if pull and self._pull_policies.get(EdgeManager.EDGEHUB) != 'never':
+                cmd_pull = self._instance.get_compose_cmd('pull', EdgeManager.EDGEHUB)
+                with tracing.span('compose.pull'):
+                    Utils.exe_proc(cmd_pull)
+            unavailable = self._pull_module_images(edgedockerclient, module_content, output=output)
+            running = self._compose_up(unavailable=unavailable, edgedockerclient=edgedockerclient, output=output)
+        if verbose:
+            # Attach to the containers started above outside of the lock, so that stop can run meanwhile
+            Utils.exe_proc(self._instance.get_compose_cmd(
+                'up', *([] if len(running) == len(self._services) else running)))
+
+    def _compose_up(self, names=None, unavailable=(), edgedockerclient=None, output=None):
+        """Start the services, or only the named ones without their dependencies. The modules whose desired status
+        is stopped are created but not started, and those whose image is unavailable are left out.
+
+        When the modules have several startupOrder values, and a Docker client is given to follow their state, they
+        are started in stages: edgeHub, then each group of modules once the previous one is running.
+
+        Returns the services started."""
+        services = [name for name in (self._services if names is None else names) if name not in unavailable]
+        running = [name for name in services if name not in self._stopped_services]
+        stopped = [name for name in services if name in self._stopped_services]
+        groups = self._get_startup_groups(running)
+        if edgedockerclient is not None and len([group for group in groups if EdgeManager.EDGEHUB not in group]) > 1:
+            for index, group in enumerate(groups):
+                with tracing.span('compose.up', services=len(group), stage=index):
+                    Utils.exe_proc(self._instance.get_compose_cmd('up', '-d', '--no-deps', *group))
+                if index < len(groups) - 1:
+                    self._wait_for_services(edgedockerclient, group, output)
+        elif running:
+            args = ['up', '-d']
+            if names is not None:
+                args.extend(['--no-deps'] + running)
+            elif len(running) < len(self._services):
+                args.extend(running)
+            with tracing.span('compose.up', services=len(running)):
+                Utils.exe_proc(self._instance.get_compose_cmd(*args))
+        if stopped:
+            # Recreated even if unchanged, so a module that was running until its status changed is stopped
+            with tracing.span('compose.create', services=len(stopped)):
+                Utils.exe_proc(self._instance.get_compose_cmd('up', '--no-start', '--no-deps', '--force-recreate',
+                                                              *stopped))
+        return running
+
+    def apply_solution_changes(self, old_module_content, module_content, output, edgedockerclient=None):
+        """Bring a running solution from old_module_content to module_content, touching only what changed.
+
+        Returns the changes as computed by get_solution_changes."""
+        if edgedockerclient is None:
+            edgedockerclient = EdgeDockerClient()
+        mount_base = self._obtain_mount_path(edgedockerclient)
+        compose_file = self._instance.get_compose_file_path()
+
+        with self._instance.get_runtime_lock():
+            old_services = EdgeManager._load_compose_services(compose_file)
+            with tracing.span('edgemanager.config_solution'):
+                ports = self.config_solution(module_content, compose_file, mount_base, output)
+            self._save_state({'mode': 'solution', 'ports': ports})
+            changes = EdgeManager.get_solution_changes(old_module_content, module_content, old_services,
+                                                       EdgeManager._load_compose_services(compose_file))
+
+            if changes['registries']:
+                self._login_registries(module_content, edgedockerclient, output)
+            for service_name in changes['remove']:
+                container_name = self._instance.get_resource_name('') + service_name
+                if edgedockerclient.status(container_name) is not None:
+                    edgedockerclient.stop(container_name)
+                    edgedockerclient.remove(container_name)
+            if changes['recreate']:
+                unavailable = self._pull_module_images(edgedockerclient, module_content, changes['recreate'], output)
+                self._compose_up(changes['recreate'], unavailable, edgedockerclient, output)
+            if changes['twins']:
+                with tracing.span('edgemanager.update_module_twin'):
+                    self.update_module_twin(module_content, changes['twins'])
+        return changes
 
-        self.config_solution(module_content, EdgeManager.COMPOSE_FILE, mount_base)
-        try:
-            self.update_module_twin(module_content)
-        except Exception as e:
-            output.warning(str(e))
+    @staticmethod
+    def get_solution_changes(old_module_content, module_content, old_services, services):
+        """What has to be done to go from the old to the new deployment.
+
+        Services are the compose services generated from each deployment. A service whose generated config
+        differs is recreated, which covers image, createOptions, env and, for edgeHub, routes. A module whose
+        desired properties alone changed only gets its twin patched."""
+        def desired(content, name):
+            return (content.get(name) or {}).get('properties.desired')
+
+        def status(content, name):
+            modules = content.get('$edgeAgent', {}).get('properties.desired', {}).get('modules', {})
+            return (modules.get(name) or {}).get('status', 'running')
+
+        def registries(content):
+            return content.get('$edgeAgent', {}).get('properties.desired', {}).get(
+                'runtime', {}).get('settings', {}).get('registryCredentials')
+
+        def changed(name):
+            # The desired status is not part of the service, a module is recreated started or only created
+            return services[name] != old_services.get(name) or status(module_content, name) != status(old_module_content, name)
+
+        twins = [name for name in module_content if name not in ['$edgeAgent', '$edgeHub']]
+        twins = [name for name in twins if desired(module_content, name) != desired(old_module_content, name)]
+        return {
+            'recreate': sorted(name for name in services if changed(name)),
+            'remove': sorted(name for name in old_services if name not in services),
+            'twins': sorted(twins),
+            'registries': registries(module_content) != registries(old_module_content)
+        }
 
-        cmd_pull = ['docker-compose', '-f', EdgeManager.COMPOSE_FILE, 'pull', EdgeManager.EDGEHUB]
-        Utils.exe_proc(cmd_pull)
-        if verbose:
-            cmd_up = ['docker-compose', '-f', EdgeManager.COMPOSE_FILE, 'up']
-        else:
-            cmd_up = ['docker-compose', '-f', EdgeManager.COMPOSE_FILE, 'up', '-d']
-        Utils.exe_proc(cmd_up)
+    @staticmethod
+    def _load_compose_services(compose_file):
+        if not os.path.exists(compose_file):
+            return {}
+        with open(compose_file) as f:
+            return (yaml.safe_load(f) or {}).get('services') or {}
 
-    def update_module_twin(self, module_content):
+    def update_module_twin(self, module_content, names=None):
         if self._hub_access_key is None:
             return
 
@@ -213,10 +480,12 @@ class EdgeManager(object):
         for name in module_content:
             if name == '$edgeAgent' or name == '$edgeHub':
                 continue
+            if names is not None and name not in names:
+                continue
             twin = module_content.get(name).get('properties.desired')
             uri = self._get_update_twin_uri(name)
-            res = requests.patch(
-                uri,
+            res = EdgeManager._request(
+                'PATCH', 'twin', uri,
                 headers={
                     'Authorization': sas,
                     'Content-Type': "application/json",
@@ -234,74 +503,248 @@ class EdgeManager(object):
             raise Exception(twinErrorMsg)
 
     @staticmethod
-    def login_registries(module_content):
+    def login_registries(module_content, edgedockerclient=None):
+        """Log in to all the registries of the deployment at once through the Docker API.
+
+        Returns the auth config of each registry host, for the image pulls. Credentials of the same user already
+        in the Docker config are reused without logging in again."""
         registryCredentials = module_content.get('$edgeAgent', {}).get('properties.desired', {}).get(
             'runtime', {}).get('settings', {}).get('registryCredentials')
         if not registryCredentials:
-            return
+            return {}
+        try:
+            if edgedockerclient is None:
+                edgedockerclient = EdgeDockerClient()
+        except Exception as e:
+            raise RegistriesLoginError(list(registryCredentials), '{0}\n'.format(str(e)))
+
+        def login(value):
+            if not value.get('username') or not value.get('password'):
+                raise ValueError('Username and password are required to log in to {0}'.format(value.get('address')))
+            return edgedockerclient.login(value['username'], value['password'], value['address'])
+
+        auths = {}
         failLogin = []
         errMsg = ''
-        for key in registryCredentials:
-            value = registryCredentials[key]
-            try:
-                cmd_login = ['docker', 'login', '-u', value['username'], '-p', value['password'], value['address']]
-                Utils.exe_proc(cmd_login)
-            except Exception as e:
-                failLogin.append(key)
-                errMsg += '{0}\n'.format(str(e))
+        workers = min(len(registryCredentials), EdgeManager.MAX_LOGIN_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(key, executor.submit(login, registryCredentials[key])) for key in registryCredentials]
+            for key, future in futures:
+                try:
+                    auth_config = future.result()
+                    auths[docker.auth.resolve_index_name(registryCredentials[key]['address'])] = auth_config
+                except Exception as e:
+                    failLogin.append(key)
+                    errMsg += '{0}\n'.format(str(e))
         if failLogin:
             raise RegistriesLoginError(failLogin, errMsg)
+        return auths
+
+    def _login_registries(self, module_content, edgedockerclient, output):
+        try:
+            with tracing.span('edgemanager.login_registries'):
+                self._registry_auths = EdgeManager.login_registries(module_content, edgedockerclient)
+        except RegistriesLoginError as e:
+            self._registry_auths = {}
+            output.warning(e.getmsg())
+
+    def _get_startup_groups(self, services):
+        """The services grouped by ascending startupOrder, with edgeHub first on its own as the modules connect to it."""
+        modules = [name for name in services if name != EdgeManager.EDGEHUB]
+        groups = [[EdgeManager.EDGEHUB]] if EdgeManager.EDGEHUB in services else []
+        for order in sorted(set(self._startup_orders.get(name, DEFAULT_STARTUP_ORDER) for name in modules)):
+            groups.append([name for name in modules if self._startup_orders.get(name, DEFAULT_STARTUP_ORDER) == order])
+        return groups
+
+    def _wait_for_services(self, edgedockerclient, services, output=None):
+        # Running, or healthy for those with a health check. A module which exits or never gets there within the
+        # timeout does not hold the next ones back, as edgeAgent does not either.
+        pending = list(services)
+        deadline = time.time() + EdgeManager.STARTUP_TIMEOUT
+        with tracing.span('edgemanager.wait_for_services', services=len(services)):
+            while pending:
+                for name in list(pending):
+                    state = edgedockerclient.get_container_state(self._instance.get_resource_name('') + name) or {}
+                    health = (state.get('Health') or {}).get('Status')
+                    if state.get('Status') == 'running' and health in [None, 'healthy']:
+                        pending.remove(name)
+                    elif state.get('Status') in ['exited', 'dead'] or health == 'unhealthy':
+                        pending.remove(name)
+                        if output is not None:
+                            output.warning('Module {0} is {1}, starting the next modules anyway.'.format(
+                                name, 'unhealthy' if health == 'unhealthy' else state.get('Status')))
+                if not pending:
+                    break
+                if time.time() >= deadline:
+                    if output is not None:
+                        output.warning('{0} not running after {1}s, starting the next modules anyway.'.format(
+                            ', '.join(pending), EdgeManager.STARTUP_TIMEOUT))
+                    break
+                time.sleep(EdgeManager.STARTUP_POLL_INTERVAL)
+
+    @tracing.traced('edgemanager.pull_module_images')
+    def _pull_module_images(self, edgedockerclient, module_content, names=None, output=None):
+        """Pull the missing images of the modules, except those whose imagePullPolicy is never.
+
+        Returns the modules not to create, as their policy is never and their image is missing."""
+        # docker-compose would pull missing images with the credentials of the Docker config, which the logins
+        # above leave alone, so pull them here. The auth is passed explicitly as concurrent logins may race on
+        # the credentials the SDK keeps.
+        modules = module_content['$edgeAgent']['properties.desired']['modules']
+        modules = dict((name, config) for name, config in modules.items() if names is None or name in names)
+        unavailable = []
+        for name, config in sorted(modules.items()):
+            image = config['settings']['image']
+            if config.get('imagePullPolicy') == 'never' and edgedockerclient.get_local_image_sha_id(image) is None:
+                unavailable.append(name)
+                if output is not None:
+                    output.warning('Module {0} is not created as its imagePullPolicy is never and image {1} is not '
+                                   'present locally.'.format(name, image))
+        images = sorted(set(config['settings']['image'] for config in modules.values()
+                            if config.get('imagePullPolicy') != 'never'))
+        for image in images:
+            username, password = EdgeManager.get_registry_auth(self._registry_auths, image)
+            edgedockerclient.pullIfNotExist(image, username, password)
+        return unavailable
 
+    @staticmethod
+    def get_registry_auth(auths, image):
+        """The username and password from login_registries to pull the image with, or None to let the Docker
+        SDK find credentials itself."""
+        registry, _ = docker.auth.resolve_repository_name(image)
+        auth_config = auths.get(registry, {})
+        return auth_config.get('username'), auth_config.get('password')
+
+    @tracing.traced('edgemanager.prepare_cert')
     def _prepare_cert(self, edgedockerclient, mount_base):
-        status = edgedockerclient.status(EdgeManager.CERT_HELPER)
+        status = edgedockerclient.status(self._cert_helper)
         if status is not None:
-            edgedockerclient.stop(EdgeManager.CERT_HELPER)
-            edgedockerclient.remove(EdgeManager.CERT_HELPER)
+            edgedockerclient.stop(self._cert_helper)
+            edgedockerclient.remove(self._cert_helper)
 
         hub_mount = EdgeManager.HUB_MOUNT.format(mount_base)
         module_mount = EdgeManager.MODULE_MOUNT.format(mount_base)
 
         helper_host_config = edgedockerclient.create_host_config(
-            mounts=[docker.types.Mount(hub_mount, EdgeManager.HUB_VOLUME),
-                    docker.types.Mount(module_mount, EdgeManager.MODULE_VOLUME)]
+            mounts=[docker.types.Mount(hub_mount, self._hub_volume),
+                    docker.types.Mount(module_mount, self._module_volume)]
         )
 
-        edgedockerclient.pull(EdgeManager.HELPER_IMG, None, None)
+        self._pull_image(edgedockerclient, EdgeManager.HELPER_IMG)
 
         edgedockerclient.create_container(
             EdgeManager.HELPER_IMG,
-            name=EdgeManager.CERT_HELPER,
+            name=self._cert_helper,
             volumes=[hub_mount, module_mount],
             host_config=helper_host_config,
-            labels=[EdgeManager.LABEL]
+            labels=[self._label]
         )
 
-        edgedockerclient.copy_file_to_volume(
-            EdgeManager.CERT_HELPER, EdgeManager.HUB_VOLUME, EdgeManager._chain_cert(),
-            hub_mount, self._edge_cert.get_cert_file_path(EC.EDGE_CHAIN_CA))
-        edgedockerclient.copy_file_to_volume(
-            EdgeManager.CERT_HELPER, EdgeManager.HUB_VOLUME, EdgeManager._hubserver_pfx(),
-            hub_mount, self._edge_cert.get_pfx_file_path(EC.EDGE_HUB_SERVER))
-        edgedockerclient.copy_file_to_volume(
-            EdgeManager.CERT_HELPER, EdgeManager.MODULE_VOLUME, self._device_cert(),
-            module_mount, self._edge_cert.get_cert_file_path(EC.EDGE_DEVICE_CA))
+        # Copy a consistent set of certificates even while setup regenerates them
+        with filelock.lock_for(self._cert_path, 'certificates'):
+            self._seed_volume(edgedockerclient, self._cert_helper, self._hub_volume, hub_mount, self._hub_cert_files())
+            self._seed_volume(edgedockerclient, self._cert_helper, self._module_volume, module_mount, [
+                (self._device_cert(), self._edge_cert.get_cert_file_path(EC.EDGE_DEVICE_CA))])
+
+    def _hub_cert_files(self):
+        return [(EdgeManager._chain_cert(), self._edge_cert.get_cert_file_path(EC.EDGE_CHAIN_CA)),
+                (EdgeManager._hubserver_pfx(), self._edge_cert.get_pfx_file_path(EC.EDGE_HUB_SERVER))]
+
+    @staticmethod
+    def _seed_volume(edgedockerclient, container_name, volume_name, mount, files):
+        # The certificates only change when setup runs again, so most starts copy nothing
+        report = edgedockerclient.seed_volume(container_name, volume_name, mount, files)
+        registry = metrics.get_registry()
+        registry.counter('volume seed bytes copied').inc(report['copiedBytes'])
+        registry.counter('volume seed bytes skipped').inc(report['skippedBytes'])
+        return report
+
+    @staticmethod
+    def seed_volume(volume_name, source_dir, edgedockerclient=None, progress=None):
+        """Stream the files of source_dir that changed since the last seeding into the volume, through a helper
+        container mounting it. Returns the VolumeSeeder, with the files and bytes copied and skipped."""
+        if edgedockerclient is None:
+            edgedockerclient = EdgeDockerClient()
+        if edgedockerclient.get_os_type() == 'windows':
+            raise ValueError('Volume seeding is only supported for Linux containers.')
+
+        helper = EdgeManager.SEED_HELPER.format(volume_name)
+        if edgedockerclient.status(helper) is not None:
+            edgedockerclient.remove(helper)
+        edgedockerclient.create_volume(volume_name)
+        edgedockerclient.pullIfNotExist(EdgeManager.HELPER_IMG, None, None)
+        # The helper is never started, it only holds the volume for the archive to be extracted into
+        edgedockerclient.create_container(
+            EdgeManager.HELPER_IMG,
+            name=helper,
+            volumes=[EdgeManager.SEED_MOUNT],
+            host_config=edgedockerclient.create_host_config(
+                mounts=[docker.types.Mount(EdgeManager.SEED_MOUNT, volume_name)])
+        )
+        try:
+            seeder = VolumeSeeder(source_dir, edgedockerclient.get_volume_manifest(helper, EdgeManager.SEED_MOUNT))
+            if seeder.needs_copy:
+                edgedockerclient.put_archive(helper, EdgeManager.SEED_MOUNT, seeder.iter_archive(progress))
+            return seeder
+        finally:
+            edgedockerclient.remove(helper)
+
+    @staticmethod
+    def get_images(edgehub_image_version, module_content=None):
+        """The images the simulator runs, and those of the deployment in solution mode."""
+        images = [EdgeManager.EDGEHUB_IMG.format(edgehub_image_version), EdgeManager.TESTUTILITY_IMG,
+                  EdgeManager.HELPER_IMG]
+        if module_content is not None:
+            desired = module_content['$edgeAgent']['properties.desired']
+            modules = [desired['systemModules']['edgeHub']] + list(desired['modules'].values())
+            images.extend(module['settings']['image'] for module in modules)
+        return sorted(set(images))
+
+    def _pull_image(self, edgedockerclient, image):
+        # Without pulls, images loaded from a bundle are used as they are
+        if self._pull_images:
+            edgedockerclient.pull(image, None, None)
+        else:
+            edgedockerclient.pullIfNotExist(image, None, None)
+
+    def _get_host_port(self, port):
+        # Keep the host ports of a named instance while a solution is updated in place
+        if port not in self._host_ports:
+            self._host_ports[port] = self._instance.get_host_port(port)
+        return self._host_ports[port]
 
     def start(self, modulesDict, routes):
         return
 
+    def cache_credentials(self, ttl):
+        """Keep module connection strings for ttl seconds instead of fetching them from IoT Hub every time."""
+        self._credential_cache = {}
+        self._credential_ttl = ttl
+
     def getOrAddModule(self, name, islocal):
-        try:
-            return self.getModule(name, islocal)
-        except ResponseError as geterr:
-            if geterr.status_code == 404:
-                try:
-                    return self.addModule(name, islocal)
-                except ResponseError as adderr:
-                    if adderr.status_code == 400:
-                        raise ResponseError(400, adderr.value + " Please make sure you are using an Edge device.")
-                    raise adderr
-            else:
-                raise geterr
+        if self._credential_cache is None:
+            return self._getOrAddModule(name, islocal)
+        cached = self._credential_cache.get((name, islocal))
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        connection_str = self._getOrAddModule(name, islocal)
+        self._credential_cache[(name, islocal)] = (connection_str, time.time() + self._credential_ttl)
+        return connection_str
+
+    def _getOrAddModule(self, name, islocal):
+        with tracing.span('iothub.get_or_add_module', module=name):
+            try:
+                return self.getModule(name, islocal)
+            except ResponseError as geterr:
+                if geterr.status_code == 404:
+                    try:
+                        return self.addModule(name, islocal)
+                    except ResponseError as adderr:
+                        if adderr.status_code == 400:
+                            raise ResponseError(400, adderr.value + " Please make sure you are using an Edge device.")
+                        raise adderr
+                else:
+                    raise geterr
 
     def outputModuleCred(self, names, islocal, output_file):
         connstrENV = 'EdgeHubConnectionString={0}'.format('|'.join([self.getOrAddModule(name, islocal) for name in names]))
@@ -320,8 +763,8 @@ class EdgeManager(object):
     def getModule(self, name, islocal):
         moduleUri = self._getModuleReqUri(name)
         sas = Utils.get_iot_hub_sas_token(self._device_uri, self._access_key, None)
-        res = requests.get(
-            moduleUri,
+        res = EdgeManager._request(
+            'GET', 'module', moduleUri,
             headers={
                 'Authorization': sas,
                 'Content-Type': 'application/json'
@@ -342,8 +785,8 @@ class EdgeManager(object):
     def updateModule(self, name, etag, islocal):
         moduleUri = self._getModuleReqUri(name)
         sas = Utils.get_iot_hub_sas_token(self._device_uri, self._access_key, None)
-        res = requests.put(
-            moduleUri,
+        res = EdgeManager._request(
+            'PUT', 'module', moduleUri,
             headers={
                 'Authorization': sas,
                 'Content-Type': "application/json",
@@ -364,8 +807,8 @@ class EdgeManager(object):
     def addModule(self, name, islocal):
         moduleUri = self._getModuleReqUri(name)
         sas = Utils.get_iot_hub_sas_token(self._device_uri, self._access_key, None)
-        res = requests.put(
-            moduleUri,
+        res = EdgeManager._request(
+            'PUT', 'module', moduleUri,
             headers={
                 "Authorization": sas,
                 "Content-Type": "application/json"
@@ -379,6 +822,16 @@ class EdgeManager(object):
             raise ResponseError(res.status_code, res.text)
         return self._generateModuleConnectionStr(res, islocal)
 
+    @staticmethod
+    def _request(method, resource, uri, **kwargs):
+        name = 'iothub {0} {1}'.format(method, resource)
+        with metrics.timed(name):
+            res = EdgeManager._http.request(method, uri, **kwargs)
+        # Error responses count as errors too, the callers turn them into exceptions
+        if res.ok is not True:
+            metrics.get_registry().counter(name + ' errors').inc()
+        return res
+
     def _getModuleReqUri(self, name):
         return "https://{0}/devices/{1}/modules/{2}?api-version={3}".format(
             self._hostname, self._device_id, name, EdgeManager.TWIN_API_VERSION)
@@ -402,34 +855,54 @@ class EdgeManager(object):
         else:
             return moduleTemplate.format(self._hostname, gatewayhost, deviceId, moduleId, sasKey)
 
-    def _generateRoutesEnvFromInputs(self, inputs):
+    def _generateRoutesEnvFromInputs(self, inputs, producers=None):
         routes = [
             'routes__output=FROM /messages/modules/target/outputs/* INTO BrokeredEndpoint("/modules/input/inputs/print")'
         ]
-        template = 'routes__r{0}=FROM /messages/modules/input/outputs/{1} INTO BrokeredEndpoint("/modules/target/inputs/{2}")'
+        template = 'routes__r{0}=FROM /messages/modules/{1}/outputs/{2} INTO BrokeredEndpoint("/modules/target/inputs/{3}")'
         inputSet = set(inputs)
-        for (idx, input) in enumerate(inputSet):
-            routes.append(template.format(idx + 1, input, input))
+        # Every producer sends to the same target inputs, so edgeHub fans them in
+        routes_inputs = [(producer, input) for producer in producers or [EdgeManager.INPUT] for input in inputSet]
+        for (idx, (producer, input)) in enumerate(routes_inputs):
+            routes.append(template.format(idx + 1, producer, input, input))
         return routes
 
+    @tracing.traced('edgemanager.prepare')
     def _prepare(self, edgedockerclient):
-        edgedockerclient.create_network(EdgeManager.NW_NAME)
-        edgedockerclient.create_volume(EdgeManager.HUB_VOLUME)
-        edgedockerclient.create_volume(EdgeManager.MODULE_VOLUME)
-
-    def _start_edge_hub(self, edgedockerclient, edgeHubConnStr, routes, mount_base, envs, edgehub_image_version):
-        edgehub_image = EdgeManager.EDGEHUB_IMG.format(edgehub_image_version)
-        edgedockerclient.pull(edgehub_image, None, None)
-        network_config = edgedockerclient.create_config_for_network(EdgeManager.NW_NAME, aliases=[self._gatewayhost])
+        edgedockerclient.create_network(
+            self._nw_name,
+            mtu=self._network_options.get('mtu'),
+            driver_opts=self._network_options.get('driverOpts'),
+            ipv6=self._network_options.get('ipv6', False),
+            internal=self._network_options.get('internal', False))
+        edgedockerclient.create_volume(self._hub_volume)
+        edgedockerclient.create_volume(self._module_volume)
+
+    @tracing.traced('edgemanager.create_edge_hub')
+    def _create_edge_hub(self, edgedockerclient, edgeHubConnStr, routes, mount_base, envs, edgehub_image,
+                         metrics_port=None):
         hub_mount = EdgeManager.HUB_MOUNT.format(mount_base)
-        hub_host_config = edgedockerclient.create_host_config(
-            mounts=[docker.types.Mount(hub_mount, EdgeManager.HUB_VOLUME)],
-            port_bindings={
-                '8883': 8883,
-                '443': 443,
-                '5671': 5671
-            }
-        )
+        hub_ports = {}
+        for port in [8883, 443, 5671]:
+            hub_ports[str(port)] = port if self._host_network else self._instance.get_host_port(port)
+        container_ports = [(8883, 'tcp'), (443, 'tcp'), (5671, 'tcp')]
+        if metrics_port is not None:
+            hub_ports[str(EdgeHubMetrics.CONTAINER_PORT)] = \
+                EdgeHubMetrics.CONTAINER_PORT if self._host_network else self._instance.get_host_port(metrics_port)
+            container_ports.append((EdgeHubMetrics.CONTAINER_PORT, 'tcp'))
+        if self._host_network:
+            # edgeHub listens on the ports of the host itself, without any NAT in between
+            network_config = None
+            hub_host_config = edgedockerclient.create_host_config(
+                mounts=[docker.types.Mount(hub_mount, self._hub_volume)],
+                network_mode='host'
+            )
+        else:
+            network_config = edgedockerclient.create_config_for_network(self._nw_name, aliases=[self._gatewayhost])
+            hub_host_config = edgedockerclient.create_host_config(
+                mounts=[docker.types.Mount(hub_mount, self._hub_volume)],
+                port_bindings=hub_ports
+            )
         hubEnv = [
             EdgeManager.HUB_CA_ENV.format(mount_base),
             EdgeManager.HUB_CERT_ENV.format(mount_base),
@@ -438,26 +911,23 @@ class EdgeManager(object):
             EdgeManager.HUB_SSLCRT_ENV,
             'IotHubConnectionString={0}'.format(edgeHubConnStr)]
         hubEnv.extend(routes)
+        if metrics_port is not None:
+            hubEnv.extend(EdgeHubMetrics.ENV)
         hubEnv.extend(list(envs))
 
         hubContainer = edgedockerclient.create_container(
             edgehub_image,
-            name=EdgeManager.EDGEHUB,
+            name=self._edgehub_container,
             volumes=[hub_mount],
             host_config=hub_host_config,
             networking_config=network_config,
             environment=hubEnv,
-            labels=[EdgeManager.LABEL],
-            ports=[(8883, 'tcp'), (443, 'tcp'), (5671, 'tcp')]
+            labels=[self._label],
+            ports=container_ports
         )
 
-        edgedockerclient.copy_file_to_volume(
-            EdgeManager.EDGEHUB, EdgeManager.HUB_VOLUME, EdgeManager._chain_cert(),
-            hub_mount, self._edge_cert.get_cert_file_path(EC.EDGE_CHAIN_CA))
-        edgedockerclient.copy_file_to_volume(
-            EdgeManager.EDGEHUB, EdgeManager.HUB_VOLUME, EdgeManager._hubserver_pfx(),
-            hub_mount, self._edge_cert.get_pfx_file_path(EC.EDGE_HUB_SERVER))
-        edgedockerclient.start(hubContainer.get('Id'))
+        self._seed_volume(edgedockerclient, self._edgehub_container, self._hub_volume, hub_mount, self._hub_cert_files())
+        return hubContainer.get('Id'), hub_ports
 
     def _obtain_mount_path(self, edgedockerclient):
         os_type = edgedockerclient.get_os_type().lower()
@@ -62,3 +62,11 @@ class RegistriesLoginError(EdgeError):
 class InvalidConfigError(EdgeError):
     def __init__(self, msg):
         super(InvalidConfigError, self).__init__(msg)
+
+
+class EdgeLockTimeoutError(EdgeError):
+    def __init__(self, lock_name, timeout):
+        super(EdgeLockTimeoutError, self).__init__(
+            'Timed out after {0}s waiting for another iotedgehubdev process to release the {1} lock'.format(
+                timeout, lock_name))
+        self.lock_name = lock_name
@@ -0,0 +1,139 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import contextlib
+import os
+import threading
+import time
+
+from .errors import EdgeLockTimeoutError
+from .output import Output
+from .utils import Utils
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_TIMEOUT = 300
+POLL_INTERVAL = 0.1
+
+_default_timeout = DEFAULT_TIMEOUT
+_held = threading.local()
+# Settings of the command a thread runs for, when it is not the command of this process
+_call = threading.local()
+
+
+def set_default_timeout(timeout):
+    global _default_timeout
+    _default_timeout = timeout
+
+
+def get_default_timeout():
+    timeout = getattr(_call, 'timeout', None)
+    return _default_timeout if timeout is None else timeout
+
+
+@contextlib.contextmanager
+def call_settings(timeout=None, output=None):
+    """Within the block, locks taken by this thread wait timeout seconds by default and report waiting through
+    output. The daemon serves each command on its own thread, with the settings of the process that ran it."""
+    previous = (getattr(_call, 'timeout', None), getattr(_call, 'output', None))
+    _call.timeout, _call.output = timeout, output
+    try:
+        yield
+    finally:
+        _call.timeout, _call.output = previous
+
+
+def lock_for(path, description):
+    """The lock guarding changes to the file or directory at path, held in a .lock file next to it."""
+    return FileLock(path.rstrip('/\\') + '.lock', description=description)
+
+
+class FileLock(object):
+    """Advisory lock on a file shared by every iotedgehubdev process on the host.
+
+    The lock is held by the open file, so the operating system releases it when a process dies.
+    It is reentrant within a thread, so a command that takes a lock can call code that takes it again.
+    A process that has to wait says so once, and gives up with EdgeLockTimeoutError after timeout seconds."""
+
+    def __init__(self, path, timeout=None, description=None):
+        self._path = path
+        self._timeout = timeout
+        self._description = description or path
+        self._fd = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def acquire(self):
+        counts = FileLock._get_counts()
+        if counts.get(self._path, 0) > 0:
+            counts[self._path] += 1
+            return
+        Utils.mkdir_if_needed(os.path.dirname(self._path))
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o666)
+        timeout = get_default_timeout() if self._timeout is None else self._timeout
+        deadline = time.time() + timeout
+        waiting = False
+        while not FileLock._try_lock(fd):
+            if time.time() >= deadline:
+                os.close(fd)
+                raise EdgeLockTimeoutError(self._description, timeout)
+            if not waiting:
+                output = getattr(_call, 'output', None) or Output()
+                output.info('Waiting for another iotedgehubdev process to release the {0} lock...'.format(
+                    self._description))
+                waiting = True
+            time.sleep(POLL_INTERVAL)
+        self._fd = fd
+        counts[self._path] = 1
+
+    def release(self):
+        counts = FileLock._get_counts()
+        counts[self._path] -= 1
+        if counts[self._path] > 0 or self._fd is None:
+            return
+        del counts[self._path]
+        try:
+            FileLock._unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @staticmethod
+    def _get_counts():
+        if not hasattr(_held, 'counts'):
+            _held.counts = {}
+        return _held.counts
+
+    @staticmethod
+    def _try_lock(fd):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except (IOError, OSError):
+            return False
+
+    @staticmethod
+    def _unlock(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+
+class _Inotify(object):
+    """Minimal inotify binding watching one directory for files being written, created or renamed into it."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    _event_header = struct.Struct('iIII')
+
+    def __init__(self, dir_path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(_Inotify.IN_NONBLOCK | _Inotify.IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        mask = _Inotify.IN_CLOSE_WRITE | _Inotify.IN_MOVED_TO | _Inotify.IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(dir_path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), dir_path)
+
+    def read_names(self, timeout):
+        """Names of the files changed within timeout seconds, empty when nothing changed."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + _Inotify._event_header.size <= len(data):
+            _, _, _, name_len = _Inotify._event_header.unpack_from(data, offset)
+            offset += _Inotify._event_header.size
+            names.append(os.fsdecode(data[offset:offset + name_len].rstrip(b'\0')))
+            offset += name_len
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class FileWatcher(object):
+    """Waits for a file to change, using inotify where available and polling its mtime and size otherwise.
+
+    Editors save in bursts of writes, or write a temporary file and rename it over the original, so a change
+    is only reported once the file has been quiet for debounce seconds."""
+
+    def __init__(self, file_path, debounce=0.3, poll_interval=1.0):
+        self._file_path = os.path.abspath(file_path)
+        self._file_name = os.path.basename(self._file_path)
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        self._inotify = None
+        try:
+            self._inotify = _Inotify(os.path.dirname(self._file_path))
+        except (OSError, AttributeError):
+            # Not Linux, or out of inotify watches
+            self._inotify = None
+        self._signature = self._get_signature()
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def wait_for_change(self, timeout=None):
+        """Block until the file changed and has been quiet for the debounce time. Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._poll(self._poll_interval if deadline is None else
+                             max(0, min(self._poll_interval, deadline - time.time()))):
+            if deadline is not None and time.time() >= deadline:
+                return False
+        while self._poll(self._debounce):
+            pass
+        self._signature = self._get_signature()
+        return True
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _poll(self, timeout):
+        if self._inotify is not None:
+            return self._file_name in self._inotify.read_names(timeout)
+        time.sleep(timeout)
+        signature = self._get_signature()
+        if signature != self._signature:
+            self._signature = signature
+            return True
+        return False
+
+    def _get_signature(self):
+        try:
+            stat = os.stat(self._file_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
@@ -13,6 +13,8 @@ class HostPlatform(object):
     _setting_ini = 'setting.ini'
     _certs = 'certs'
     _data = 'data'
+    _keypool = 'keypool'
+    _instances = 'instances'
     _platforms = {
         'linux': {
             'supported_deployments': ['docker'],
@@ -122,3 +124,23 @@ class HostPlatform(object):
         if host in HostPlatform._platforms:
             return os.path.join(HostPlatform.get_data_path(), HostPlatform._data)
         return None
+
+    @staticmethod
+    def get_key_pool_path():
+        host = platform.system()
+        if host is None:
+            raise EdgeInvalidArgument('host cannot be None')
+        host = host.lower()
+        if host in HostPlatform._platforms:
+            return os.path.join(HostPlatform.get_data_path(), HostPlatform._keypool)
+        return None
+
+    @staticmethod
+    def get_instance_path(name):
+        host = platform.system()
+        if host is None:
+            raise EdgeInvalidArgument('host cannot be None')
+        host = host.lower()
+        if host in HostPlatform._platforms:
+            return os.path.join(HostPlatform.get_data_path(), HostPlatform._instances, name)
+        return None
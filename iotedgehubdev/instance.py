@@ -0,0 +1,110 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import json
+import os
+import re
+import socket
+
+from . import filelock
+from .hostplatform import HostPlatform
+from .utils import Utils
+
+
+class EdgeInstance(object):
+    """Names of the Docker resources and the state files of one simulator instance.
+
+    Named instances prefix every network, volume, container and label with their name, keep their compose
+    and state files in their own directory, and get free host ports, so several of them can run on the
+    same Docker host. The default instance keeps the historical names and paths."""
+    COMPOSE_PROJECT = 'iotedgehubdev'
+    _name_pattern = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+    _compose_file = 'docker-compose.yml'
+    _state_file = 'instance.json'
+    _config_file = 'edgehub.json'
+    _certs = 'certs'
+
+    def __init__(self, name=None):
+        if name is not None and EdgeInstance._name_pattern.match(name) is None:
+            raise ValueError('Instance name `{0}` is not valid. Use up to 32 lowercase letters, digits, '
+                             '"-" or "_", starting with a letter or digit.'.format(name))
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def is_default(self):
+        return self._name is None
+
+    def get_resource_name(self, base_name):
+        if self.is_default:
+            return base_name
+        return '{0}-{1}'.format(self._name, base_name)
+
+    def get_data_path(self):
+        if self.is_default:
+            return HostPlatform.get_share_data_path()
+        return HostPlatform.get_instance_path(self._name)
+
+    def get_compose_file_path(self):
+        return os.path.join(self.get_data_path(), EdgeInstance._compose_file)
+
+    def get_compose_cmd(self, *args):
+        cmd = ['docker-compose', '-f', self.get_compose_file_path()]
+        if not self.is_default:
+            cmd.extend(['-p', self.get_resource_name(EdgeInstance.COMPOSE_PROJECT)])
+        cmd.extend(args)
+        return cmd
+
+    def get_config_file_path(self):
+        if self.is_default:
+            return HostPlatform.get_config_file_path()
+        return os.path.join(self.get_data_path(), EdgeInstance._config_file)
+
+    def get_cert_path(self):
+        if self.is_default:
+            return HostPlatform.get_default_cert_path()
+        return os.path.join(self.get_data_path(), EdgeInstance._certs)
+
+    def get_runtime_lock(self):
+        """The lock serializing changes to the containers, compose file and state of the instance."""
+        description = 'simulator' if self.is_default else 'simulator instance `{0}`'.format(self._name)
+        return filelock.lock_for(self.get_compose_file_path(), description)
+
+    def get_host_port(self, port):
+        """The host port to publish a container port on. Named instances get a free port instead."""
+        if self.is_default:
+            return port
+        return EdgeInstance.find_free_port()
+
+    def load_state(self):
+        state_file = os.path.join(self.get_data_path(), EdgeInstance._state_file)
+        if not Utils.check_if_file_exists(state_file):
+            return {}
+        with open(state_file) as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+
+    def save_state(self, state):
+        Utils.mkdir_if_needed(self.get_data_path())
+        Utils.write_file_atomic(os.path.join(self.get_data_path(), EdgeInstance._state_file),
+                                json.dumps(state, indent=2, sort_keys=True))
+
+    def delete_state(self):
+        state_file = os.path.join(self.get_data_path(), EdgeInstance._state_file)
+        if Utils.check_if_file_exists(state_file):
+            os.remove(state_file)
+
+    @staticmethod
+    def find_free_port():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(('', 0))
+            return sock.getsockname()[1]
+        finally:
+            sock.close()
@@ -0,0 +1,155 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from .certutils import EdgeCertUtil, generate_private_key_pem
+from .hostplatform import HostPlatform
+from .utils import Utils
+
+
+class KeyPool(object):
+    """A protected local directory of pregenerated private keys.
+
+    Keys are grouped by key spec, e.g. rsa-4096 or ec-256. Each key is handed out at most once: a
+    consumer claims a key by renaming it, which only one process can succeed at. Fill and take events
+    are appended to a usage log, from which the hit rate and the generation time saved are derived.
+    """
+    KEY_SUFFIX = '.key.pem'
+    USAGE_LOG = 'usage.log'
+    _spec_type_names = {EdgeCertUtil.TYPE_RSA: 'rsa', EdgeCertUtil.TYPE_EC: 'ec'}
+
+    def __init__(self, pool_dir=None):
+        self._pool_dir = pool_dir if pool_dir is not None else HostPlatform.get_key_pool_path()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def pool_dir(self):
+        return self._pool_dir
+
+    @staticmethod
+    def get_spec_name(key_spec):
+        private_key_type, key_bit_len = key_spec
+        return '{0}-{1}'.format(KeyPool._spec_type_names[private_key_type], key_bit_len)
+
+    def fill(self, key_spec, count):
+        spec_dir = self._ensure_spec_dir(key_spec)
+        private_key_type, key_bit_len = key_spec
+        workers = max(1, min(count, os.cpu_count() or 1))
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for key_pem in executor.map(generate_private_key_pem, [private_key_type] * count, [key_bit_len] * count):
+                self._publish(spec_dir, key_pem)
+        elapsed = time.time() - start
+        # Keys are generated concurrently, so record the CPU time a single generation would take inline
+        self._log_usage('fill', key_spec, count=count, seconds=elapsed * workers / count)
+
+    def take(self, key_spec):
+        spec_dir = os.path.join(self._pool_dir, KeyPool.get_spec_name(key_spec))
+        for key_file in self._list_keys(spec_dir):
+            claimed_file = '{0}.claimed-{1}'.format(key_file, uuid.uuid4().hex)
+            try:
+                os.rename(key_file, claimed_file)
+            except OSError:
+                # Claimed by another process
+                continue
+            try:
+                with open(claimed_file, 'rb') as f:
+                    key_pem = f.read()
+            finally:
+                os.unlink(claimed_file)
+            self.hits += 1
+            self._log_usage('hit', key_spec)
+            return key_pem
+
+        self.misses += 1
+        self._log_usage('miss', key_spec)
+        return None
+
+    def get_status(self):
+        status = {}
+        if Utils.check_if_directory_exists(self._pool_dir):
+            for spec_name in sorted(os.listdir(self._pool_dir)):
+                spec_dir = os.path.join(self._pool_dir, spec_name)
+                if os.path.isdir(spec_dir):
+                    status[spec_name] = self._new_status(len(self._list_keys(spec_dir)))
+
+        generated_seconds = {}
+        for entry in self._read_usage():
+            spec_status = status.setdefault(entry['spec'], self._new_status(0))
+            if entry['event'] == 'fill':
+                spec_status['generated'] += entry['count']
+                generated_seconds[entry['spec']] = generated_seconds.get(entry['spec'], 0.0) + \
+                    entry['seconds'] * entry['count']
+            elif entry['event'] == 'hit':
+                spec_status['hits'] += 1
+            elif entry['event'] == 'miss':
+                spec_status['misses'] += 1
+
+        for spec_name, spec_status in status.items():
+            requests = spec_status['hits'] + spec_status['misses']
+            if requests > 0:
+                spec_status['hit_rate'] = float(spec_status['hits']) / requests
+            if spec_status['generated'] > 0:
+                avg_seconds = generated_seconds.get(spec_name, 0.0) / spec_status['generated']
+                spec_status['saved_seconds'] = avg_seconds * spec_status['hits']
+        return status
+
+    @staticmethod
+    def _new_status(available):
+        return {'available': available, 'generated': 0, 'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'saved_seconds': 0.0}
+
+    def _ensure_spec_dir(self, key_spec):
+        Utils.mkdir_if_needed(self._pool_dir)
+        os.chmod(self._pool_dir, 0o700)
+        spec_dir = os.path.join(self._pool_dir, KeyPool.get_spec_name(key_spec))
+        Utils.mkdir_if_needed(spec_dir)
+        os.chmod(spec_dir, 0o700)
+        return spec_dir
+
+    @staticmethod
+    def _publish(spec_dir, key_pem):
+        # Write under a temporary name first so consumers never see a partially written key
+        key_id = uuid.uuid4().hex
+        tmp_file = os.path.join(spec_dir, '.{0}.tmp'.format(key_id))
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key_pem)
+        os.rename(tmp_file, os.path.join(spec_dir, key_id + KeyPool.KEY_SUFFIX))
+
+    @staticmethod
+    def _list_keys(spec_dir):
+        if not Utils.check_if_directory_exists(spec_dir):
+            return []
+        return [os.path.join(spec_dir, name) for name in sorted(os.listdir(spec_dir)) if name.endswith(KeyPool.KEY_SUFFIX)]
+
+    def _log_usage(self, event, key_spec, **kwargs):
+        if not Utils.check_if_directory_exists(self._pool_dir):
+            return
+        entry = {'event': event, 'spec': KeyPool.get_spec_name(key_spec), 'time': time.time()}
+        entry.update(kwargs)
+        # A single small O_APPEND write is atomic, so concurrent consumers do not lose entries
+        fd = os.open(os.path.join(self._pool_dir, KeyPool.USAGE_LOG), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            os.write(fd, (json.dumps(entry) + '\n').encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def _read_usage(self):
+        usage_file = os.path.join(self._pool_dir, KeyPool.USAGE_LOG)
+        if not Utils.check_if_file_exists(usage_file):
+            return []
+        entries = []
+        with open(usage_file) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
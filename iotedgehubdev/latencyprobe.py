@@ -0,0 +1,152 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import json
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+import requests
+
+from .metrics import Histogram
+
+
+class LatencyProbe(object):
+    """Measures the time a message takes from the input module, through the edgeHub routes to the
+    target module and back to the input module via the routes__output route.
+
+    Every probe message carries a run id, a sequence number and its send time. They are printed by the
+    input module when they come back on its print input, so the probe polls the input container logs and
+    uses the Docker log timestamp as the receive time. This assumes the Docker daemon clock is in sync
+    with the host clock, which holds for a local daemon."""
+    MARKER = 'iotedgehubdev-probe'
+    POLL_INTERVAL = 0.5
+    _message_pattern = re.compile(MARKER + r':(?P<run_id>[0-9a-f]+):(?P<input>[^:\s"]+):(?P<seq>\d+):(?P<sent>\d+\.\d+)')
+    _timestamp_pattern = re.compile(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?Z$')
+
+    def __init__(self, edgedockerclient, container_name, url, inputs, count, rate, timeout):
+        self._client = edgedockerclient
+        self._container_name = container_name
+        self._url = url
+        self._inputs = inputs
+        self._count = count
+        self._rate = rate
+        self._timeout = timeout
+        self._run_id = uuid.uuid4().hex[:8]
+
+    @staticmethod
+    def format_message(run_id, input_name, seq, sent_time):
+        return '{0}:{1}:{2}:{3}:{4:.6f}'.format(LatencyProbe.MARKER, run_id, input_name, seq, sent_time)
+
+    @staticmethod
+    def parse_logs(logs, run_id):
+        """Return (input, seq, sent time, received time) of the probe messages of the run, in log order."""
+        received = []
+        for line in logs.splitlines():
+            timestamp, _, text = line.partition(' ')
+            match = LatencyProbe._message_pattern.search(text)
+            if match is None or match.group('run_id') != run_id:
+                continue
+            received_time = LatencyProbe._parse_docker_timestamp(timestamp)
+            if received_time is None:
+                continue
+            received.append((match.group('input'), int(match.group('seq')), float(match.group('sent')), received_time))
+        return received
+
+    @staticmethod
+    def get_report(sent, received):
+        """Per-route latency percentiles, loss, duplicates and reordering.
+
+        sent maps each input to the number of messages sent through it, received is the output of parse_logs."""
+        routes = {}
+        for input_name, sent_count in sent.items():
+            routes[input_name] = {'sent': sent_count, 'seen': set(), 'duplicates': 0, 'reordered': 0,
+                                  'max_seq': -1, 'latency': Histogram()}
+        for input_name, seq, sent_time, received_time in sorted(received, key=lambda message: message[3]):
+            route = routes.get(input_name)
+            if route is None:
+                continue
+            if seq in route['seen']:
+                route['duplicates'] += 1
+                continue
+            route['seen'].add(seq)
+            if seq < route['max_seq']:
+                route['reordered'] += 1
+            route['max_seq'] = max(route['max_seq'], seq)
+            route['latency'].record(max(received_time - sent_time, 0.0))
+
+        report = {}
+        total = Histogram()
+        for input_name, route in routes.items():
+            total.merge(route['latency'])
+            report[input_name] = LatencyProbe._get_route_report(route['sent'], len(route['seen']), route['duplicates'],
+                                                                route['reordered'], route['latency'])
+        report_all = LatencyProbe._get_route_report(sum(route['sent'] for route in routes.values()),
+                                                    sum(len(route['seen']) for route in routes.values()),
+                                                    sum(route['duplicates'] for route in routes.values()),
+                                                    sum(route['reordered'] for route in routes.values()),
+                                                    total)
+        return {'routes': report, 'all': report_all}
+
+    def run(self):
+        # Docker only filters logs by whole seconds
+        since = int(time.time()) - 1
+        sent = self._send()
+        expected = sum(sent.values())
+        deadline = time.time() + self._timeout
+        while True:
+            received = LatencyProbe.parse_logs(self._client.get_container_logs(self._container_name, since=since),
+                                               self._run_id)
+            if len(set((message[0], message[1]) for message in received)) >= expected or time.time() >= deadline:
+                break
+            time.sleep(LatencyProbe.POLL_INTERVAL)
+        return LatencyProbe.get_report(sent, received)
+
+    def _send(self):
+        sent = {input_name: 0 for input_name in self._inputs}
+        session = requests.Session()
+        start = time.time()
+        try:
+            for index in range(self._count):
+                scheduled = start + index / float(self._rate)
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                input_name = self._inputs[index % len(self._inputs)]
+                body = json.dumps({
+                    'inputName': input_name,
+                    'data': LatencyProbe.format_message(self._run_id, input_name, sent[input_name], time.time())
+                })
+                try:
+                    session.post(self._url, data=body, headers={'Content-Type': 'application/json'}, timeout=10)
+                except requests.RequestException:
+                    # Counted as lost, like a message dropped on the way
+                    pass
+                sent[input_name] += 1
+        finally:
+            session.close()
+        return sent
+
+    @staticmethod
+    def _get_route_report(sent, received, duplicates, reordered, latency):
+        return {
+            'sent': sent,
+            'received': received,
+            'lost': sent - received,
+            'lossRate': (sent - received) / float(sent) if sent else 0.0,
+            'duplicates': duplicates,
+            'reordered': reordered,
+            'latency': latency.to_dict()
+        }
+
+    @staticmethod
+    def _parse_docker_timestamp(timestamp):
+        # RFC3339 with nanoseconds, e.g. 2021-06-01T10:00:00.123456789Z
+        match = LatencyProbe._timestamp_pattern.match(timestamp)
+        if match is None:
+            return None
+        seconds = datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        fraction = match.group(2)
+        return seconds + (float('0.' + fraction) if fraction else 0.0)
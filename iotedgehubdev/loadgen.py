@@ -0,0 +1,148 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import base64
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .metrics import Histogram
+
+
+class LoadGenerator(object):
+    """Sends messages to the testing utility /api/v1/messages endpoint from a pool of worker threads.
+
+    Each worker keeps its own keep-alive session. With a target rate, request i is scheduled at
+    start + i / rate and its latency is measured from that time rather than from when it was actually
+    sent, so a stalled endpoint shows up in the percentiles instead of silently lowering the load.
+
+    Given the URLs of several input producers, requests go to each of them in turn."""
+    MESSAGES_PATH = '/api/v1/messages'
+    PERCENTILES = [50, 90, 99, 99.9]
+
+    def __init__(self, url, inputs, concurrency, rate=None, duration=None, count=None, payload_size=(64, 64),
+                 timeout=10):
+        if duration is None and count is None:
+            raise ValueError('Either duration or count must be provided.')
+        self._urls = [url] if isinstance(url, str) else list(url)
+        self._inputs = inputs
+        self._concurrency = concurrency
+        self._rate = rate
+        self._duration = duration
+        self._count = count
+        self._min_size, self._max_size = payload_size
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._succeeded = 0
+        self._bytes_sent = 0
+        self._errors = {}
+        self._latency = Histogram()
+        self._start = None
+        self._deadline = None
+        # Payloads are slices of one random string, so generating them costs nothing per request
+        self._payload_pool = base64.b64encode(os.urandom(self._max_size)).decode('ascii')[:self._max_size]
+
+    @staticmethod
+    def get_messages_url(port, host='localhost'):
+        return 'http://{0}:{1}{2}'.format(host, port, LoadGenerator.MESSAGES_PATH)
+
+    @staticmethod
+    def parse_payload_size(value):
+        """Parse a payload size given as N or MIN-MAX bytes."""
+        try:
+            bounds = [int(bound) for bound in value.split('-')]
+        except ValueError:
+            bounds = []
+        if len(bounds) == 1:
+            bounds = bounds * 2
+        if len(bounds) != 2 or bounds[0] < 0 or bounds[0] > bounds[1]:
+            raise ValueError('Payload size `{0}` is not valid. Use N or MIN-MAX bytes.'.format(value))
+        return tuple(bounds)
+
+    def run(self):
+        self._start = time.perf_counter()
+        if self._duration is not None:
+            self._deadline = self._start + self._duration
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            workers = [executor.submit(self._run_worker, worker_id) for worker_id in range(self._concurrency)]
+            for worker in workers:
+                worker.result()
+        return self._get_report(time.perf_counter() - self._start)
+
+    def _run_worker(self, worker_id):
+        rand = random.Random(worker_id)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self._urls), pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        try:
+            while True:
+                request = self._next_request()
+                if request is None:
+                    return
+                index, scheduled = request
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self._send(session, rand, scheduled, self._urls[index % len(self._urls)])
+        finally:
+            session.close()
+
+    def _next_request(self):
+        with self._lock:
+            index = self._issued
+            if self._count is not None and index >= self._count:
+                return None
+            self._issued += 1
+        scheduled = self._start + index / self._rate if self._rate else time.perf_counter()
+        if self._deadline is not None and scheduled >= self._deadline:
+            return None
+        return index, scheduled
+
+    def _send(self, session, rand, scheduled, url):
+        size = rand.randint(self._min_size, self._max_size)
+        offset = rand.randint(0, self._max_size - size)
+        body = json.dumps({
+            'inputName': self._inputs[rand.randrange(len(self._inputs))],
+            'data': self._payload_pool[offset:offset + size]
+        })
+        error = None
+        try:
+            res = session.post(url, data=body, headers={'Content-Type': 'application/json'}, timeout=self._timeout)
+            if res.ok is not True:
+                error = 'HTTP {0}'.format(res.status_code)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        self._latency.record(time.perf_counter() - scheduled)
+        with self._lock:
+            self._bytes_sent += len(body)
+            if error is None:
+                self._succeeded += 1
+            else:
+                self._errors[error] = self._errors.get(error, 0) + 1
+
+    def _get_report(self, elapsed):
+        with self._lock:
+            sent = self._succeeded + sum(self._errors.values())
+            return {
+                'urls': list(self._urls),
+                'concurrency': self._concurrency,
+                'targetRate': self._rate,
+                'elapsed': elapsed,
+                'sent': sent,
+                'succeeded': self._succeeded,
+                'errors': dict(self._errors),
+                'errorRate': (sent - self._succeeded) / float(sent) if sent else 0.0,
+                'throughput': self._succeeded / elapsed if elapsed > 0 else 0.0,
+                'bytesSent': self._bytes_sent,
+                'latency': dict(self._latency.to_dict(), **{
+                    'p{0}'.format(percent): self._latency.percentile(percent) for percent in LoadGenerator.PERCENTILES
+                })
+            }
@@ -0,0 +1,139 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import json
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from .errors import EdgeValueError
+
+
+class LogStreamer(object):
+    """Streams the logs of several containers at once, one reader thread per container.
+
+    Readers split the Docker log stream into lines, filter them and put them on a bounded queue, which the
+    writer drains in batches. When the output cannot keep up the readers block on the queue, so Docker holds
+    back the stream instead of this process buffering it, and memory stays bounded by the queue size."""
+    QUEUE_SIZE = 4096
+    BATCH_SIZE = 1024
+    # Longer lines are written in pieces rather than buffered whole
+    MAX_LINE_SIZE = 64 * 1024
+    _duration_pattern = re.compile(r'^(\d+(?:\.\d+)?)(s|m|h)$')
+    _duration_units = {'s': 1, 'm': 60, 'h': 3600}
+    _date_pattern = re.compile(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?Z?$')
+    _done = object()
+
+    def __init__(self, edgedockerclient, containers, follow=True, since=None, tail='all', pattern=None,
+                 json_output=False, timestamps=False, prefix=True):
+        self._client = edgedockerclient
+        self._containers = containers
+        self._follow = follow
+        self._since = since
+        self._tail = tail
+        self._pattern = re.compile(pattern) if pattern is not None else None
+        self._json_output = json_output
+        self._timestamps = timestamps
+        self._prefix_width = max([len(name) for name in containers] or [0]) if prefix else None
+        self._queue = queue.Queue(maxsize=LogStreamer.QUEUE_SIZE)
+        self._stopped = threading.Event()
+        self.errors = {}
+
+    @staticmethod
+    def parse_since(value, now=None):
+        """Parse a --since value like docker logs does: a unix timestamp, a UTC date or a duration such as
+        30s, 10m or 1.5h back from now. Returns a unix timestamp."""
+        if value is None:
+            return None
+        match = LogStreamer._duration_pattern.match(value)
+        if match is not None:
+            now = time.time() if now is None else now
+            return int(now - float(match.group(1)) * LogStreamer._duration_units[match.group(2)])
+        try:
+            return int(float(value))
+        except ValueError:
+            pass
+        match = LogStreamer._date_pattern.match(value)
+        if match is None:
+            raise EdgeValueError('Since `{0}` is not valid. Use a unix timestamp, a UTC date such as '
+                                 '2021-06-01T10:00:00Z or a duration such as 10m.'.format(value))
+        date = datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+        return int(date.timestamp())
+
+    def run(self, writer):
+        """Write the log lines to writer until every stream ended, or forever when following."""
+        readers = []
+        for container in self._containers:
+            reader = threading.Thread(target=self._read, args=(container,))
+            reader.daemon = True
+            reader.start()
+            readers.append(reader)
+
+        remaining = len(readers)
+        try:
+            while remaining > 0:
+                batch = [self._queue.get()]
+                while len(batch) < LogStreamer.BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = []
+                for item in batch:
+                    if item is LogStreamer._done:
+                        remaining -= 1
+                    else:
+                        lines.append(self._format(*item))
+                if lines:
+                    writer.write(''.join(lines))
+                    writer.flush()
+        finally:
+            self._stopped.set()
+
+    def _read(self, container):
+        try:
+            stream = self._client.stream_container_logs(container, follow=self._follow, since=self._since,
+                                                        tail=self._tail)
+            pending = b''
+            # Whether the next line continues one that was too long, and so has no timestamp
+            continued = False
+            for chunk in stream:
+                if self._stopped.is_set():
+                    break
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    self._put(container, line, continued)
+                    continued = False
+                if len(pending) > LogStreamer.MAX_LINE_SIZE:
+                    self._put(container, pending, continued)
+                    pending = b''
+                    continued = True
+            if pending:
+                self._put(container, pending, continued)
+        except Exception as e:
+            self.errors[container] = str(e)
+        finally:
+            self._queue.put(LogStreamer._done)
+
+    def _put(self, container, line, continued=False):
+        text = line.decode('utf-8', errors='replace').rstrip('\r')
+        if continued:
+            timestamp, message = '', text
+        else:
+            timestamp, _, message = text.partition(' ')
+        if self._pattern is not None and self._pattern.search(message) is None:
+            return
+        self._queue.put((container, timestamp, message))
+
+    def _format(self, container, timestamp, message):
+        if self._json_output:
+            return json.dumps({'container': container, 'timestamp': timestamp, 'message': message}) + '\n'
+        if self._timestamps:
+            message = timestamp + ' ' + message
+        if self._prefix_width is not None:
+            return '{0} | {1}\n'.format(container.ljust(self._prefix_width), message)
+        return message + '\n'
@@ -0,0 +1,175 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import math
+import threading
+import time
+
+
+class Counter(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram(object):
+    """Latency histogram with logarithmic buckets, in the spirit of HdrHistogram.
+
+    Every power of two above MIN_VALUE seconds is split into SUB_BUCKETS buckets, so percentiles are
+    accurate to about 4% whatever the magnitude, and memory only grows with the range of values seen."""
+    MIN_VALUE = 1e-6
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        index = Histogram._get_index(value)
+        with self._lock:
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        with other._lock:
+            buckets = dict(other._buckets)
+            count, total, min_value, max_value = other.count, other.total, other.min, other.max
+        if count == 0:
+            return
+        with self._lock:
+            for index, bucket_count in buckets.items():
+                self._buckets[index] = self._buckets.get(index, 0) + bucket_count
+            self.count += count
+            self.total += total
+            self.min = min_value if self.min is None else min(self.min, min_value)
+            self.max = max_value if self.max is None else max(self.max, max_value)
+
+    def percentile(self, percent):
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+            seen = 0
+            for index in sorted(self._buckets):
+                seen += self._buckets[index]
+                if seen >= rank:
+                    return min(max(Histogram._get_upper_bound(index), self.min), self.max)
+            return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99)
+        }
+
+    @staticmethod
+    def _get_index(value):
+        if value <= Histogram.MIN_VALUE:
+            return 0
+        return int(math.log2(value / Histogram.MIN_VALUE) * Histogram.SUB_BUCKETS) + 1
+
+    @staticmethod
+    def _get_upper_bound(index):
+        return Histogram.MIN_VALUE * 2 ** (index / float(Histogram.SUB_BUCKETS))
+
+
+class _Timer(object):
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._registry.histogram(self._name).record(time.perf_counter() - self._start)
+        if exc_type is not None:
+            self._registry.counter(self._name + ' errors').inc()
+        return False
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name):
+        counter = self._counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def timed(self, name):
+        """Context manager recording the latency of the block in the `name` histogram,
+        and counting exceptions in the `<name> errors` counter."""
+        return _Timer(self, name)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        return {
+            'counters': {name: counter.value for name, counter in sorted(counters.items())},
+            'latencies': {name: histogram.to_dict() for name, histogram in sorted(histograms.items())}
+        }
+
+    def format_summary(self):
+        snapshot = self.snapshot()
+        lines = ['{0:<36} {1:>6} {2:>6} {3:>11} {4:>9} {5:>9} {6:>9} {7:>9}'.format(
+            'OPERATION', 'CALLS', 'ERRORS', 'TOTAL(ms)', 'P50(ms)', 'P90(ms)', 'P99(ms)', 'MAX(ms)')]
+        for name, latency in snapshot['latencies'].items():
+            lines.append('{0:<36} {1:>6} {2:>6} {3:>11.1f} {4:>9.1f} {5:>9.1f} {6:>9.1f} {7:>9.1f}'.format(
+                name, latency['count'], snapshot['counters'].get(name + ' errors', 0), latency['sum'] * 1000,
+                latency['p50'] * 1000, latency['p90'] * 1000, latency['p99'] * 1000, latency['max'] * 1000))
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+def timed(name):
+    return _registry.timed(name)
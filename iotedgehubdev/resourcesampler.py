@@ -0,0 +1,177 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import csv
+import threading
+import time
+
+
+class ResourceSampler(object):
+    """Follows the Docker stats stream of several containers at once, one reader thread per container.
+
+    Keeps the latest sample of each container for a live table, the peak and the average for the summary,
+    and optionally appends every sample to a CSV file."""
+    CSV_COLUMNS = ['time', 'container', 'cpu_percent', 'memory_bytes', 'memory_limit_bytes', 'net_rx_bytes',
+                   'net_tx_bytes', 'block_read_bytes', 'block_write_bytes']
+    # Write the CSV file out at most this often rather than on every sample
+    FLUSH_INTERVAL = 5.0
+
+    def __init__(self, edgedockerclient, containers, record_file=None):
+        self._client = edgedockerclient
+        self._containers = containers
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._latest = {}
+        self._summary = {}
+        self._record = None
+        self._record_writer = None
+        self._last_flush = time.time()
+        if record_file is not None:
+            self._record = open(record_file, 'w', newline='')
+            self._record_writer = csv.writer(self._record)
+            self._record_writer.writerow(ResourceSampler.CSV_COLUMNS)
+        self.errors = {}
+
+    @staticmethod
+    def parse_sample(stats):
+        """CPU, memory, network and block I/O of one Docker stats sample, computed like `docker stats` does.
+        Network and block I/O are totals since the container started."""
+        cpu_stats = stats.get('cpu_stats') or {}
+        precpu_stats = stats.get('precpu_stats') or {}
+        cpu_percent = 0.0
+        cpu_usage = cpu_stats.get('cpu_usage') or {}
+        cpu_delta = cpu_usage.get('total_usage', 0) - (precpu_stats.get('cpu_usage') or {}).get('total_usage', 0)
+        system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+        # The first sample of a stream has no previous reading to compare with
+        if precpu_stats.get('system_cpu_usage') and system_delta > 0 and cpu_delta > 0:
+            online_cpus = cpu_stats.get('online_cpus') or len(cpu_usage.get('percpu_usage') or [1])
+            cpu_percent = float(cpu_delta) / system_delta * online_cpus * 100
+
+        memory_stats = stats.get('memory_stats') or {}
+        memory = memory_stats.get('usage', 0)
+        detail = memory_stats.get('stats') or {}
+        # Page cache can be reclaimed, so it is not counted; cgroup v2 calls it inactive_file, v1 total_inactive_file
+        memory -= detail.get('inactive_file', detail.get('total_inactive_file', 0))
+
+        networks = stats.get('networks') or {}
+        block_read = block_write = 0
+        for entry in (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []:
+            if entry.get('op', '').lower() == 'read':
+                block_read += entry.get('value', 0)
+            elif entry.get('op', '').lower() == 'write':
+                block_write += entry.get('value', 0)
+
+        return {
+            'cpu': cpu_percent,
+            'memory': max(memory, 0),
+            'memoryLimit': memory_stats.get('limit', 0),
+            'netRx': sum(network.get('rx_bytes', 0) for network in networks.values()),
+            'netTx': sum(network.get('tx_bytes', 0) for network in networks.values()),
+            'blockRead': block_read,
+            'blockWrite': block_write
+        }
+
+    def start(self):
+        for container in self._containers:
+            reader = threading.Thread(target=self._read, args=(container,))
+            reader.daemon = True
+            reader.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            if self._record is not None:
+                self._record.close()
+                self._record = None
+
+    def add_sample(self, container, sample, sample_time=None):
+        sample_time = time.time() if sample_time is None else sample_time
+        with self._lock:
+            self._latest[container] = sample
+            summary = self._summary.get(container)
+            if summary is None:
+                summary = self._summary[container] = {'samples': 0, 'cpuSum': 0.0, 'cpuPeak': 0.0, 'memorySum': 0,
+                                                      'memoryPeak': 0, 'first': sample}
+            summary['samples'] += 1
+            summary['cpuSum'] += sample['cpu']
+            summary['cpuPeak'] = max(summary['cpuPeak'], sample['cpu'])
+            summary['memorySum'] += sample['memory']
+            summary['memoryPeak'] = max(summary['memoryPeak'], sample['memory'])
+            summary['last'] = sample
+            if self._record is not None:
+                self._record_writer.writerow([
+                    '{0:.3f}'.format(sample_time), container, '{0:.2f}'.format(sample['cpu']), sample['memory'],
+                    sample['memoryLimit'], sample['netRx'], sample['netTx'], sample['blockRead'], sample['blockWrite']])
+                if sample_time - self._last_flush >= ResourceSampler.FLUSH_INTERVAL:
+                    self._record.flush()
+                    self._last_flush = sample_time
+
+    def get_summary(self):
+        """Average and peak CPU and memory, and network and block I/O during sampling, of each container."""
+        with self._lock:
+            summary = {}
+            for container, stats in self._summary.items():
+                first, last = stats['first'], stats['last']
+                summary[container] = {
+                    'samples': stats['samples'],
+                    'cpuAvg': stats['cpuSum'] / stats['samples'],
+                    'cpuPeak': stats['cpuPeak'],
+                    'memoryAvg': stats['memorySum'] / stats['samples'],
+                    'memoryPeak': stats['memoryPeak'],
+                    'netRx': last['netRx'] - first['netRx'],
+                    'netTx': last['netTx'] - first['netTx'],
+                    'blockRead': last['blockRead'] - first['blockRead'],
+                    'blockWrite': last['blockWrite'] - first['blockWrite']
+                }
+            return summary
+
+    def format_table(self):
+        lines = ['{0:<32} {1:>7} {2:>21} {3:>21} {4:>21}'.format('CONTAINER', 'CPU %', 'MEM USAGE / LIMIT',
+                                                                 'NET I/O', 'BLOCK I/O')]
+        with self._lock:
+            for container in self._containers:
+                sample = self._latest.get(container)
+                if sample is None:
+                    lines.append('{0:<32} {1:>7}'.format(container, '-'))
+                    continue
+                lines.append('{0:<32} {1:>7.2f} {2:>21} {3:>21} {4:>21}'.format(
+                    container, sample['cpu'],
+                    _format_pair(sample['memory'], sample['memoryLimit']),
+                    _format_pair(sample['netRx'], sample['netTx']),
+                    _format_pair(sample['blockRead'], sample['blockWrite'])))
+        return lines
+
+    def format_summary(self):
+        lines = ['{0:<32} {1:>7} {2:>8} {3:>9} {4:>10} {5:>10} {6:>21} {7:>21}'.format(
+            'CONTAINER', 'SAMPLES', 'CPU AVG', 'CPU PEAK', 'MEM AVG', 'MEM PEAK', 'NET I/O', 'BLOCK I/O')]
+        for container, stats in sorted(self.get_summary().items()):
+            lines.append('{0:<32} {1:>7} {2:>7.2f}% {3:>8.2f}% {4:>10} {5:>10} {6:>21} {7:>21}'.format(
+                container, stats['samples'], stats['cpuAvg'], stats['cpuPeak'], format_bytes(stats['memoryAvg']),
+                format_bytes(stats['memoryPeak']), _format_pair(stats['netRx'], stats['netTx']),
+                _format_pair(stats['blockRead'], stats['blockWrite'])))
+        return lines
+
+    def _read(self, container):
+        try:
+            for stats in self._client.stream_container_stats(container):
+                if self._stopped.is_set():
+                    return
+                if not stats.get('read') or stats['read'].startswith('0001-01-01'):
+                    # Sent for a container that is not running
+                    continue
+                self.add_sample(container, ResourceSampler.parse_sample(stats))
+        except Exception as e:
+            if not self._stopped.is_set():
+                self.errors[container] = str(e)
+
+
+def format_bytes(value):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(value) < 1024 or unit == 'GiB':
+            return '{0:.1f}{1}'.format(value, unit) if unit != 'B' else '{0:.0f}B'.format(value)
+        value /= 1024.0
+
+
+def _format_pair(first, second):
+    return '{0} / {1}'.format(format_bytes(first), format_bytes(second))
@@ -0,0 +1,87 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import tracing
+
+
+class TaskGraph(object):
+    """Runs named tasks on a thread pool, each one as soon as the tasks it depends on have finished.
+
+    A task is called with the results of its dependencies, in the order they were given. Once a task fails
+    no other task is started, the running ones are waited for and the first error is raised. Dependencies
+    must be added before the tasks depending on them, so the graph cannot have cycles."""
+
+    def __init__(self, max_workers=None):
+        self._tasks = OrderedDict()
+        self._max_workers = max_workers
+        # When each task ran, in seconds from the start of run()
+        self.timeline = []
+
+    def add(self, name, func, depends=()):
+        if name in self._tasks:
+            raise ValueError('Task `{0}` is already in the graph.'.format(name))
+        for dependency in depends:
+            if dependency not in self._tasks:
+                raise ValueError('Task `{0}` depends on unknown task `{1}`.'.format(name, dependency))
+        self._tasks[name] = (func, tuple(depends))
+        return name
+
+    def run(self):
+        """Run all the tasks and return their results by name."""
+        results = {}
+        pending = OrderedDict(self._tasks)
+        running = {}
+        error = None
+        origin = time.perf_counter()
+        self.timeline = []
+        with ThreadPoolExecutor(max_workers=self._max_workers or max(len(self._tasks), 1)) as executor:
+            while pending or running:
+                for name, (func, depends) in list(pending.items()):
+                    if all(dependency in results for dependency in depends):
+                        del pending[name]
+                        args = [results[dependency] for dependency in depends]
+                        running[executor.submit(self._run_task, name, func, args, origin)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+                if error is not None:
+                    pending.clear()
+        if error is not None:
+            raise error
+        return results
+
+    def _run_task(self, name, func, args, origin):
+        entry = {'name': name, 'start': time.perf_counter() - origin}
+        try:
+            with tracing.span('task.' + name):
+                return func(*args)
+        except Exception:
+            entry['error'] = True
+            raise
+        finally:
+            entry['end'] = time.perf_counter() - origin
+            self.timeline.append(entry)
+
+    @staticmethod
+    def format_timeline(timeline, width=40):
+        """Lines with the start and duration of each task, and a bar showing when it ran."""
+        total = max([entry['end'] for entry in timeline] or [0]) or 1
+        lines = ['{0:<20} {1:>10} {2:>13}  {3}'.format('TASK', 'START(ms)', 'DURATION(ms)', 'TIMELINE')]
+        for entry in sorted(timeline, key=lambda entry: entry['start']):
+            begin = min(int(entry['start'] / total * width), width - 1)
+            end = max(begin + 1, int(round(entry['end'] / total * width)))
+            bar = ' ' * begin + ('x' if entry.get('error') else '#') * (end - begin)
+            lines.append('{0:<20} {1:>10.1f} {2:>13.1f}  |{3}|'.format(
+                entry['name'], entry['start'] * 1000, (entry['end'] - entry['start']) * 1000, bar.ljust(width)))
+        return lines
@@ -0,0 +1,186 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+# The active TraceSession, None when tracing is disabled. span() and traced() check it first so that
+# instrumented code pays a single global lookup when nobody asked for timings.
+_session = None
+
+
+class Span(object):
+    def __init__(self, session, name, args):
+        self.session = session
+        self.name = name
+        self.args = args
+        self.path = None
+        self.tid = None
+        self.start = None
+        self.end = None
+        self.children_duration = 0.0
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def __enter__(self):
+        stack = self.session._get_stack()
+        parent = stack[-1] if stack else None
+        self.path = (parent.path if parent else ()) + (self.name,)
+        self.tid = threading.current_thread().ident
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        stack = self.session._get_stack()
+        stack.pop()
+        if stack:
+            stack[-1].children_duration += self.duration
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.session._record(self)
+        return False
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class TraceSession(object):
+    def __init__(self):
+        self._spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    @property
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def span(self, name, args=None):
+        return Span(self, name, args or {})
+
+    def get_summary(self):
+        """Aggregate the spans by their nesting path, ordered by first start time.
+
+        Returns a list of dicts with path, count, total, self (total minus nested spans) and max in seconds."""
+        rows = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            row = rows.get(span.path)
+            if row is None:
+                row = rows[span.path] = {'path': span.path, 'count': 0, 'total': 0.0, 'self': 0.0, 'max': 0.0}
+            row['count'] += 1
+            row['total'] += span.duration
+            row['self'] += span.duration - span.children_duration
+            row['max'] = max(row['max'], span.duration)
+        return TraceSession._order_by_tree(list(rows.values()))
+
+    def format_summary(self):
+        lines = ['{0:<56} {1:>6} {2:>11} {3:>11} {4:>11}'.format('PHASE', 'CALLS', 'TOTAL(ms)', 'SELF(ms)', 'MAX(ms)')]
+        for row in self.get_summary():
+            name = '  ' * (len(row['path']) - 1) + row['path'][-1]
+            lines.append('{0:<56} {1:>6} {2:>11.1f} {3:>11.1f} {4:>11.1f}'.format(
+                name, row['count'], row['total'] * 1000, row['self'] * 1000, row['max'] * 1000))
+        return lines
+
+    def to_chrome_trace(self):
+        """Complete ("X") events of the Chrome trace event format, loadable in chrome://tracing or Perfetto."""
+        events = []
+        for span in self.spans:
+            events.append({
+                'name': span.name,
+                'cat': span.name.split('.')[0],
+                'ph': 'X',
+                'ts': round((span.start - self._origin) * 1e6, 3),
+                'dur': round(span.duration * 1e6, 3),
+                'pid': self._pid,
+                'tid': span.tid,
+                'args': {key: str(value) for key, value in span.args.items()}
+            })
+        events.sort(key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, file_path):
+        with open(file_path, 'w') as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+    def _get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    @staticmethod
+    def _order_by_tree(rows):
+        # Children follow their parent, siblings keep first-start order
+        children = {}
+        for row in rows:
+            children.setdefault(row['path'][:-1], []).append(row)
+        ordered = []
+
+        def _visit(path):
+            for row in children.get(path, []):
+                ordered.append(row)
+                _visit(row['path'])
+
+        _visit(())
+        return ordered
+
+
+def start():
+    global _session
+    _session = TraceSession()
+    return _session
+
+
+def stop():
+    global _session
+    session = _session
+    _session = None
+    return session
+
+
+def is_enabled():
+    return _session is not None
+
+
+def span(name, **args):
+    session = _session
+    if session is None:
+        return _NULL_SPAN
+    return session.span(name, args)
+
+
+def traced(name):
+    def _decorator(func):
+        @wraps(func)
+        def _wrapped_func(*args, **kwargs):
+            session = _session
+            if session is None:
+                return func(*args, **kwargs)
+            with session.span(name, {}):
+                return func(*args, **kwargs)
+
+        return _wrapped_func
+
+    return _decorator
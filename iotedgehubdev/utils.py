@@ -2,12 +2,14 @@
 # Licensed under the MIT License.
 
 
+import csv
 import errno
 import os
 import shutil
 import socket
 import stat
 import subprocess
+import tempfile
 
 
 from base64 import b64decode, b64encode
@@ -127,15 +129,34 @@ class Utils(object):
     @staticmethod
     def create_file(file_path, data, file_type_diagnostic, mode=0o644):
         try:
-            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
-            with os.fdopen(fd, 'w') as output_file:
-                output_file.write(data)
+            Utils.write_file_atomic(file_path, data, mode)
         except OSError as ex:
             msg = 'Error creating {0}: {1}. ' \
                   'Errno: {2}, Error: {3}'.format(file_type_diagnostic,
                                                   file_path, str(ex.errno), ex.strerror)
             raise EdgeFileAccessError(msg, file_path)
 
+    @staticmethod
+    def write_file_atomic(file_path, data, mode=None):
+        """Write data to a temporary file next to file_path and rename it over file_path, so readers
+        and concurrent writers only ever see a complete file. data is text unless it is bytes.
+        Without a mode, an existing file keeps its mode."""
+        if mode is None:
+            mode = stat.S_IMODE(os.stat(file_path).st_mode) if os.path.exists(file_path) else 0o644
+        dir_path = os.path.dirname(os.path.abspath(file_path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.{0}.'.format(os.path.basename(file_path)), suffix='.tmp', dir=dir_path)
+        try:
+            with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as output_file:
+                output_file.write(data)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
     @staticmethod
     def get_iot_hub_sas_token(uri, key, policy_name, expiry=3600):
         ttl = time() + expiry
@@ -204,3 +225,26 @@ class Utils(object):
         result[EC.KEY_SUFFIX] = os.path.join(root_dir, cert_id + EC.KEY_SUFFIX)
         result[EC.CHAIN_CERT_SUFFIX] = os.path.join(root_dir, cert_id + EC.CHAIN_CERT_SUFFIX)
         return result
+
+    @staticmethod
+    def parse_device_ids(device_ids_str, device_ids_file):
+        """Collect device IDs from a comma-separated string and/or a text or CSV file with the ID in the first
+        column. Blank lines, lines starting with # and a deviceId header are skipped. Duplicates are dropped."""
+        device_ids = []
+        if device_ids_str:
+            device_ids.extend(device_ids_str.split(','))
+        if device_ids_file:
+            with open(device_ids_file, newline='') as f:
+                for row in csv.reader(f):
+                    if row and not row[0].strip().startswith('#'):
+                        device_ids.append(row[0])
+
+        result = []
+        for device_id in device_ids:
+            device_id = device_id.strip()
+            if not device_id or device_id.lower() == 'deviceid' or device_id in result:
+                continue
+            if device_id in ('.', '..') or os.path.basename(device_id) != device_id or '/' in device_id:
+                raise ValueError('Device ID `{0}` is not valid.'.format(device_id))
+            result.append(device_id)
+        return result
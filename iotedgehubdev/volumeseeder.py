@@ -0,0 +1,112 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+import errno
+import hashlib
+import json
+import os
+import tarfile
+import time
+
+from .edgedockerclient import EdgeDockerClient
+
+
+class VolumeSeeder(object):
+    """Streams a directory tree into a volume as a tar archive generated one chunk at a time, so memory does not
+    grow with the size of the files.
+
+    The volume keeps the size, modification time and SHA-256 of the files seeded into it in a manifest. A file with
+    the same size and modification time is skipped without reading it, and one with the same size and hash is
+    skipped once hashed. Files removed from the directory are left in the volume."""
+    CHUNK_SIZE = 1024 * 1024
+    _BLOCK_SIZE = tarfile.BLOCKSIZE
+
+    def __init__(self, source_dir, manifest=None, chunk_size=CHUNK_SIZE):
+        self._source_dir = source_dir
+        self._chunk_size = chunk_size
+        self._manifest = dict(manifest or {})
+        self._manifest_changed = False
+        # (name in the volume, path, size, mtime, mode) of the files to copy
+        self.files = []
+        self.skipped = []
+        self.skipped_bytes = 0
+        self.total_bytes = 0
+        self.copied_bytes = 0
+        self._plan()
+
+    @property
+    def needs_copy(self):
+        return bool(self.files) or self._manifest_changed
+
+    def _plan(self):
+        for dir_path, dir_names, file_names in os.walk(self._source_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                path = os.path.join(dir_path, file_name)
+                name = os.path.relpath(path, self._source_dir).replace(os.sep, '/')
+                if name == EdgeDockerClient.SEED_MANIFEST or not os.path.isfile(path):
+                    continue
+                file_stat = os.stat(path)
+                entry = self._manifest.get(name)
+                if isinstance(entry, dict) and entry.get('size') == file_stat.st_size:
+                    unchanged = entry.get('mtime') == file_stat.st_mtime
+                    if not unchanged and entry.get('sha256') == VolumeSeeder._hash_file(path, self._chunk_size):
+                        # Touched but not modified, so only the manifest needs the new time
+                        entry['mtime'] = file_stat.st_mtime
+                        self._manifest_changed = unchanged = True
+                    if unchanged:
+                        self.skipped.append(name)
+                        self.skipped_bytes += file_stat.st_size
+                        continue
+                self.files.append((name, path, file_stat.st_size, file_stat.st_mtime, file_stat.st_mode & 0o777))
+                self.total_bytes += file_stat.st_size
+
+    def iter_archive(self, progress=None):
+        """Yield the tar archive of the files to copy and the updated manifest. progress is called with the
+        bytes copied so far and the total after each chunk."""
+        for name, path, size, mtime, mode in self.files:
+            yield VolumeSeeder._header(name, size, mtime, mode)
+            digest = hashlib.sha256()
+            remaining = size
+            with open(path, 'rb') as f:
+                while remaining:
+                    chunk = f.read(min(self._chunk_size, remaining))
+                    if not chunk:
+                        raise IOError(errno.EIO, 'File shrank while it was being seeded', path)
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                    self.copied_bytes += len(chunk)
+                    yield chunk
+                    if progress is not None:
+                        progress(self.copied_bytes, self.total_bytes)
+            yield VolumeSeeder._padding(size)
+            self._manifest[name] = {'size': size, 'mtime': mtime, 'sha256': digest.hexdigest()}
+
+        data = json.dumps(self._manifest, sort_keys=True).encode('utf-8')
+        yield VolumeSeeder._header(EdgeDockerClient.SEED_MANIFEST, len(data), time.time(), 0o644)
+        yield data
+        yield VolumeSeeder._padding(len(data))
+        # The end of the archive
+        yield b'\0' * (2 * VolumeSeeder._BLOCK_SIZE)
+
+    @staticmethod
+    def _header(name, size, mtime, mode):
+        archive_info = tarfile.TarInfo(name=name)
+        archive_info.size = size
+        archive_info.mtime = mtime
+        archive_info.mode = mode
+        # PAX headers allow long names and files over 8 GiB
+        return archive_info.tobuf(format=tarfile.PAX_FORMAT)
+
+    @staticmethod
+    def _padding(size):
+        return b'\0' * (-size % VolumeSeeder._BLOCK_SIZE)
+
+    @staticmethod
+    def _hash_file(path, chunk_size):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
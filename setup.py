@@ -29,6 +29,7 @@ dependencies = [
     'click',
     'docker==5.0.3',
     'pyOpenSSL==22.0.0',
+    'cryptography>=35.0',
     'requests>=2.25.1',
     'applicationinsights==0.11.9',
     'pyyaml>=5.4',
@@ -5,6 +5,9 @@ import os
 import unittest
 import shutil
 from unittest import mock
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import pkcs12
+from OpenSSL import crypto
 from iotedgehubdev.certutils import EdgeCertUtil
 from iotedgehubdev.constants import EdgeConstants as EC
 from iotedgehubdev.errors import EdgeValueError
@@ -67,6 +70,75 @@ class TestEdgeCertUtilAPICreateRootCACert(unittest.TestCase):
                                           passphrase=bad_pass_1024)
 
 
+class TestEdgeCertUtilAPIPregenerateKeyPairs(unittest.TestCase):
+    @mock.patch('os.cpu_count', mock.MagicMock(return_value=3))
+    def test_pregenerated_key_pairs_are_used_for_chain(self):
+        cert_util = EdgeCertUtil()
+        cert_util.pregenerate_key_pairs({
+            'root': (EdgeCertUtil.TYPE_RSA, 1024),
+            'int': (EdgeCertUtil.TYPE_RSA, 1024),
+            'server': (EdgeCertUtil.TYPE_RSA, 1024)
+        })
+        cert_util.create_root_ca_cert('root', subject_dict=VALID_SUBJECT_DICT)
+        cert_util.create_intermediate_ca_cert('int', 'root', common_name='name')
+        cert_util.create_server_cert('server', 'int', hostname='name')
+        for id_str in ['root', 'int', 'server']:
+            self.assertEqual(1024, cert_util._get_cert_dict(id_str)['key_pair'].bits())
+
+    @mock.patch('os.cpu_count', mock.MagicMock(return_value=2))
+    @mock.patch('iotedgehubdev.certutils.ProcessPoolExecutor')
+    def test_pregenerate_key_pairs_falls_back_to_serial(self, mock_executor):
+        mock_executor.side_effect = OSError('no process pool')
+        cert_util = EdgeCertUtil()
+        cert_util.pregenerate_key_pairs({
+            'root': (EdgeCertUtil.TYPE_RSA, 1024),
+            'int': (EdgeCertUtil.TYPE_RSA, 1024)
+        })
+        mock_executor.assert_called_with(max_workers=2)
+        cert_util.create_root_ca_cert('root', subject_dict=VALID_SUBJECT_DICT)
+        self.assertEqual(1024, cert_util._get_cert_dict('root')['key_pair'].bits())
+
+    def test_key_pair_generated_inline_without_pregeneration(self):
+        cert_util = EdgeCertUtil()
+        cert_util.create_root_ca_cert('root', subject_dict=VALID_SUBJECT_DICT)
+        self.assertEqual(EdgeCertUtil.CA_KEY_LEN, cert_util._get_cert_dict('root')['key_pair'].bits())
+
+
+class TestEdgeCertUtilAPIKeyAlgorithm(unittest.TestCase):
+    def tearDown(self):
+        for id_str in ['root', 'server']:
+            test_data_folder = os.path.join(WORKINGDIRECTORY, id_str)
+            if os.path.exists(test_data_folder):
+                shutil.rmtree(test_data_folder)
+
+    def test_get_key_spec(self):
+        self.assertEqual((EdgeCertUtil.TYPE_RSA, 2048), EdgeCertUtil.get_key_spec('rsa', 2048))
+        self.assertEqual((EdgeCertUtil.TYPE_EC, 256), EdgeCertUtil.get_key_spec('ecdsa-p256', 2048))
+        self.assertEqual((EdgeCertUtil.TYPE_EC, 384), EdgeCertUtil.get_key_spec('ecdsa-p384', 4096))
+        with self.assertRaises(EdgeValueError):
+            EdgeCertUtil.get_key_spec('dsa', 2048)
+
+    def test_create_ecdsa_cert_chain(self):
+        cert_util = EdgeCertUtil()
+        cert_util.create_root_ca_cert('root', subject_dict=VALID_SUBJECT_DICT, key_algorithm='ecdsa-p384')
+        cert_util.create_intermediate_ca_cert('int', 'root', common_name='name', key_algorithm='ecdsa-p256')
+        cert_util.create_server_cert('server', 'int', hostname='name', key_algorithm='ecdsa-p256')
+        self.assertEqual(crypto.TYPE_EC, cert_util._get_cert_dict('root')['key_pair'].type())
+        self.assertEqual(384, cert_util._get_cert_dict('root')['key_pair'].bits())
+        self.assertEqual(256, cert_util._get_cert_dict('server')['key_pair'].bits())
+
+        cert_util.export_simulator_cert_artifacts_to_dir('server', WORKINGDIRECTORY)
+        cert_util.export_pfx_cert('server', WORKINGDIRECTORY)
+        with open(cert_util.get_pfx_file_path('server', WORKINGDIRECTORY), 'rb') as pfx_file:
+            private_key, _, _ = pkcs12.load_key_and_certificates(pfx_file.read(), None)
+        self.assertIsInstance(private_key, ec.EllipticCurvePrivateKey)
+
+    def test_create_cert_key_algorithm_invalid(self):
+        cert_util = EdgeCertUtil()
+        with self.assertRaises(EdgeValueError):
+            cert_util.create_root_ca_cert('root', subject_dict=VALID_SUBJECT_DICT, key_algorithm='ecdsa-p521')
+
+
 class TestEdgeCertUtilAPICreateIntCACert(unittest.TestCase):
     def test_create_intermediate_ca_cert_duplicate_ids_invalid(self):
         cert_util = EdgeCertUtil()
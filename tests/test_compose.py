@@ -478,3 +478,88 @@ def create_test_compose_project(json_file):
     })
 
     return compose_project
+
+
+def test_remap_host_ports():
+    compose_project = ComposeProject({})
+    compose_project.Services = {
+        'edgeHub': {'ports': ['8883:8883', '0.0.0.0:443:443/tcp', '127.0.0.1:5671']},
+        'module': {'image': 'module'}
+    }
+    ports = compose_project.remap_host_ports(lambda port: port + 1000)
+    assert compose_project.Services['edgeHub']['ports'] == ['9883:8883', '0.0.0.0:1443:443/tcp', '127.0.0.1:5671']
+    assert 'ports' not in compose_project.Services['module']
+    assert ports == {'edgeHub': {'8883': 9883, '443/tcp': 1443}}
+
+
+def test_container_prefix():
+    test_resources_dir = os.path.join('tests', 'test_compose_resources')
+    with open(os.path.join(test_resources_dir, 'deployment_with_create_options.json')) as json_file:
+        compose_project = create_test_compose_project(json_file)
+    compose_project.edge_info['container_prefix'] = 'sim1-'
+    compose_project.compose()
+    for service_name, config in compose_project.Services.items():
+        assert config['container_name'] == 'sim1-' + service_name
+
+
+def test_metrics_port():
+    test_resources_dir = os.path.join('tests', 'test_compose_resources')
+    with open(os.path.join(test_resources_dir, 'deployment_with_create_options.json')) as json_file:
+        compose_project = create_test_compose_project(json_file)
+    compose_project.edge_info['metrics_port'] = 9700
+    compose_project.compose()
+    assert '9700:9600' in compose_project.Services[EdgeManager.EDGEHUB]['ports']
+    ports = compose_project.remap_host_ports(lambda port: port)
+    assert ports[EdgeManager.EDGEHUB]['9600'] == 9700
+
+
+def test_host_network():
+    test_resources_dir = os.path.join('tests', 'test_compose_resources')
+    with open(os.path.join(test_resources_dir, 'deployment_with_create_options.json')) as json_file:
+        compose_project = create_test_compose_project(json_file)
+    compose_project.edge_info['metrics_port'] = 9700
+    compose_project.edge_info['host_network'] = True
+    compose_project.compose()
+    for service in compose_project.Services.values():
+        assert service['network_mode'] == 'host'
+        assert 'networks' not in service
+        assert 'ports' not in service
+    hub_alias = compose_project.edge_info['network_info']['ALIASES']
+    for service_name, service in compose_project.Services.items():
+        if service_name != EdgeManager.EDGEHUB:
+            assert '{0}:127.0.0.1'.format(hub_alias) in service['extra_hosts']
+    assert compose_project.remap_host_ports(lambda port: port) == {}
+
+
+def test_module_status_and_pull_policy():
+    test_resources_dir = os.path.join('tests', 'test_compose_resources')
+    with open(os.path.join(test_resources_dir, 'deployment_with_create_options.json')) as json_file:
+        compose_project = create_test_compose_project(json_file)
+    modules = compose_project.module_content['$edgeAgent']['properties.desired']['modules']
+    modules['tempSensor']['status'] = 'stopped'
+    modules['tempSensor']['imagePullPolicy'] = 'never'
+    compose_project.compose()
+    assert compose_project.StoppedServices == ['tempSensor']
+    assert compose_project.PullPolicies == {EdgeManager.EDGEHUB: 'on-create', 'tempSensor': 'never'}
+    assert 'tempSensor' in compose_project.Services
+
+    modules['tempSensor']['imagePullPolicy'] = 'always'
+    with pytest.raises(KeyError):
+        compose_project.compose()
+
+
+def test_startup_order():
+    test_resources_dir = os.path.join('tests', 'test_compose_resources')
+    with open(os.path.join(test_resources_dir, 'deployment_with_create_options.json')) as json_file:
+        compose_project = create_test_compose_project(json_file)
+    modules = compose_project.module_content['$edgeAgent']['properties.desired']['modules']
+    compose_project.compose()
+    assert compose_project.StartupOrders == {EdgeManager.EDGEHUB: 4294967295, 'tempSensor': 4294967295}
+
+    modules['tempSensor']['startupOrder'] = 1
+    compose_project.compose()
+    assert compose_project.StartupOrders['tempSensor'] == 1
+
+    modules['tempSensor']['startupOrder'] = -1
+    with pytest.raises(ValueError):
+        compose_project.compose()
@@ -0,0 +1,102 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from iotedgehubdev.cryptocertutils import CryptographyEdgeCertUtil
+from iotedgehubdev.edgecert import EdgeCert
+from iotedgehubdev.errors import EdgeInvalidArgument, EdgeValueError
+from .test_certutils import VALID_SUBJECT_DICT
+
+
+class TestCryptographyEdgeCertUtil(unittest.TestCase):
+    def setUp(self):
+        self.certs_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.certs_dir)
+
+    def _create_chain(self, cert_util, key_algorithm='rsa'):
+        cert_util.create_root_ca_cert('root', subject_dict=VALID_SUBJECT_DICT, key_algorithm=key_algorithm)
+        cert_util.create_intermediate_ca_cert('int', 'root', common_name='name', key_algorithm=key_algorithm)
+        cert_util.create_server_cert('server', 'int', hostname='testhostname', key_algorithm=key_algorithm)
+
+    def _load_cert(self, cert_util, id_str):
+        with open(cert_util.get_cert_file_path(id_str, self.certs_dir), 'rb') as cert_file:
+            return x509.load_pem_x509_certificate(cert_file.read())
+
+    def test_create_cert_chain(self):
+        cert_util = CryptographyEdgeCertUtil()
+        self._create_chain(cert_util)
+        for id_str in ['root', 'int', 'server']:
+            cert_util.export_simulator_cert_artifacts_to_dir(id_str, self.certs_dir)
+
+        root = self._load_cert(cert_util, 'root')
+        intermediate = self._load_cert(cert_util, 'int')
+        server = self._load_cert(cert_util, 'server')
+        self.assertEqual(root.subject, root.issuer)
+        self.assertEqual(root.subject, intermediate.issuer)
+        self.assertEqual('name', intermediate.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value)
+        self.assertEqual('Test Organization',
+                         intermediate.subject.get_attributes_for_oid(x509.NameOID.ORGANIZATION_NAME)[0].value)
+        self.assertEqual(intermediate.subject, server.issuer)
+        self.assertTrue(root.extensions.get_extension_for_class(x509.BasicConstraints).value.ca)
+        self.assertFalse(server.extensions.get_extension_for_class(x509.BasicConstraints).value.ca)
+        self.assertEqual(['localhost', 'testhostname'],
+                         server.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+                         .get_values_for_type(x509.DNSName))
+        self.assertIsInstance(server.public_key(), rsa.RSAPublicKey)
+        self.assertEqual(2048, server.public_key().key_size)
+        self.assertEqual(4096, root.public_key().key_size)
+
+    def test_export_pfx_cert_ecdsa(self):
+        cert_util = CryptographyEdgeCertUtil()
+        self._create_chain(cert_util, 'ecdsa-p256')
+        cert_util.export_simulator_cert_artifacts_to_dir('server', self.certs_dir)
+        cert_util.export_pfx_cert('server', self.certs_dir)
+        with open(cert_util.get_pfx_file_path('server', self.certs_dir), 'rb') as pfx_file:
+            private_key, cert, _ = pkcs12.load_key_and_certificates(pfx_file.read(), None)
+        self.assertIsInstance(private_key, ec.EllipticCurvePrivateKey)
+        self.assertEqual(self._load_cert(cert_util, 'server'), cert)
+
+    def test_load_cert_from_file(self):
+        cert_util = CryptographyEdgeCertUtil()
+        cert_util.create_root_ca_cert('root', subject_dict=VALID_SUBJECT_DICT, passphrase='1234')
+        cert_util.export_simulator_cert_artifacts_to_dir('root', self.certs_dir)
+        key_path = os.path.join(self.certs_dir, 'root', 'private', 'root.key.pem')
+        with open(key_path, 'rb') as key_file:
+            self.assertIn(b'ENCRYPTED', key_file.read())
+
+        loaded_util = CryptographyEdgeCertUtil()
+        loaded_util.load_cert_from_file('root', cert_util.get_cert_file_path('root', self.certs_dir), key_path, '1234')
+        loaded_util.create_intermediate_ca_cert('int', 'root', common_name='name')
+        loaded_util.export_simulator_cert_artifacts_to_dir('int', self.certs_dir)
+        self.assertEqual(self._load_cert(cert_util, 'root').subject, self._load_cert(loaded_util, 'int').issuer)
+
+        with self.assertRaises(EdgeInvalidArgument):
+            CryptographyEdgeCertUtil().load_cert_from_file('root', cert_util.get_cert_file_path('root', self.certs_dir),
+                                                           key_path, 'wrong')
+
+
+class TestEdgeCertEngine(unittest.TestCase):
+    def setUp(self):
+        self.certs_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.certs_dir)
+
+    def test_generate_self_signed_certs_with_cryptography_engine(self):
+        edge_cert = EdgeCert(self.certs_dir, 'testhostname', engine=EdgeCert.ENGINE_CRYPTOGRAPHY)
+        edge_cert.generate_self_signed_certs()
+        with open(os.path.join(self.certs_dir, 'edge-hub-server', 'cert', 'edge-hub-server.cert.pfx'), 'rb') as pfx_file:
+            private_key, _, _ = pkcs12.load_key_and_certificates(pfx_file.read(), None)
+        self.assertIsInstance(private_key, rsa.RSAPrivateKey)
+
+    def test_engine_invalid(self):
+        with self.assertRaises(EdgeValueError):
+            EdgeCert(self.certs_dir, 'testhostname', engine='openssl')
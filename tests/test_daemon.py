@@ -0,0 +1,121 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+from iotedgehubdev import daemon, filelock
+from iotedgehubdev.daemon import DaemonClient, EdgeDaemon
+from iotedgehubdev.edgemanager import EdgeManager
+from iotedgehubdev.errors import EdgeError, InvalidConfigError
+
+
+@unittest.skipUnless(daemon.is_supported(), 'Unix domain sockets are not supported')
+class TestEdgeDaemon(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.temp_dir, 'daemon.sock')
+        self.config_file = os.path.join(self.temp_dir, 'edgehub.json')
+        with open(self.config_file, 'w') as f:
+            f.write('{}')
+        self.edge_manager = mock.Mock()
+        self.parse_config = mock.Mock(return_value=self.edge_manager)
+
+        patchers = [
+            mock.patch('iotedgehubdev.daemon._WarmDockerClient'),
+            mock.patch('iotedgehubdev.daemon.HostPlatform.get_config_file_path', return_value=self.config_file),
+            mock.patch('iotedgehubdev.instance.HostPlatform.get_config_file_path', return_value=self.config_file)
+        ]
+        self.mock_docker = patchers[0].start()
+        for patcher in patchers[1:]:
+            patcher.start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+        self.edge_daemon = EdgeDaemon(self.parse_config, self.socket_path)
+        self.thread = threading.Thread(target=self.edge_daemon.serve)
+        self.thread.start()
+        self.client = DaemonClient(self.socket_path)
+        for _ in range(100):
+            if self.client.is_running():
+                break
+            threading.Event().wait(0.02)
+
+    def tearDown(self):
+        self.edge_daemon.shutdown()
+        self.thread.join()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_serve_and_shutdown(self):
+        self.assertIsInstance(EdgeManager._http, requests.Session)
+        self.assertEqual(0, os.stat(self.socket_path).st_mode & 0o077)
+        self.assertIsNotNone(daemon.connect(self.socket_path))
+        self.client.call('shutdown')
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertIsNone(daemon.connect(self.socket_path))
+        self.assertIs(requests, EdgeManager._http)
+
+    def test_already_running(self):
+        with self.assertRaises(EdgeError):
+            EdgeDaemon(self.parse_config, self.socket_path).serve()
+
+    def test_modulecred_reuses_manager(self):
+        self.edge_manager.outputModuleCred.return_value = ['EdgeHubConnectionString=x', 'EdgeModuleCACertificateFile=y']
+        for _ in range(2):
+            credential = self.client.call('modulecred', instance=None, modules=['target'], local=False, output_file=None)
+            self.assertEqual(['EdgeHubConnectionString=x', 'EdgeModuleCACertificateFile=y'], credential)
+        self.parse_config.assert_called_once()
+        self.edge_manager.cache_credentials.assert_called_once_with(daemon.CREDENTIAL_TTL)
+
+        os.utime(self.config_file, (0, 0))
+        self.client.call('modulecred', instance=None, modules=['target'], local=False, output_file=None)
+        self.assertEqual(2, self.parse_config.call_count)
+
+    @mock.patch('iotedgehubdev.daemon.Output')
+    def test_start_solution_replays_output(self, mock_output):
+        self.edge_manager.start_solution.side_effect = \
+            lambda module_content, verbose, output, edgedockerclient, metrics_port, pull, network_options: \
+            output.warning('login failed')
+        self.client.call('start_solution', instance='sim1', module_content={'$edgeAgent': {}})
+        args = self.edge_manager.start_solution.call_args[0]
+        self.assertEqual(({'$edgeAgent': {}}, False), args[:2])
+        self.assertIs(self.mock_docker.return_value, args[3])
+        mock_output.return_value.warning.assert_called_once_with('login failed')
+
+    def test_connect_checks_docker_host(self):
+        with mock.patch.dict(os.environ, {'DOCKER_HOST': 'tcp://docker1:2375'}):
+            self.assertIsNotNone(daemon.connect(self.socket_path, docker_host='tcp://docker1:2375'))
+            self.assertIsNone(daemon.connect(self.socket_path, docker_host=None))
+            self.assertIsNotNone(daemon.connect(self.socket_path))
+
+    def test_call_settings(self):
+        settings = []
+
+        def start_solution(module_content, verbose, output, *args):
+            settings.append((filelock.get_default_timeout(), filelock._call.output is output))
+        self.edge_manager.start_solution.side_effect = start_solution
+        # The thread serving the call only sees the timeout of this one if the client sends it
+        with filelock.call_settings(42):
+            self.client.call('start_solution', instance='sim1', module_content={'$edgeAgent': {}})
+        self.assertEqual([(42, True)], settings)
+
+    @mock.patch('iotedgehubdev.daemon.EdgeManager.stop')
+    def test_stop(self, mock_stop):
+        self.client.call('stop', instance='sim1')
+        edgedockerclient, instance = mock_stop.call_args[0]
+        self.assertIs(self.mock_docker.return_value, edgedockerclient)
+        self.assertEqual('sim1', instance.name)
+
+    def test_errors(self):
+        self.parse_config.side_effect = InvalidConfigError('Cannot find config file.')
+        with self.assertRaises(InvalidConfigError):
+            self.client.call('modulecred', instance=None, modules=['target'], local=False, output_file=None)
+        with self.assertRaises(EdgeError):
+            self.client.call('rm -rf')
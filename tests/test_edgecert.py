@@ -3,7 +3,9 @@
 
 import os
 import shutil
+import tempfile
 import unittest
+from OpenSSL import crypto
 from iotedgehubdev.edgecert import EdgeCert
 
 WORKINGDIRECTORY = os.getcwd()
@@ -30,3 +32,33 @@ class TestEdgeCertAPICreateSelfSignedCerts(unittest.TestCase):
         assert edge_cert.get_cert_file_path('edge-device-ca')
         assert edge_cert.get_cert_file_path('edge-hub-server')
         assert edge_cert.get_pfx_file_path('edge-hub-server')
+
+    def test_get_self_signed_ecdsa_certs(self):
+        edge_cert = EdgeCert(WORKINGDIRECTORY, 'testhostname', 'ecdsa-p256')
+        edge_cert.generate_self_signed_certs()
+        assert os.path.exists(edge_cert.get_cert_file_path('edge-chain-ca'))
+        assert os.path.exists(edge_cert.get_pfx_file_path('edge-hub-server'))
+
+
+class TestEdgeCertAPIGenerateDeviceCABatch(unittest.TestCase):
+
+    def setUp(self):
+        self.certs_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.certs_dir, ignore_errors=True)
+
+    def test_generate_device_ca_batch(self):
+        edge_cert = EdgeCert(self.certs_dir, '', 'ecdsa-p256')
+        edge_cert.generate_device_ca_batch(['device1', 'device2'], 30, None, None, None)
+        assert os.path.exists(os.path.join(self.certs_dir, 'azure-iot-test-only.root.ca.cert.pem'))
+        assert os.path.exists(os.path.join(self.certs_dir, 'azure-iot-test-only.root.ca.key.pem'))
+        serials = set()
+        for device_id in ['device1', 'device2']:
+            device_dir = edge_cert.get_device_certs_dir(device_id)
+            assert os.path.exists(os.path.join(device_dir, 'iot-edge-device-ca.key.pem'))
+            with open(os.path.join(device_dir, 'iot-edge-device-ca.cert.pem')) as f:
+                serials.add(crypto.load_certificate(crypto.FILETYPE_PEM, f.read()).get_serial_number())
+            with open(os.path.join(device_dir, 'iot-edge-device-ca-chain.cert.pem')) as f:
+                self.assertEqual(2, f.read().count('BEGIN CERTIFICATE'))
+        self.assertEqual(2, len(serials))
@@ -2,9 +2,16 @@
 # Licensed under the MIT License.
 
 
+import json
+import os
+import shutil
+import tarfile
+import tempfile
 import unittest
+from io import BytesIO
 from unittest import mock
 import docker
+from iotedgehubdev import metrics
 from iotedgehubdev.errors import EdgeError, EdgeDeploymentError
 from iotedgehubdev.edgedockerclient import EdgeDockerClient
 
@@ -31,6 +38,27 @@ class TestEdgeDockerClientGetOSType(unittest.TestCase):
             client.get_os_type()
 
 
+class TestEdgeDockerClientMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.get_registry().reset()
+
+    def tearDown(self):
+        metrics.get_registry().reset()
+
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_docker_calls_are_counted(self, mock_docker_client):
+        mock_docker_client.info.side_effect = [{'OSType': 'linux'}, {'OSType': 'linux'}, docker.errors.APIError('info fails')]
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+        client.get_os_type()
+        client.get_os_type()
+        with self.assertRaises(EdgeError):
+            client.get_os_type()
+
+        snapshot = metrics.get_registry().snapshot()
+        self.assertEqual(3, snapshot['latencies']['docker info']['count'])
+        self.assertEqual(1, snapshot['counters']['docker info errors'])
+
+
 class TestEdgeDockerClientGetLocalImageSHAId(unittest.TestCase):
     @mock.patch('docker.APIClient', autospec=True)
     @mock.patch('docker.DockerClient', autospec=True)
@@ -402,6 +430,187 @@ class TestEdgeDockerContainerOps(unittest.TestCase):
         with self.assertRaises(EdgeDeploymentError):
             client.stop_remove_by_label(self.TEST_LABEL)
 
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_list_containers_by_label(self, mock_docker_client):
+        # arrange
+        mock_container1 = mock.MagicMock()
+        mock_container1.name = 'input'
+        mock_container2 = mock.MagicMock()
+        mock_container2.name = 'edgeHubDev'
+        mock_docker_client.containers.list.return_value = [mock_container1, mock_container2]
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+
+        # act
+        result = client.list_containers_by_label(self.TEST_LABEL, all=True)
+
+        # assert
+        mock_docker_client.containers.list.assert_called_with(all=True, filters={'label': self.TEST_LABEL})
+        self.assertEqual(['edgeHubDev', 'input'], result)
+
+    @mock.patch('docker.APIClient', autospec=True)
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_stream_container_logs(self, mock_docker_client, mock_docker_api_client):
+        # arrange
+        type(mock_docker_client).api = mock.PropertyMock(return_value=mock_docker_api_client)
+        mock_docker_api_client.logs.return_value = iter([b'line'])
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+
+        # act
+        result = client.stream_container_logs(self.TEST_CONTAINER_NAME, follow=False, since=10, tail=5)
+
+        # assert
+        mock_docker_api_client.logs.assert_called_with(self.TEST_CONTAINER_NAME, stream=True, follow=False,
+                                                       timestamps=True, since=10, tail=5)
+        self.assertEqual([b'line'], list(result))
+
+    @mock.patch('docker.APIClient', autospec=True)
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_stream_container_stats(self, mock_docker_client, mock_docker_api_client):
+        # arrange
+        type(mock_docker_client).api = mock.PropertyMock(return_value=mock_docker_api_client)
+        mock_docker_api_client.stats.return_value = iter([{'read': 'now'}])
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+
+        # act
+        result = client.stream_container_stats(self.TEST_CONTAINER_NAME)
+
+        # assert
+        mock_docker_api_client.stats.assert_called_with(self.TEST_CONTAINER_NAME, stream=True, decode=True)
+        self.assertEqual([{'read': 'now'}], list(result))
+
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_login(self, mock_docker_client):
+        # arrange
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+
+        # act
+        result = client.login('user', 'pwd', 'myacr.azurecr.io')
+
+        # assert
+        mock_docker_client.login.assert_called_with(username='user', password='pwd', registry='myacr.azurecr.io')
+        self.assertEqual({'username': 'user', 'password': 'pwd'}, result)
+
+        mock_docker_client.login.side_effect = docker.errors.APIError('unauthorized')
+        with self.assertRaises(EdgeDeploymentError):
+            client.login('user', 'wrong', 'myacr.azurecr.io')
+
+    @mock.patch('docker.APIClient', autospec=True)
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_save_images(self, mock_docker_client, mock_docker_api_client):
+        # arrange
+        type(mock_docker_client).api = mock.PropertyMock(return_value=mock_docker_api_client)
+        mock_docker_api_client._url.return_value = 'http+docker://localhost/v1.41/images/get'
+        mock_docker_api_client._stream_raw_result.return_value = iter([b'tar'])
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+
+        # act
+        result = client.save_images(['hub:1.2', 'module:1'])
+
+        # assert
+        mock_docker_api_client._url.assert_called_with('/images/get')
+        mock_docker_api_client._get.assert_called_with('http+docker://localhost/v1.41/images/get',
+                                                       params={'names': ['hub:1.2', 'module:1']}, stream=True)
+        mock_docker_api_client._stream_raw_result.assert_called_with(mock_docker_api_client._get.return_value,
+                                                                     docker.constants.DEFAULT_DATA_CHUNK_SIZE, False)
+        self.assertEqual([b'tar'], list(result))
+
+    @mock.patch('docker.APIClient', autospec=True)
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_load_images(self, mock_docker_client, mock_docker_api_client):
+        # arrange
+        type(mock_docker_client).api = mock.PropertyMock(return_value=mock_docker_api_client)
+        mock_docker_api_client.load_image.return_value = iter([
+            {'stream': 'Loaded image: hub:1.2\n'}, {'status': 'Loading layer'}, {'stream': 'Loaded image ID: sha256:ab\n'}
+        ])
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+        data = BytesIO(b'tar')
+
+        # act
+        result = client.load_images(data)
+
+        # assert
+        mock_docker_api_client.load_image.assert_called_with(data)
+        self.assertEqual(['hub:1.2', 'sha256:ab'], result)
+
+        mock_docker_api_client.load_image.return_value = iter([{'error': 'unexpected EOF'}])
+        with self.assertRaises(EdgeDeploymentError):
+            client.load_images(data)
+
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_seed_volume(self, mock_docker_client):
+        # arrange
+        mock_docker_client.info.return_value = {'OSType': 'linux'}
+        container = mock.MagicMock()
+        mock_docker_client.containers.get.return_value = container
+        container.get_archive.side_effect = docker.errors.NotFound('no manifest')
+        archives = []
+        container.put_archive.side_effect = lambda path, data: archives.append(data.getvalue())
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        files = []
+        for name, content in [('chain.pem', b'chain'), ('server.pfx', b'server')]:
+            with open(os.path.join(temp_dir, name), 'wb') as f:
+                f.write(content)
+            files.append((name, os.path.join(temp_dir, name)))
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+
+        # act
+        report = client.seed_volume('helper', 'edgehubdev', '/mnt/edgehub', files)
+
+        # assert
+        self.assertEqual({'copied': ['chain.pem', 'server.pfx'], 'skipped': [], 'copiedBytes': 11, 'skippedBytes': 0},
+                         report)
+        container.get_archive.assert_called_once_with('/mnt/edgehub/' + EdgeDockerClient.SEED_MANIFEST)
+        with tarfile.open(fileobj=BytesIO(archives[0])) as tar_file:
+            self.assertEqual(['chain.pem', 'server.pfx', EdgeDockerClient.SEED_MANIFEST], tar_file.getnames())
+            manifest_tar = BytesIO()
+            with tarfile.TarFile(fileobj=manifest_tar, mode='w') as manifest_file:
+                member = tar_file.getmember(EdgeDockerClient.SEED_MANIFEST)
+                manifest_file.addfile(member, tar_file.extractfile(member))
+
+        # arrange
+        container.get_archive.side_effect = None
+        container.get_archive.return_value = (iter([manifest_tar.getvalue()]), {})
+        with open(files[1][1], 'wb') as f:
+            f.write(b'renewed')
+
+        # act
+        report = client.seed_volume('helper', 'edgehubdev', '/mnt/edgehub', files)
+
+        # assert
+        self.assertEqual({'copied': ['server.pfx'], 'skipped': ['chain.pem'], 'copiedBytes': 7, 'skippedBytes': 5},
+                         report)
+        with tarfile.open(fileobj=BytesIO(archives[1])) as tar_file:
+            self.assertEqual(['server.pfx', EdgeDockerClient.SEED_MANIFEST], tar_file.getnames())
+
+    @mock.patch('docker.DockerClient', autospec=True)
+    def test_create_network(self, mock_docker_client):
+        # arrange
+        mock_docker_client.info.return_value = {'OSType': 'linux'}
+        same = mock.MagicMock()
+        same.name = 'azure-iot-edge-dev'
+        same.attrs = {'Labels': {'iotedgehubdev.network-settings':
+                                 '{"internal": false, "ipv6": false, "options": {"com.docker.network.driver.mtu": "1400"}}'}}
+        mock_docker_client.networks.list.return_value = [same]
+        client = EdgeDockerClient.create_instance(mock_docker_client)
+
+        # act
+        client.create_network('azure-iot-edge-dev', mtu=1400)
+
+        # assert
+        mock_docker_client.networks.create.assert_not_called()
+
+        # act
+        client.create_network('azure-iot-edge-dev', driver_opts={'com.docker.network.bridge.enable_icc': 'true'})
+
+        # assert
+        same.remove.assert_called_once_with()
+        options = {'com.docker.network.bridge.enable_icc': 'true'}
+        mock_docker_client.networks.create.assert_called_once_with(
+            'azure-iot-edge-dev', driver='bridge', options=options, enable_ipv6=False, internal=False,
+            labels={'iotedgehubdev.network-settings': json.dumps(
+                {'options': options, 'ipv6': False, 'internal': False}, sort_keys=True)})
+
     @mock.patch('docker.APIClient', autospec=True)
     @mock.patch('docker.DockerClient', autospec=True)
     def test_create_valid(self, mock_docker_client, mock_docker_api_client):
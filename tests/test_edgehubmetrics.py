@@ -0,0 +1,107 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from iotedgehubdev.edgehubmetrics import EdgeHubMetrics
+
+METRICS = '''# HELP edgehub_messages_received_total Number of messages received from client
+# TYPE edgehub_messages_received_total counter
+edgehub_messages_received_total{{iothub="hub",edge_device="dev",id="input",route_output="output1"}} {received} 1622541600000
+edgehub_messages_sent_total{{iothub="hub",edge_device="dev",from="input",to="target"}} {sent}
+# TYPE edgehub_queue_length gauge
+edgehub_queue_length{{endpoint="target/input1",priority="0"}} {queue}
+edgehub_queue_length{{endpoint="target/input1",priority="1"}} 1
+edgehub_messages_dropped_total{{reason="ttl_expiry",from="input"}} {dropped}
+edgehub_message_send_duration_seconds{{from="input",to="target",quantile="0.5"}} 0.002
+edgehub_message_send_duration_seconds{{from="input",to="target",quantile="0.99"}} {p99}
+edgehub_message_send_duration_seconds{{from="input",to="other",quantile="0.99"}} NaN
+'''
+
+
+def _metrics(received, sent, queue=0, dropped=0, p99=0.01):
+    return EdgeHubMetrics.parse(METRICS.format(received=received, sent=sent, queue=queue, dropped=dropped, p99=p99))
+
+
+class TestEdgeHubMetrics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_parse(self):
+        samples = EdgeHubMetrics.parse('\n'.join([
+            '# HELP up whether it is up',
+            'up 1',
+            'escaped{path="C:\\\\edge",msg="say \\"hi\\"",empty=""} 2.5e3',
+            'edgehub_uptime_seconds{id="$edgeHub"} +Inf 1622541600000',
+            'not a sample'
+        ]))
+        self.assertEqual(1.0, samples[('up', ())])
+        self.assertEqual(2500.0, samples[('escaped', (('empty', ''), ('msg', 'say "hi"'), ('path', 'C:\\edge')))])
+        self.assertEqual(float('inf'), samples[('edgehub_uptime_seconds', (('id', '$edgeHub'),))])
+        self.assertEqual(3, len(samples))
+
+    def test_summary(self):
+        collector = EdgeHubMetrics('http://localhost:9600/metrics')
+        self.assertIsNone(collector.get_summary())
+        collector.add_scrape(_metrics(100, 90, queue=4), now=1000)
+        collector.add_scrape(_metrics(300, 250, queue=10, dropped=2), now=1010)
+        collector.add_scrape(_metrics(500, 480, queue=2, dropped=5, p99=0.02), now=1020)
+        summary = collector.get_summary()
+        self.assertEqual((3, 20), (summary['scrapes'], summary['elapsed']))
+        self.assertEqual({'total': 500, 'increase': 400, 'rate': 20.0}, summary['throughput']['received'])
+        self.assertEqual(19.5, summary['throughput']['sent']['rate'])
+        self.assertEqual({'target/input1': {'current': 3, 'peak': 11}}, summary['queues'])
+        self.assertEqual({'total': 5, 'increase': 5}, summary['drops']['edgehub_messages_dropped_total'])
+        self.assertEqual({'0.5': 0.002, '0.99': 0.02}, summary['sendLatency'])
+
+    def test_counter_reset_and_retention(self):
+        collector = EdgeHubMetrics('http://localhost:9600/metrics', retention=2)
+        collector.add_scrape(_metrics(1000, 1000), now=1000)
+        collector.add_scrape(_metrics(1200, 1100), now=1010)
+        # edgeHub restarted
+        collector.add_scrape(_metrics(50, 40), now=1020)
+        summary = collector.get_summary()
+        self.assertEqual(2, summary['scrapes'])
+        self.assertEqual(50, summary['throughput']['received']['increase'])
+
+    def test_scrape(self):
+        collector = EdgeHubMetrics('http://localhost:9700/metrics', timeout=2)
+        with mock.patch.object(collector, '_session') as mock_session:
+            mock_session.get.return_value.text = METRICS.format(received=1, sent=1, queue=0, dropped=0, p99=0.01)
+            collector.scrape(now=1000)
+        mock_session.get.assert_called_once_with('http://localhost:9700/metrics', timeout=2)
+        self.assertEqual(1, collector.scrapes)
+
+    def test_snapshot_and_comparison(self):
+        collector = EdgeHubMetrics('http://localhost:9600/metrics')
+        collector.add_scrape(_metrics(0, 0), now=1000)
+        collector.add_scrape(_metrics(100, 100, queue=3, p99=0.01), now=1010)
+        snapshot_file = os.path.join(self.temp_dir, 'baseline.json')
+        collector.export_snapshot(snapshot_file)
+        baseline = EdgeHubMetrics.load_snapshot(snapshot_file)
+        self.assertEqual(1010, baseline['time'])
+        self.assertIn({'name': 'edgehub_queue_length', 'labels': {'endpoint': 'target/input1', 'priority': '0'},
+                       'value': 3.0}, baseline['metrics'])
+
+        collector.add_scrape(_metrics(400, 400, queue=1, p99=0.005), now=1020)
+        lines = EdgeHubMetrics.format_comparison(baseline['summary'], collector.get_summary())
+        self.assertTrue(lines[0].startswith('METRIC'))
+        self.assertEqual(['received', 'msg/s', '10.0', '20.0', '+100.0%'], lines[1].split())
+        self.assertEqual(['send', 'latency', 'q0.99', '(ms)', '10.0', '5.0', '-50.0%'], lines[-1].split())
+
+    def test_format_summary(self):
+        collector = EdgeHubMetrics('http://localhost:9600/metrics')
+        collector.add_scrape(_metrics(0, 0), now=1000)
+        collector.add_scrape(_metrics(100, 50, dropped=1), now=1010)
+        lines = EdgeHubMetrics.format_summary(collector.get_summary())
+        self.assertEqual('Messages received: 100 total, 100 in the last 10s (10.0 msg/s)', lines[0])
+        self.assertIn('Queue target/input1: 1 now, 1 peak', lines)
+        self.assertIn('edgehub_messages_dropped_total: 1 total, 1 in the last 10s', lines)
+        self.assertEqual('Send latency (ms): q0.5 2.0, q0.99 10.0', lines[-1])
@@ -1,6 +1,7 @@
 import os
 import platform
 import unittest
+from unittest import mock
 from iotedgehubdev.edgemanager import EdgeManager
 from iotedgehubdev.errors import RegistriesLoginError
 
@@ -81,3 +82,274 @@ class TestEdgeManager(unittest.TestCase):
             edge_manager.update_module_twin(module_content)
         except Exception:
             self.fail("No exception should be raised to update module twin here")
+
+    def test_credential_cache(self):
+        device_conn_str = 'HostName=testhub.azure-devices.net;DeviceId=device;SharedAccessKey=a2V5'
+        edge_manager = EdgeManager(device_conn_str, 'localhost', '')
+        with mock.patch.object(edge_manager, '_getOrAddModule', side_effect=['conn1', 'conn2', 'conn3']) as mock_get:
+            self.assertEqual('conn1', edge_manager.getOrAddModule('target', False))
+            self.assertEqual('conn2', edge_manager.getOrAddModule('target', False))
+            edge_manager.cache_credentials(60)
+            self.assertEqual('conn3', edge_manager.getOrAddModule('target', False))
+            self.assertEqual('conn3', edge_manager.getOrAddModule('target', False))
+            self.assertEqual(3, mock_get.call_count)
+
+    def test_get_solution_changes(self):
+        old_content = {
+            '$edgeAgent': {'properties.desired': {'runtime': {'settings': {}}}},
+            '$edgeHub': {'properties.desired': {'routes': {}}},
+            'module1': {'properties.desired': {'interval': 1}},
+            'module2': {'properties.desired': {'interval': 1}}
+        }
+        content = {
+            '$edgeAgent': {'properties.desired': {'runtime': {'settings': {}}}},
+            '$edgeHub': {'properties.desired': {'routes': {'r1': 'FROM /messages/* INTO $upstream'}}},
+            'module1': {'properties.desired': {'interval': 2}},
+            'module2': {'properties.desired': {'interval': 1}},
+            'module3': {'properties.desired': {}}
+        }
+        old_services = {
+            'edgeHubDev': {'image': 'hub', 'environment': []},
+            'module1': {'image': 'module1:1'},
+            'module2': {'image': 'module2:1'},
+            'old': {'image': 'old'}
+        }
+        services = {
+            'edgeHubDev': {'image': 'hub', 'environment': ['routes__r1=FROM /messages/* INTO $upstream']},
+            'module1': {'image': 'module1:1'},
+            'module2': {'image': 'module2:2'},
+            'module3': {'image': 'module3:1'}
+        }
+        changes = EdgeManager.get_solution_changes(old_content, content, old_services, services)
+        self.assertEqual(['edgeHubDev', 'module2', 'module3'], changes['recreate'])
+        self.assertEqual(['old'], changes['remove'])
+        self.assertEqual(['module1', 'module3'], changes['twins'])
+        self.assertFalse(changes['registries'])
+
+        self.assertEqual({'recreate': [], 'remove': [], 'twins': [], 'registries': False},
+                         EdgeManager.get_solution_changes(content, content, services, services))
+
+    def test_solution_module_status_and_pull_policy(self):
+        device_conn_str = 'HostName=testhub.azure-devices.net;DeviceId=device;SharedAccessKey=a2V5'
+        edge_manager = EdgeManager(device_conn_str, 'localhost', '')
+        edge_manager._instance = mock.MagicMock()
+        edge_manager._instance.get_compose_cmd.side_effect = lambda *args: list(args)
+        edge_manager._services = ['edgeHubDev', 'sensor', 'disabled', 'local']
+        edge_manager._stopped_services = ['disabled']
+        module_content = {'$edgeAgent': {'properties.desired': {'modules': {
+            'sensor': {'settings': {'image': 'sensor:1'}},
+            'disabled': {'status': 'stopped', 'settings': {'image': 'disabled:1'}},
+            'local': {'imagePullPolicy': 'never', 'settings': {'image': 'local:1'}}
+        }}}}
+        edgedockerclient = mock.MagicMock()
+        edgedockerclient.get_local_image_sha_id.return_value = None
+        output = mock.MagicMock()
+
+        unavailable = edge_manager._pull_module_images(edgedockerclient, module_content, output=output)
+        self.assertEqual(['local'], unavailable)
+        self.assertEqual([mock.call('disabled:1', None, None), mock.call('sensor:1', None, None)],
+                         edgedockerclient.pullIfNotExist.call_args_list)
+        output.warning.assert_called_once()
+
+        with mock.patch('iotedgehubdev.edgemanager.Utils.exe_proc') as mock_exe_proc:
+            self.assertEqual(['edgeHubDev', 'sensor'], edge_manager._compose_up(unavailable=unavailable))
+            edge_manager._compose_up(['disabled', 'sensor'])
+        self.assertEqual([
+            mock.call(['up', '-d', 'edgeHubDev', 'sensor']),
+            mock.call(['up', '--no-start', '--no-deps', '--force-recreate', 'disabled']),
+            mock.call(['up', '-d', '--no-deps', 'sensor']),
+            mock.call(['up', '--no-start', '--no-deps', '--force-recreate', 'disabled'])
+        ], mock_exe_proc.call_args_list)
+
+        old_content = {'$edgeAgent': {'properties.desired': {'modules': {'disabled': {}}}}}
+        services = {'disabled': {'image': 'disabled:1'}}
+        changes = EdgeManager.get_solution_changes(old_content, module_content, services, services)
+        self.assertEqual(['disabled'], changes['recreate'])
+
+    @mock.patch('iotedgehubdev.edgemanager.time.sleep')
+    @mock.patch('iotedgehubdev.edgemanager.Utils.exe_proc')
+    def test_staged_startup(self, mock_exe_proc, mock_sleep):
+        device_conn_str = 'HostName=testhub.azure-devices.net;DeviceId=device;SharedAccessKey=a2V5'
+        edge_manager = EdgeManager(device_conn_str, 'localhost', '')
+        edge_manager._instance = mock.MagicMock()
+        edge_manager._instance.get_compose_cmd.side_effect = lambda *args: list(args)
+        edge_manager._instance.get_resource_name.side_effect = lambda name: 'sim_' + name
+        edge_manager._services = ['edgeHubDev', 'db', 'api', 'ui', 'worker']
+        edge_manager._startup_orders = {'edgeHubDev': 0, 'db': 0, 'api': 1, 'ui': 2, 'worker': 1}
+        edgedockerclient = mock.MagicMock()
+        states = {
+            'sim_edgeHubDev': [{'Status': 'created'}, {'Status': 'running'}],
+            'sim_db': [{'Status': 'running', 'Health': {'Status': 'starting'}},
+                       {'Status': 'running', 'Health': {'Status': 'healthy'}}],
+            'sim_api': [{'Status': 'exited'}],
+            'sim_worker': [{'Status': 'running'}]
+        }
+        edgedockerclient.get_container_state.side_effect = lambda name: states[name].pop(0)
+        output = mock.MagicMock()
+
+        self.assertEqual(['edgeHubDev', 'db', 'api', 'ui', 'worker'],
+                         edge_manager._compose_up(edgedockerclient=edgedockerclient, output=output))
+        self.assertEqual([
+            mock.call(['up', '-d', '--no-deps', 'edgeHubDev']),
+            mock.call(['up', '-d', '--no-deps', 'db']),
+            mock.call(['up', '-d', '--no-deps', 'api', 'worker']),
+            mock.call(['up', '-d', '--no-deps', 'ui'])
+        ], mock_exe_proc.call_args_list)
+        self.assertEqual(2, mock_sleep.call_count)
+        output.warning.assert_called_once_with('Module api is exited, starting the next modules anyway.')
+
+        # A single group of modules starts at once, as before
+        mock_exe_proc.reset_mock()
+        edge_manager._startup_orders = {}
+        edge_manager._compose_up(edgedockerclient=edgedockerclient, output=output)
+        mock_exe_proc.assert_called_once_with(['up', '-d'])
+
+    def test_get_images(self):
+        self.assertEqual(['hello-world:latest', 'mcr.microsoft.com/azureiotedge-hub:1.1',
+                          'mcr.microsoft.com/azureiotedge-testing-utility:1.0.0'], EdgeManager.get_images('1.1'))
+        module_content = {'$edgeAgent': {'properties.desired': {
+            'systemModules': {'edgeHub': {'settings': {'image': 'mcr.microsoft.com/azureiotedge-hub:1.2'}}},
+            'modules': {
+                'module1': {'settings': {'image': 'localhost:5000/module:0.0.1'}},
+                'module2': {'settings': {'image': 'localhost:5000/module:0.0.1'}}
+            }
+        }}}
+        self.assertEqual(['hello-world:latest', 'localhost:5000/module:0.0.1', 'mcr.microsoft.com/azureiotedge-hub:1.2',
+                          'mcr.microsoft.com/azureiotedge-testing-utility:1.0.0'],
+                         EdgeManager.get_images('1.2', module_content))
+
+    def test_login_registries(self):
+        module_content = {'$edgeAgent': {'properties.desired': {'runtime': {'settings': {'registryCredentials': {
+            'acr': {'address': 'https://myacr.azurecr.io', 'username': 'acr', 'password': 'acrpwd'},
+            'hub': {'address': 'index.docker.io', 'username': 'hub', 'password': 'hubpwd'},
+            'nopwd': {'address': 'other.io', 'username': 'other'},
+            'denied': {'address': 'denied.io', 'username': 'denied', 'password': 'wrong'}
+        }}}}}}
+        edgedockerclient = mock.MagicMock()
+
+        def login(username, password, registry):
+            if registry == 'denied.io':
+                raise Exception('unauthorized')
+            return {'username': username, 'password': password}
+        edgedockerclient.login.side_effect = login
+
+        with self.assertRaises(RegistriesLoginError) as context:
+            EdgeManager.login_registries(module_content, edgedockerclient)
+        self.assertEqual(['nopwd', 'denied'], context.exception.registries())
+        self.assertEqual(3, edgedockerclient.login.call_count)
+
+        del module_content['$edgeAgent']['properties.desired']['runtime']['settings']['registryCredentials']['nopwd']
+        del module_content['$edgeAgent']['properties.desired']['runtime']['settings']['registryCredentials']['denied']
+        auths = EdgeManager.login_registries(module_content, edgedockerclient)
+        self.assertEqual({'myacr.azurecr.io': {'username': 'acr', 'password': 'acrpwd'},
+                          'docker.io': {'username': 'hub', 'password': 'hubpwd'}}, auths)
+        self.assertEqual(('acr', 'acrpwd'), EdgeManager.get_registry_auth(auths, 'myacr.azurecr.io/module:0.0.1'))
+        self.assertEqual(('hub', 'hubpwd'), EdgeManager.get_registry_auth(auths, 'team/module'))
+        self.assertEqual((None, None), EdgeManager.get_registry_auth(auths, 'localhost:5000/module'))
+
+    @mock.patch('iotedgehubdev.edgemanager.filelock.lock_for')
+    def test_start_singlemodule(self, mock_lock_for):
+        device_conn_str = 'HostName=testhub.azure-devices.net;DeviceId=device;SharedAccessKey=a2V5'
+        edge_manager = EdgeManager(device_conn_str, 'localhost', '')
+        edgedockerclient = mock.MagicMock()
+        edgedockerclient.get_os_type.return_value = 'linux'
+        instance = mock.MagicMock()
+        instance.get_resource_name.side_effect = lambda name: name
+        instance.get_compose_file_path.return_value = os.path.join('tests', 'no-such-compose.yml')
+        edge_manager._instance = instance
+        events = []
+        edgedockerclient.stop_remove_by_label.side_effect = lambda label: events.append('stop')
+        edgedockerclient.create_network.side_effect = lambda name, **options: events.append('prepare')
+        edgedockerclient.start.side_effect = lambda container_id: events.append('start ' + container_id)
+        with mock.patch.object(edge_manager, 'getOrAddModule', side_effect=lambda name, islocal: name), \
+                mock.patch.object(edge_manager, '_create_edge_hub', return_value=('hub', {'8883': 8883})) as mock_hub, \
+                mock.patch.object(edge_manager, '_create_input', return_value='input') as mock_input:
+            timeline = edge_manager.start_singlemodule(['input1'], 53000, [], '1.2', edgedockerclient)
+
+        self.assertEqual(['stop', 'prepare', 'start hub', 'start input'], events)
+        self.assertEqual('$edgeHub', mock_hub.call_args[0][1])
+        self.assertEqual('mcr.microsoft.com/azureiotedge-hub:1.2', mock_hub.call_args[0][5])
+        self.assertEqual(('input', 'input', 53000), mock_input.call_args[0][1:4])
+        edgedockerclient.pull.assert_called_once_with('mcr.microsoft.com/azureiotedge-hub:1.2', None, None)
+        instance.save_state.assert_called_once_with({'mode': 'singlemodule', 'ports': {
+            'edgeHubDev': {'8883': 8883}, 'input': {'3000': 53000}}, 'producers': ['input']})
+        self.assertEqual(10, len(timeline))
+
+        # Several producers
+        instance.get_host_port.side_effect = lambda port: port
+        events[:] = []
+        with mock.patch.object(edge_manager, 'getOrAddModule', side_effect=lambda name, islocal: name), \
+                mock.patch.object(edge_manager, '_create_edge_hub', return_value=('hub', {})) as mock_hub, \
+                mock.patch.object(edge_manager, '_create_input', side_effect=lambda *args: args[1]) as mock_input:
+            edge_manager.start_singlemodule(['input1'], 53000, [], '1.2', edgedockerclient, producers=3)
+        self.assertEqual(['start hub', 'start input', 'start input2', 'start input3'], sorted(events[2:]))
+        self.assertEqual([('input', 53000, True), ('input2', 53001, False), ('input3', 53002, False)],
+                         sorted((call[0][1], call[0][3], call[0][5]) for call in mock_input.call_args_list))
+        self.assertIn('routes__r3=FROM /messages/modules/input3/outputs/input1 '
+                      'INTO BrokeredEndpoint("/modules/target/inputs/input1")', mock_hub.call_args[0][2])
+        state = instance.save_state.call_args[0][0]
+        self.assertEqual(['input', 'input2', 'input3'], state['producers'])
+        self.assertEqual({'3000': 53002}, state['ports']['input3'])
+
+    def test_seed_volume(self):
+        edgedockerclient = mock.MagicMock()
+        edgedockerclient.get_os_type.return_value = 'linux'
+        edgedockerclient.get_volume_manifest.return_value = {}
+        edgedockerclient.status.return_value = None
+        archives = []
+        edgedockerclient.put_archive.side_effect = lambda name, path, data: archives.append(b''.join(data))
+        seeder = EdgeManager.seed_volume('models', os.path.join('tests', 'test_compose_resources'), edgedockerclient)
+
+        edgedockerclient.create_volume.assert_called_once_with('models')
+        self.assertEqual('models_seed_helper', edgedockerclient.create_container.call_args[1]['name'])
+        edgedockerclient.put_archive.assert_called_once_with('models_seed_helper', '/seed', mock.ANY)
+        self.assertTrue(archives[0])
+        self.assertIn('deployment.json', [entry[0] for entry in seeder.files])
+        edgedockerclient.remove.assert_called_once_with('models_seed_helper')
+
+        edgedockerclient.get_os_type.return_value = 'windows'
+        with self.assertRaises(ValueError):
+            EdgeManager.seed_volume('models', 'tests', edgedockerclient)
+
+    @mock.patch('iotedgehubdev.edgemanager.filelock.lock_for')
+    def test_start_singlemodule_host_network(self, mock_lock_for):
+        device_conn_str = 'HostName=testhub.azure-devices.net;DeviceId=device;SharedAccessKey=a2V5'
+        edge_manager = EdgeManager(device_conn_str, 'localhost', '')
+        edgedockerclient = mock.MagicMock()
+        edgedockerclient.get_os_type.return_value = 'linux'
+        edgedockerclient.create_container.side_effect = lambda image, **kwargs: {'Id': kwargs['name']}
+        edgedockerclient.seed_volume.return_value = {'copiedBytes': 0, 'skippedBytes': 0}
+        instance = mock.MagicMock()
+        instance.get_resource_name.side_effect = lambda name: name
+        instance.get_compose_file_path.return_value = os.path.join('tests', 'no-such-compose.yml')
+        edge_manager._instance = instance
+        with mock.patch.object(edge_manager, 'getOrAddModule', side_effect=lambda name, islocal: name):
+            edge_manager.start_singlemodule(['input1'], 53000, [], '1.2', edgedockerclient, metrics_port=9700,
+                                            network_options={'mtu': 1400, 'hostNetwork': True})
+
+        edgedockerclient.create_network.assert_called_once_with(
+            'azure-iot-edge-dev', mtu=1400, driver_opts=None, ipv6=False, internal=False)
+        host_configs = [call[1] for call in edgedockerclient.create_host_config.call_args_list]
+        self.assertEqual(['host', 'host'], [host_config['network_mode'] for host_config in host_configs])
+        self.assertEqual([{'localhost': '127.0.0.1'}], [host_config['extra_hosts'] for host_config in host_configs
+                                                        if 'extra_hosts' in host_config])
+        instance.get_host_port.assert_not_called()
+        for call in edgedockerclient.create_container.call_args_list:
+            self.assertIsNone(call[1]['networking_config'])
+        state = instance.save_state.call_args[0][0]
+        self.assertTrue(state['hostNetwork'])
+        self.assertEqual({'8883': 8883, '443': 443, '5671': 5671, '9600': 9600}, state['ports']['edgeHubDev'])
+        self.assertEqual({'3000': 3000}, state['ports']['input'])
+
+        with self.assertRaises(ValueError):
+            edge_manager.start_singlemodule(['input1'], 53000, [], '1.2', edgedockerclient, producers=2,
+                                            network_options={'hostNetwork': True})
+
+        # The options of a start are only set once it holds the runtime lock
+        edge_manager._set_network_options(None)
+        instance.get_runtime_lock.return_value.__enter__.side_effect = \
+            lambda: self.assertFalse(edge_manager._host_network)
+        with mock.patch.object(edge_manager, 'getOrAddModule', side_effect=lambda name, islocal: name):
+            edge_manager.start_singlemodule(['input1'], 53000, [], '1.2', edgedockerclient,
+                                            network_options={'hostNetwork': True})
+        self.assertTrue(edge_manager._host_network)
@@ -0,0 +1,91 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from iotedgehubdev import filelock
+from iotedgehubdev.errors import EdgeLockTimeoutError
+from iotedgehubdev.filelock import FileLock
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.lock_path = os.path.join(self.temp_dir, 'sub', 'config.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _hold_in_thread(self, seconds):
+        acquired = threading.Event()
+
+        def hold():
+            with FileLock(self.lock_path):
+                acquired.set()
+                time.sleep(seconds)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        acquired.wait()
+        return thread
+
+    def test_lock_for(self):
+        self.assertEqual(os.path.join(self.temp_dir, 'certs.lock'),
+                         filelock.lock_for(os.path.join(self.temp_dir, 'certs') + os.sep, 'certificates').path)
+
+    def test_reentrant(self):
+        with FileLock(self.lock_path):
+            with FileLock(self.lock_path, timeout=0):
+                pass
+            with FileLock(self.lock_path, timeout=0):
+                pass
+        self.assertEqual({}, FileLock._get_counts())
+
+    @mock.patch('iotedgehubdev.filelock.Output')
+    def test_waits_for_other_holder(self, mock_output):
+        thread = self._hold_in_thread(0.3)
+        start = time.time()
+        with FileLock(self.lock_path, timeout=5, description='config'):
+            waited = time.time() - start
+        thread.join()
+        self.assertGreaterEqual(waited, 0.2)
+        mock_output.return_value.info.assert_called_once_with(
+            'Waiting for another iotedgehubdev process to release the config lock...')
+
+    @mock.patch('iotedgehubdev.filelock.Output')
+    def test_timeout(self, mock_output):
+        thread = self._hold_in_thread(0.5)
+        try:
+            with self.assertRaises(EdgeLockTimeoutError) as err:
+                FileLock(self.lock_path, timeout=0.1, description='config').acquire()
+            self.assertEqual('config', err.exception.lock_name)
+        finally:
+            thread.join()
+        with FileLock(self.lock_path, timeout=0):
+            pass
+
+    def test_default_timeout(self):
+        filelock.set_default_timeout(7)
+        try:
+            self.assertEqual(7, filelock.get_default_timeout())
+        finally:
+            filelock.set_default_timeout(filelock.DEFAULT_TIMEOUT)
+
+    def test_call_settings(self):
+        thread = self._hold_in_thread(0.5)
+        output = mock.Mock()
+        try:
+            with filelock.call_settings(0.1, output):
+                self.assertEqual(0.1, filelock.get_default_timeout())
+                with self.assertRaises(EdgeLockTimeoutError):
+                    FileLock(self.lock_path, description='config').acquire()
+        finally:
+            thread.join()
+        output.info.assert_called_once_with('Waiting for another iotedgehubdev process to release the config lock...')
+        self.assertEqual(filelock.DEFAULT_TIMEOUT, filelock.get_default_timeout())
@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from iotedgehubdev.filewatcher import FileWatcher
+
+
+class TestFileWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, 'deployment.json')
+        self._write('{}')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write(self, content):
+        with open(self.file_path, 'w') as f:
+            f.write(content)
+
+    def _replace(self, content):
+        # What editors saving through a temporary file do
+        tmp_path = os.path.join(self.temp_dir, '.deployment.json.swp')
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, self.file_path)
+
+    def _edit_later(self, edits, delay=0.1):
+        def edit():
+            for edit in edits:
+                time.sleep(delay)
+                edit()
+        thread = threading.Thread(target=edit)
+        thread.start()
+        return thread
+
+    def _assert_detects_changes(self, watcher):
+        try:
+            self.assertFalse(watcher.wait_for_change(timeout=0.2))
+
+            thread = self._edit_later([lambda: self._write('{"a": 1}'), lambda: self._write('{"a": 12}')])
+            start = time.time()
+            self.assertTrue(watcher.wait_for_change(timeout=5))
+            thread.join()
+            # Both writes are reported as one change once the file is quiet
+            self.assertGreaterEqual(time.time() - start, 0.2)
+            self.assertFalse(watcher.wait_for_change(timeout=0.3))
+
+            thread = self._edit_later([lambda: self._replace('{"a": 123}')])
+            self.assertTrue(watcher.wait_for_change(timeout=5))
+            thread.join()
+        finally:
+            watcher.close()
+
+    @unittest.skipUnless(os.path.exists('/proc/sys/fs/inotify'), 'inotify is not available')
+    def test_inotify(self):
+        watcher = FileWatcher(self.file_path, debounce=0.15)
+        self.assertTrue(watcher.uses_inotify)
+        self._assert_detects_changes(watcher)
+
+    def test_polling(self):
+        with mock.patch('iotedgehubdev.filewatcher._Inotify', side_effect=OSError(28, 'No space left on device')):
+            watcher = FileWatcher(self.file_path, debounce=0.15, poll_interval=0.05)
+        self.assertFalse(watcher.uses_inotify)
+        self._assert_detects_changes(watcher)
+
+    def test_ignores_other_files(self):
+        watcher = FileWatcher(self.file_path, debounce=0.1)
+        try:
+            thread = self._edit_later([lambda: open(os.path.join(self.temp_dir, 'other.json'), 'w').close()])
+            self.assertFalse(watcher.wait_for_change(timeout=0.4))
+            thread.join()
+        finally:
+            watcher.close()
@@ -0,0 +1,62 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from iotedgehubdev.hostplatform import HostPlatform
+from iotedgehubdev.instance import EdgeInstance
+
+
+class TestEdgeInstance(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(HostPlatform, 'get_data_path', return_value=self.data_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_name_validation(self):
+        for name in ['sim1', 'a', 'load_test-2']:
+            self.assertEqual(name, EdgeInstance(name).name)
+        for name in ['', 'Sim1', '-sim', 'sim 1', 'a' * 33, '../sim']:
+            with self.assertRaises(ValueError):
+                EdgeInstance(name)
+
+    def test_default_instance(self):
+        instance = EdgeInstance()
+        self.assertTrue(instance.is_default)
+        self.assertEqual('edgeHubDev', instance.get_resource_name('edgeHubDev'))
+        self.assertEqual(8883, instance.get_host_port(8883))
+        self.assertNotIn('-p', instance.get_compose_cmd('up', '-d'))
+        self.assertEqual(['up', '-d'], instance.get_compose_cmd('up', '-d')[-2:])
+
+    def test_named_instance(self):
+        instance = EdgeInstance('sim1')
+        self.assertFalse(instance.is_default)
+        self.assertEqual('sim1-edgeHubDev', instance.get_resource_name('edgeHubDev'))
+        self.assertEqual(os.path.join(self.data_dir, 'instances', 'sim1'), instance.get_data_path())
+        cmd = instance.get_compose_cmd('down')
+        self.assertEqual(['docker-compose', '-f', instance.get_compose_file_path(),
+                          '-p', 'sim1-iotedgehubdev', 'down'], cmd)
+        with mock.patch.object(EdgeInstance, 'find_free_port', return_value=40001):
+            self.assertEqual(40001, instance.get_host_port(8883))
+
+    def test_state(self):
+        instance = EdgeInstance('sim1')
+        self.assertEqual({}, instance.load_state())
+        state = {'mode': 'singlemodule', 'ports': {'sim1-input': {'3000': 40001}}}
+        instance.save_state(state)
+        self.assertEqual(state, instance.load_state())
+        self.assertEqual({}, EdgeInstance('sim2').load_state())
+        instance.delete_state()
+        self.assertEqual({}, instance.load_state())
+
+    def test_find_free_port(self):
+        port = EdgeInstance.find_free_port()
+        self.assertTrue(0 < port < 65536)
@@ -0,0 +1,63 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from iotedgehubdev.certutils import EdgeCertUtil
+from iotedgehubdev.constants import EdgeConstants as EC
+from iotedgehubdev.keypool import KeyPool
+
+KEY_SPEC = (EdgeCertUtil.TYPE_EC, 256)
+
+
+class TestKeyPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool_dir = os.path.join(tempfile.mkdtemp(), 'keypool')
+        self.pool = KeyPool(self.pool_dir)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.pool_dir), ignore_errors=True)
+
+    def test_get_spec_name(self):
+        self.assertEqual('rsa-4096', KeyPool.get_spec_name((EdgeCertUtil.TYPE_RSA, 4096)))
+        self.assertEqual('ec-384', KeyPool.get_spec_name((EdgeCertUtil.TYPE_EC, 384)))
+
+    def test_take_from_empty_pool(self):
+        self.assertIsNone(self.pool.take(KEY_SPEC))
+        self.assertEqual(1, self.pool.misses)
+
+    def test_fill_and_take_each_key_once(self):
+        self.pool.fill(KEY_SPEC, 2)
+        spec_dir = os.path.join(self.pool_dir, 'ec-256')
+        self.assertEqual(0o700, os.stat(spec_dir).st_mode & 0o777)
+        first = self.pool.take(KEY_SPEC)
+        second = self.pool.take(KEY_SPEC)
+        self.assertIn(b'PRIVATE KEY', first)
+        self.assertNotEqual(first, second)
+        self.assertIsNone(self.pool.take(KEY_SPEC))
+        self.assertEqual([], os.listdir(spec_dir))
+
+        status = self.pool.get_status()['ec-256']
+        self.assertEqual(0, status['available'])
+        self.assertEqual(2, status['generated'])
+        self.assertEqual(2, status['hits'])
+        self.assertEqual(1, status['misses'])
+        self.assertAlmostEqual(2.0 / 3, status['hit_rate'])
+
+    def test_take_skips_key_claimed_by_another_process(self):
+        self.pool.fill(KEY_SPEC, 2)
+        with mock.patch('os.rename', side_effect=[OSError('claimed'), mock.DEFAULT], wraps=os.rename):
+            self.assertIsNotNone(self.pool.take(KEY_SPEC))
+        self.assertEqual(1, len(os.listdir(os.path.join(self.pool_dir, 'ec-256'))))
+
+    def test_cert_util_consumes_pool_keys(self):
+        self.pool.fill(KEY_SPEC, 1)
+        cert_util = EdgeCertUtil(key_pool=self.pool)
+        cert_util.create_root_ca_cert('root', subject_dict=EC.CERT_DEFAULT_DICT, key_algorithm='ecdsa-p256')
+        cert_util.create_intermediate_ca_cert('int', 'root', common_name='name', key_algorithm='ecdsa-p256')
+        self.assertEqual(1, self.pool.hits)
+        self.assertEqual(1, self.pool.misses)
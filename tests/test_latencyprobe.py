@@ -0,0 +1,69 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import json
+import unittest
+from unittest import mock
+
+from iotedgehubdev.latencyprobe import LatencyProbe
+
+# 2021-06-01T10:00:00Z
+BASE_TIME = 1622541600.0
+
+
+def _log_line(received_offset, run_id, input_name, seq, sent_offset):
+    return '2021-06-01T10:00:{0:012.9f}Z Received message: {{"data":"{1}"}}'.format(
+        received_offset, LatencyProbe.format_message(run_id, input_name, seq, BASE_TIME + sent_offset))
+
+
+class TestLatencyProbe(unittest.TestCase):
+    def test_parse_logs(self):
+        logs = '\n'.join([
+            '2021-06-01T10:00:00.000000000Z starting',
+            _log_line(1.25, 'abcd', 'input1', 0, 1.0),
+            _log_line(1.5, 'ffff', 'input1', 0, 1.0),
+            'not a docker log line ' + LatencyProbe.format_message('abcd', 'input1', 1, BASE_TIME)
+        ])
+        received = LatencyProbe.parse_logs(logs, 'abcd')
+        self.assertEqual(1, len(received))
+        input_name, seq, sent_time, received_time = received[0]
+        self.assertEqual(('input1', 0), (input_name, seq))
+        self.assertAlmostEqual(0.25, received_time - sent_time, places=5)
+
+    def test_get_report(self):
+        received = [
+            ('input1', 0, BASE_TIME, BASE_TIME + 0.010),
+            ('input1', 2, BASE_TIME + 0.2, BASE_TIME + 0.220),
+            ('input1', 1, BASE_TIME + 0.1, BASE_TIME + 0.230),
+            ('input1', 1, BASE_TIME + 0.1, BASE_TIME + 0.240),
+            ('input2', 0, BASE_TIME, BASE_TIME + 0.030),
+            ('other', 0, BASE_TIME, BASE_TIME + 0.030)
+        ]
+        report = LatencyProbe.get_report({'input1': 4, 'input2': 1}, received)
+        route = report['routes']['input1']
+        self.assertEqual((4, 3, 1, 1, 1), (route['sent'], route['received'], route['lost'], route['duplicates'],
+                                           route['reordered']))
+        self.assertEqual(0.25, route['lossRate'])
+        self.assertAlmostEqual(0.130, route['latency']['max'], places=5)
+        self.assertEqual(0, report['routes']['input2']['lost'])
+        self.assertEqual(5, report['all']['sent'])
+        self.assertEqual(4, report['all']['received'])
+        self.assertEqual(4, report['all']['latency']['count'])
+
+    @mock.patch('iotedgehubdev.latencyprobe.requests.Session')
+    def test_run(self, mock_session):
+        posted = []
+        mock_session.return_value.post.side_effect = lambda url, data, **kwargs: posted.append(json.loads(data))
+        mock_client = mock.Mock()
+        mock_client.get_container_logs.side_effect = lambda name, since: '\n'.join(
+            '2021-06-01T10:00:00.5Z ' + message['data'] for message in posted)
+
+        with mock.patch('iotedgehubdev.latencyprobe.time.time', return_value=BASE_TIME):
+            probe = LatencyProbe(mock_client, 'input', 'http://localhost:53000/api/v1/messages',
+                                 ['input1', 'input2'], 4, 100, 5)
+            report = probe.run()
+
+        self.assertEqual(['input1', 'input2', 'input1', 'input2'], [message['inputName'] for message in posted])
+        mock_client.get_container_logs.assert_called_once_with('input', since=int(BASE_TIME) - 1)
+        self.assertEqual(0, report['all']['lost'])
+        self.assertAlmostEqual(0.5, report['all']['latency']['p50'], delta=0.02)
@@ -0,0 +1,105 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from iotedgehubdev.loadgen import LoadGenerator
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MessagesHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        with self.server.lock:
+            self.server.messages.append(body)
+        status = 500 if body['inputName'] == 'bad' else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestLoadGenerator(unittest.TestCase):
+    def setUp(self):
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _MessagesHandler)
+        self.server.lock = threading.Lock()
+        self.server.messages = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = LoadGenerator.get_messages_url(self.server.server_address[1], '127.0.0.1')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_parse_payload_size(self):
+        self.assertEqual((64, 64), LoadGenerator.parse_payload_size('64'))
+        self.assertEqual((10, 1000), LoadGenerator.parse_payload_size('10-1000'))
+        for value in ['', 'abc', '10-5', '1-2-3', '-1']:
+            with self.assertRaises(ValueError):
+                LoadGenerator.parse_payload_size(value)
+
+    def test_run_with_count(self):
+        generator = LoadGenerator(self.url, ['input1', 'input2'], 4, count=50, payload_size=(10, 20))
+        report = generator.run()
+        self.assertEqual(50, report['sent'])
+        self.assertEqual(50, report['succeeded'])
+        self.assertEqual({}, report['errors'])
+        self.assertEqual(50, report['latency']['count'])
+        self.assertLessEqual(report['latency']['p50'], report['latency']['p99.9'])
+        self.assertEqual(50, len(self.server.messages))
+        for message in self.server.messages:
+            self.assertIn(message['inputName'], ['input1', 'input2'])
+            self.assertTrue(10 <= len(message['data']) <= 20)
+
+    def test_run_counts_errors(self):
+        report = LoadGenerator(self.url, ['bad'], 2, count=10).run()
+        self.assertEqual(10, report['sent'])
+        self.assertEqual(0, report['succeeded'])
+        self.assertEqual({'HTTP 500': 10}, report['errors'])
+        self.assertEqual(1.0, report['errorRate'])
+
+    def test_run_with_rate_and_duration(self):
+        report = LoadGenerator(self.url, ['input1'], 2, rate=50, duration=0.5).run()
+        self.assertEqual(25, report['sent'])
+        self.assertGreaterEqual(report['elapsed'], 0.48)
+
+    def test_connection_error(self):
+        url = self.url
+        self.tearDown()
+        report = LoadGenerator(url, ['input1'], 1, count=2, timeout=1).run()
+        self.setUp()
+        self.assertEqual({'ConnectionError': 2}, report['errors'])
+
+    def test_run_with_several_producers(self):
+        other_server = _ThreadingHTTPServer(('127.0.0.1', 0), _MessagesHandler)
+        other_server.lock = threading.Lock()
+        other_server.messages = []
+        other_thread = threading.Thread(target=other_server.serve_forever)
+        other_thread.start()
+        try:
+            urls = [self.url, LoadGenerator.get_messages_url(other_server.server_address[1], '127.0.0.1')]
+            report = LoadGenerator(urls, ['input1'], 3, count=20).run()
+        finally:
+            other_server.shutdown()
+            other_server.server_close()
+            other_thread.join()
+        self.assertEqual(20, report['succeeded'])
+        self.assertEqual(urls, report['urls'])
+        self.assertEqual((10, 10), (len(self.server.messages), len(other_server.messages)))
+
+    def test_duration_or_count_required(self):
+        with self.assertRaises(ValueError):
+            LoadGenerator(self.url, ['input1'], 1)
@@ -0,0 +1,97 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import io
+import json
+import unittest
+from unittest import mock
+
+from iotedgehubdev.errors import EdgeValueError
+from iotedgehubdev.logstreamer import LogStreamer
+
+TIMESTAMP = '2021-06-01T10:00:00.000000000Z'
+
+
+class _FakeDockerClient(object):
+    def __init__(self, streams):
+        self._streams = streams
+        self.calls = []
+
+    def stream_container_logs(self, container_name, follow=True, since=None, tail='all'):
+        self.calls.append((container_name, follow, since, tail))
+        stream = self._streams[container_name]
+        if isinstance(stream, Exception):
+            raise stream
+        return iter(stream)
+
+
+def _lines(*messages):
+    return [('{0} {1}\n'.format(TIMESTAMP, message)).encode('utf-8') for message in messages]
+
+
+class TestLogStreamer(unittest.TestCase):
+    def test_parse_since(self):
+        self.assertIsNone(LogStreamer.parse_since(None))
+        self.assertEqual(1000 - 600, LogStreamer.parse_since('10m', now=1000))
+        self.assertEqual(1000 - 5400, LogStreamer.parse_since('1.5h', now=1000))
+        self.assertEqual(1622541600, LogStreamer.parse_since('1622541600'))
+        self.assertEqual(1622541600, LogStreamer.parse_since('2021-06-01T10:00:00Z'))
+        self.assertEqual(1622541600, LogStreamer.parse_since('2021-06-01T10:00:00.5'))
+        with self.assertRaises(EdgeValueError):
+            LogStreamer.parse_since('yesterday')
+
+    def test_run_prefixes_lines(self):
+        client = _FakeDockerClient({
+            'edgeHubDev': _lines('hub started'),
+            # Lines split across chunks, and a last line without a newline
+            'input': [TIMESTAMP.encode('utf-8') + b' hel', b'lo\n' + TIMESTAMP.encode('utf-8') + b' bye']
+        })
+        writer = io.StringIO()
+        streamer = LogStreamer(client, ['edgeHubDev', 'input'], follow=False, since=10, tail=5)
+        streamer.run(writer)
+        self.assertEqual(['edgeHubDev | hub started', 'input      | bye', 'input      | hello'],
+                         sorted(writer.getvalue().splitlines()))
+        self.assertEqual(('input', False, 10, 5), sorted(client.calls)[1])
+
+    def test_run_filters_and_writes_json(self):
+        client = _FakeDockerClient({'module': _lines('temperature 21', 'humidity 40', 'temperature 22')})
+        writer = io.StringIO()
+        LogStreamer(client, ['module'], follow=False, pattern=r'^temp', json_output=True).run(writer)
+        records = [json.loads(line) for line in writer.getvalue().splitlines()]
+        self.assertEqual(['temperature 21', 'temperature 22'], [record['message'] for record in records])
+        self.assertEqual({'container': 'module', 'timestamp': TIMESTAMP, 'message': 'temperature 21'}, records[0])
+
+    def test_run_with_timestamps_and_without_prefix(self):
+        client = _FakeDockerClient({'module': _lines('hello')})
+        writer = io.StringIO()
+        LogStreamer(client, ['module'], follow=False, timestamps=True, prefix=False).run(writer)
+        self.assertEqual(TIMESTAMP + ' hello\n', writer.getvalue())
+
+    @mock.patch.object(LogStreamer, 'MAX_LINE_SIZE', 8)
+    def test_long_lines_are_split(self):
+        client = _FakeDockerClient({'module': [TIMESTAMP.encode('utf-8') + b' 0123456789', b'abc\n']})
+        writer = io.StringIO()
+        LogStreamer(client, ['module'], follow=False, prefix=False, timestamps=True).run(writer)
+        self.assertEqual([TIMESTAMP + ' 0123456789', ' abc'], writer.getvalue().splitlines())
+
+    def test_errors_are_collected(self):
+        client = _FakeDockerClient({'module': _lines('hello'), 'gone': Exception('No such container')})
+        writer = io.StringIO()
+        streamer = LogStreamer(client, ['gone', 'module'], follow=False)
+        streamer.run(writer)
+        self.assertEqual({'gone': 'No such container'}, streamer.errors)
+        self.assertEqual('module | hello\n', writer.getvalue())
+
+    @mock.patch.object(LogStreamer, 'QUEUE_SIZE', 16)
+    def test_many_lines_through_bounded_queue(self):
+        client = _FakeDockerClient({
+            'module{0}'.format(index): _lines(*['line {0}'.format(line) for line in range(2000)]) for index in range(4)
+        })
+        writer = io.StringIO()
+        streamer = LogStreamer(client, sorted(client._streams), follow=False)
+        streamer.run(writer)
+        lines = writer.getvalue().splitlines()
+        self.assertEqual(8000, len(lines))
+        self.assertEqual(16, streamer._queue.maxsize)
+        module0 = [line for line in lines if line.startswith('module0 ')]
+        self.assertEqual(['module0 | line {0}'.format(line) for line in range(2000)], module0)
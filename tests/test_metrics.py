@@ -0,0 +1,65 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import unittest
+
+from iotedgehubdev.metrics import Histogram, MetricsRegistry
+
+
+class TestHistogram(unittest.TestCase):
+    def test_empty(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        self.assertIsNone(histogram.mean)
+        self.assertEqual(0, histogram.to_dict()['count'])
+
+    def test_percentiles_within_bucket_precision(self):
+        histogram = Histogram()
+        for i in range(1, 1001):
+            histogram.record(i / 1000.0)
+        self.assertEqual(1000, histogram.count)
+        self.assertAlmostEqual(0.5005, histogram.mean)
+        self.assertEqual(0.001, histogram.min)
+        self.assertEqual(1.0, histogram.max)
+        for percent, expected in [(50, 0.5), (90, 0.9), (99, 0.99)]:
+            self.assertAlmostEqual(expected, histogram.percentile(percent), delta=expected * 0.05)
+        self.assertEqual(1.0, histogram.percentile(100))
+
+    def test_percentile_clamped_to_recorded_range(self):
+        histogram = Histogram()
+        histogram.record(0.25)
+        self.assertEqual(0.25, histogram.percentile(1))
+        self.assertEqual(0.25, histogram.percentile(99))
+
+    def test_merge(self):
+        first = Histogram()
+        second = Histogram()
+        first.record(0.001)
+        second.record(0.1)
+        second.record(0.2)
+        first.merge(second)
+        first.merge(Histogram())
+        self.assertEqual(3, first.count)
+        self.assertEqual(0.001, first.min)
+        self.assertEqual(0.2, first.max)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_timed_records_latency_and_errors(self):
+        registry = MetricsRegistry()
+        with registry.timed('docker info'):
+            pass
+        with self.assertRaises(ValueError):
+            with registry.timed('docker info'):
+                raise ValueError()
+        registry.counter('other').inc(2)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(2, snapshot['latencies']['docker info']['count'])
+        self.assertEqual({'docker info errors': 1, 'other': 2}, snapshot['counters'])
+        lines = registry.format_summary()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[1].startswith('docker info'))
+
+        registry.reset()
+        self.assertEqual({'counters': {}, 'latencies': {}}, registry.snapshot())
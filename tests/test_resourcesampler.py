@@ -0,0 +1,123 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from iotedgehubdev.resourcesampler import ResourceSampler, format_bytes
+
+READ = '2021-06-01T10:00:00.000000000Z'
+
+
+def _stats(total_usage, system_usage, pre_total_usage, pre_system_usage, memory_detail=None, read=READ):
+    return {
+        'read': read,
+        'cpu_stats': {'cpu_usage': {'total_usage': total_usage}, 'system_cpu_usage': system_usage, 'online_cpus': 2},
+        'precpu_stats': {'cpu_usage': {'total_usage': pre_total_usage}, 'system_cpu_usage': pre_system_usage},
+        'memory_stats': {'usage': 100 * 1024 * 1024, 'limit': 1024 * 1024 * 1024,
+                         'stats': memory_detail if memory_detail is not None else {}},
+        'networks': {'eth0': {'rx_bytes': 1000, 'tx_bytes': 500}, 'eth1': {'rx_bytes': 24, 'tx_bytes': 12}},
+        'blkio_stats': {'io_service_bytes_recursive': [
+            {'major': 8, 'minor': 0, 'op': 'Read', 'value': 4096},
+            {'major': 8, 'minor': 0, 'op': 'Write', 'value': 8192},
+            {'major': 8, 'minor': 0, 'op': 'Total', 'value': 12288}
+        ]}
+    }
+
+
+def _sample(cpu, memory, net=0, block=0):
+    return {'cpu': cpu, 'memory': memory, 'memoryLimit': 1024, 'netRx': net, 'netTx': net, 'blockRead': block,
+            'blockWrite': block}
+
+
+class _FakeDockerClient(object):
+    def __init__(self, streams):
+        self._streams = streams
+
+    def stream_container_stats(self, container_name):
+        stream = self._streams[container_name]
+        if isinstance(stream, Exception):
+            raise stream
+        return iter(stream)
+
+
+class TestResourceSampler(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_parse_sample_cgroup_v1(self):
+        sample = ResourceSampler.parse_sample(_stats(300, 2000, 100, 1000, {'total_inactive_file': 10 * 1024 * 1024}))
+        self.assertAlmostEqual(40.0, sample['cpu'])
+        self.assertEqual(90 * 1024 * 1024, sample['memory'])
+        self.assertEqual(1024 * 1024 * 1024, sample['memoryLimit'])
+        self.assertEqual((1024, 512), (sample['netRx'], sample['netTx']))
+        self.assertEqual((4096, 8192), (sample['blockRead'], sample['blockWrite']))
+
+    def test_parse_sample_cgroup_v2(self):
+        sample = ResourceSampler.parse_sample(_stats(300, 2000, 100, 1000, {'inactive_file': 20 * 1024 * 1024}))
+        self.assertEqual(80 * 1024 * 1024, sample['memory'])
+
+    def test_parse_sample_first_of_stream(self):
+        # Docker sends no previous reading with the first sample
+        self.assertEqual(0.0, ResourceSampler.parse_sample(_stats(300, 2000, 0, 0))['cpu'])
+        self.assertEqual(0, ResourceSampler.parse_sample({})['memory'])
+
+    def test_summary(self):
+        sampler = ResourceSampler(None, ['edgeHubDev'])
+        sampler.add_sample('edgeHubDev', _sample(10.0, 100, net=1000, block=50))
+        sampler.add_sample('edgeHubDev', _sample(30.0, 300, net=1500, block=70))
+        sampler.add_sample('edgeHubDev', _sample(20.0, 200, net=4000, block=90))
+        summary = sampler.get_summary()['edgeHubDev']
+        self.assertEqual(3, summary['samples'])
+        self.assertAlmostEqual(20.0, summary['cpuAvg'])
+        self.assertEqual(30.0, summary['cpuPeak'])
+        self.assertEqual(200, summary['memoryAvg'])
+        self.assertEqual(300, summary['memoryPeak'])
+        self.assertEqual((3000, 40), (summary['netRx'], summary['blockWrite']))
+
+    def test_record_csv(self):
+        record_file = os.path.join(self.temp_dir, 'stats.csv')
+        sampler = ResourceSampler(None, ['input', 'edgeHubDev'], record_file)
+        sampler.add_sample('input', _sample(12.345, 100), sample_time=1622541600.5)
+        sampler.add_sample('edgeHubDev', _sample(1.0, 200), sample_time=1622541601)
+        sampler.stop()
+        with open(record_file, newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(ResourceSampler.CSV_COLUMNS, rows[0])
+        self.assertEqual(['1622541600.500', 'input', '12.35', '100', '1024', '0', '0', '0', '0'], rows[1])
+        self.assertEqual('edgeHubDev', rows[2][1])
+
+    def test_read_streams(self):
+        client = _FakeDockerClient({
+            'edgeHubDev': [_stats(0, 0, 0, 0, read='0001-01-01T00:00:00Z'), _stats(300, 2000, 100, 1000)],
+            'gone': Exception('No such container')
+        })
+        sampler = ResourceSampler(client, ['edgeHubDev', 'gone'])
+        sampler._read('edgeHubDev')
+        sampler._read('gone')
+        self.assertEqual(1, sampler.get_summary()['edgeHubDev']['samples'])
+        self.assertEqual({'gone': 'No such container'}, sampler.errors)
+
+    def test_format(self):
+        sampler = ResourceSampler(None, ['edgeHubDev', 'input'])
+        sampler.add_sample('edgeHubDev', _sample(12.5, 3 * 1024 * 1024, net=2048))
+        table = sampler.format_table()
+        self.assertTrue(table[0].startswith('CONTAINER'))
+        self.assertIn('12.50', table[1])
+        self.assertIn('3.0MiB / 1.0KiB', table[1])
+        self.assertEqual(['input', '-'], table[2].split())
+        summary = sampler.format_summary()
+        self.assertEqual(2, len(summary))
+        self.assertIn('12.50%', summary[1])
+
+    def test_format_bytes(self):
+        self.assertEqual('512B', format_bytes(512))
+        self.assertEqual('1.5KiB', format_bytes(1536))
+        self.assertEqual('2.0GiB', format_bytes(2 * 1024 ** 3))
+        self.assertEqual('2048.0GiB', format_bytes(2 * 1024 ** 4))
@@ -0,0 +1,66 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import threading
+import time
+import unittest
+
+from iotedgehubdev.taskgraph import TaskGraph
+
+
+class TestTaskGraph(unittest.TestCase):
+    def test_run_passes_dependency_results(self):
+        graph = TaskGraph()
+        graph.add('a', lambda: 1)
+        graph.add('b', lambda: 2)
+        graph.add('sum', lambda a, b: a + b, ['a', 'b'])
+        graph.add('double', lambda total: total * 2, ['sum'])
+        self.assertEqual({'a': 1, 'b': 2, 'sum': 3, 'double': 6}, graph.run())
+        self.assertEqual(['a', 'b', 'double', 'sum'], sorted(entry['name'] for entry in graph.timeline))
+
+    def test_independent_tasks_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)
+        order = []
+        graph = TaskGraph()
+        # Each task waits for the other one to start, so they only finish when run concurrently
+        graph.add('pull', lambda: barrier.wait())
+        graph.add('identity', lambda: barrier.wait())
+        graph.add('create', lambda *_: order.append('create'), ['pull', 'identity'])
+        graph.run()
+        self.assertEqual(['create'], order)
+        timeline = {entry['name']: entry for entry in graph.timeline}
+        self.assertGreaterEqual(timeline['create']['start'], max(timeline['pull']['end'], timeline['identity']['end']))
+
+    def test_failure_stops_dependents(self):
+        ran = []
+
+        def fail():
+            time.sleep(0.05)
+            raise ValueError('pull failed')
+
+        graph = TaskGraph()
+        graph.add('pull', fail)
+        graph.add('identity', lambda: ran.append('identity'))
+        graph.add('create', lambda *_: ran.append('create'), ['pull', 'identity'])
+        with self.assertRaises(ValueError):
+            graph.run()
+        self.assertEqual(['identity'], ran)
+        self.assertTrue([entry for entry in graph.timeline if entry['name'] == 'pull'][0]['error'])
+
+    def test_add_validates_dependencies(self):
+        graph = TaskGraph()
+        graph.add('a', lambda: None)
+        with self.assertRaises(ValueError):
+            graph.add('a', lambda: None)
+        with self.assertRaises(ValueError):
+            graph.add('b', lambda _: None, ['c'])
+
+    def test_format_timeline(self):
+        lines = TaskGraph.format_timeline([
+            {'name': 'stop', 'start': 0.0, 'end': 0.5},
+            {'name': 'start_hub', 'start': 0.5, 'end': 1.0, 'error': True}
+        ], width=10)
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith('stop'))
+        self.assertTrue(lines[1].endswith('|#####     |'))
+        self.assertTrue(lines[2].endswith('|     xxxxx|'))
@@ -0,0 +1,88 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from iotedgehubdev import tracing
+
+
+class TestTracing(unittest.TestCase):
+    def tearDown(self):
+        tracing.stop()
+
+    def test_disabled_span_is_noop(self):
+        self.assertFalse(tracing.is_enabled())
+        with tracing.span('phase', key='value') as span:
+            self.assertIs(tracing._NULL_SPAN, span)
+
+        @tracing.traced('func')
+        def func(value):
+            return value + 1
+
+        self.assertEqual(2, func(1))
+        self.assertIsNone(tracing.stop())
+
+    @mock.patch('iotedgehubdev.tracing.time.perf_counter')
+    def test_nested_spans_summary(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [0.0, 1.0, 2.0, 4.0, 5.0, 6.0, 10.0]
+        session = tracing.start()
+        with tracing.span('start'):
+            with tracing.span('pull', image='hub'):
+                pass
+            with tracing.span('pull', image='input'):
+                pass
+        self.assertIs(session, tracing.stop())
+
+        summary = session.get_summary()
+        self.assertEqual([('start',), ('start', 'pull')], [row['path'] for row in summary])
+        self.assertEqual((1, 9.0, 6.0, 9.0), tuple(summary[0][key] for key in ['count', 'total', 'self', 'max']))
+        self.assertEqual((2, 3.0, 3.0, 2.0), tuple(summary[1][key] for key in ['count', 'total', 'self', 'max']))
+        lines = session.format_summary()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[2].startswith('  pull '))
+
+    def test_span_records_error(self):
+        session = tracing.start()
+        with self.assertRaises(ValueError):
+            with tracing.span('phase'):
+                raise ValueError()
+        self.assertEqual({'error': 'ValueError'}, session.spans[0].args)
+
+    def test_spans_from_threads_are_not_nested(self):
+        session = tracing.start()
+
+        def _worker():
+            with tracing.span('worker'):
+                pass
+
+        with tracing.span('main'):
+            thread = threading.Thread(target=_worker)
+            thread.start()
+            thread.join()
+        paths = sorted(span.path for span in session.spans)
+        self.assertEqual([('main',), ('worker',)], paths)
+
+    def test_write_chrome_trace(self):
+        session = tracing.start()
+        with tracing.span('docker.pull', image='hub'):
+            pass
+        temp_dir = tempfile.mkdtemp()
+        try:
+            trace_file = os.path.join(temp_dir, 'trace.json')
+            session.write_chrome_trace(trace_file)
+            with open(trace_file) as f:
+                trace = json.load(f)
+        finally:
+            shutil.rmtree(temp_dir)
+        event = trace['traceEvents'][0]
+        self.assertEqual('docker.pull', event['name'])
+        self.assertEqual('docker', event['cat'])
+        self.assertEqual('X', event['ph'])
+        self.assertEqual({'image': 'hub'}, event['args'])
+        self.assertGreaterEqual(event['dur'], 0)
@@ -3,7 +3,10 @@
 
 
 import errno
+import os
+import shutil
 import stat
+import tempfile
 import unittest
 from unittest import mock
 from iotedgehubdev.utils import Utils
@@ -295,3 +298,44 @@ class TestUtilAPIs(unittest.TestCase):
 
         assert Utils.hash_connection_str_hostname("") == ("", "")
         assert Utils.hash_connection_str_hostname(None) == ("", "")
+
+    def test_parse_device_ids(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            device_ids_file = os.path.join(temp_dir, 'devices.csv')
+            with open(device_ids_file, 'w') as f:
+                f.write('deviceId,location\n# comment\n\ndevice2,lab\ndevice3,home\n')
+            self.assertEqual(['device1', 'device2', 'device3'],
+                             Utils.parse_device_ids(' device1 , device2', device_ids_file))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_parse_device_ids_invalid(self):
+        with self.assertRaises(ValueError):
+            Utils.parse_device_ids('device1,../device2', None)
+        self.assertEqual([], Utils.parse_device_ids(None, None))
+
+    def test_write_file_atomic(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(temp_dir, 'docker-compose.yml')
+            Utils.write_file_atomic(file_path, 'version: 1', 0o640)
+            self.assertEqual(0o640, stat.S_IMODE(os.stat(file_path).st_mode))
+            Utils.write_file_atomic(file_path, b'version: 2')
+            self.assertEqual(0o640, stat.S_IMODE(os.stat(file_path).st_mode))
+            with open(file_path) as f:
+                self.assertEqual('version: 2', f.read())
+            self.assertEqual(['docker-compose.yml'], os.listdir(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @mock.patch('os.replace')
+    def test_write_file_atomic_removes_temp_file_on_error(self, mock_replace):
+        mock_replace.side_effect = OSError(errno.EACCES, 'denied')
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(OSError):
+                Utils.write_file_atomic(os.path.join(temp_dir, 'edgehub.json'), '{}')
+            self.assertEqual([], os.listdir(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,69 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from io import BytesIO
+
+from iotedgehubdev.edgedockerclient import EdgeDockerClient
+from iotedgehubdev.volumeseeder import VolumeSeeder
+
+
+class TestVolumeSeeder(unittest.TestCase):
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.source_dir, 'models', 'v1'))
+        self._write('labels.txt', b'cat\ndog\n')
+        self._write(os.path.join('models', 'v1', 'model.onnx'), os.urandom(3000))
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir, ignore_errors=True)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.source_dir, name), 'wb') as f:
+            f.write(data)
+
+    def _extract(self, seeder, progress=None):
+        with tarfile.open(fileobj=BytesIO(b''.join(seeder.iter_archive(progress)))) as tar_file:
+            contents = {member.name: tar_file.extractfile(member).read() for member in tar_file.getmembers()}
+        return contents, json.loads(contents.pop(EdgeDockerClient.SEED_MANIFEST).decode('utf-8'))
+
+    def test_archive_streams_all_files(self):
+        # Small chunks, so the model spans several of them
+        seeder = VolumeSeeder(self.source_dir, chunk_size=1024)
+        progress = []
+        contents, manifest = self._extract(seeder, lambda copied, total: progress.append((copied, total)))
+        self.assertEqual(['labels.txt', 'models/v1/model.onnx'], sorted(contents))
+        with open(os.path.join(self.source_dir, 'models', 'v1', 'model.onnx'), 'rb') as f:
+            self.assertEqual(f.read(), contents['models/v1/model.onnx'])
+        self.assertEqual((3008, 3008), progress[-1])
+        self.assertEqual(4, len(progress))
+        self.assertEqual(3000, manifest['models/v1/model.onnx']['size'])
+        self.assertEqual(64, len(manifest['labels.txt']['sha256']))
+
+    def test_unchanged_files_are_skipped(self):
+        _, manifest = self._extract(VolumeSeeder(self.source_dir))
+
+        seeder = VolumeSeeder(self.source_dir, manifest)
+        self.assertFalse(seeder.needs_copy)
+        self.assertEqual((['labels.txt', 'models/v1/model.onnx'], 3008), (seeder.skipped, seeder.skipped_bytes))
+
+        # Touched without changes, only the manifest is written again
+        labels = os.path.join(self.source_dir, 'labels.txt')
+        os.utime(labels, (0, 0))
+        seeder = VolumeSeeder(self.source_dir, manifest)
+        self.assertTrue(seeder.needs_copy)
+        self.assertEqual([], seeder.files)
+        contents, manifest = self._extract(seeder)
+        self.assertEqual({}, contents)
+        self.assertEqual(0, manifest['labels.txt']['mtime'])
+
+        self._write('labels.txt', b'cat\nfox\n')
+        seeder = VolumeSeeder(self.source_dir, manifest)
+        self.assertEqual(['labels.txt'], [entry[0] for entry in seeder.files])
+        contents, _ = self._extract(seeder)
+        self.assertEqual({'labels.txt': b'cat\nfox\n'}, contents)